@@ -16,6 +16,16 @@ echo "Database is ready!"
 echo "Running database migrations..."
 python manage.py migrate --noinput
 
+# Переносим файлы продаж из корня uploads/ в шарды (повторный запуск ничего не делает)
+echo "Sharding uploads..."
+python manage.py shard_uploads
+
+# Метрики прошлого запуска не должны попасть в новые счётчики
+if [ -n "$SALES_METRICS_DIR" ]; then
+  rm -rf "$SALES_METRICS_DIR"
+  mkdir -p "$SALES_METRICS_DIR"
+fi
+
 # Собираем статические файлы
 echo "Collecting static files..."
 # Убедимся, что директория для статических файлов существует и доступна
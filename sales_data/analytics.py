@@ -0,0 +1,165 @@
+"""
+Агрегаты продаж для /analytics/: число продаж, количество и выручка
+по продукту, клиенту или периоду (день, неделя, месяц).
+
+Продажи из БД агрегируются одним запросом (values + annotate + Trunc*),
+файловые — одним проходом по записям кэша; результаты сливаются по ключу.
+Границы периодов считаются в текущем часовом поясе Django, наивные даты
+из файлов трактуются так же, как их трактует БД.
+
+Если группировка и границы дат укладываются в целые дни, а поиска нет,
+продажи из БД берутся из дневных сводок SaleDailyRollup (см. rollup.py).
+Файловые продажи в том же поясе считаются векторно по колоночному снимку
+(см. columnar.py).
+"""
+
+from datetime import datetime, timedelta
+
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import SaleDailyRollup
+
+
+GROUPINGS = ('product', 'customer', 'day', 'week', 'month')
+
+_TRUNC = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth}
+_FIELDS = {'product': 'product_name', 'customer': 'customer_email'}
+
+
+_REVENUE = ExpressionWrapper(
+    F('quantity') * F('price'), output_field=DecimalField(max_digits=20, decimal_places=2)
+)
+
+
+def _period_start(moment, group_by):
+    day = moment.date()
+    if group_by == 'week':
+        return day - timedelta(days=day.weekday())
+    if group_by == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _key_to_json(key):
+    if isinstance(key, datetime):
+        key = timezone.localtime(key).date() if timezone.is_aware(key) else key.date()
+    return key.isoformat() if hasattr(key, 'isoformat') else key
+
+
+def aggregate_queryset(queryset, group_by):
+    """Агрегаты по продажам из БД: {ключ: [count, quantity, revenue]}."""
+    if group_by in _TRUNC:
+        key = _TRUNC[group_by]('sale_date')
+    else:
+        key = F(_FIELDS[group_by])
+    rows = (
+        queryset.order_by()
+        .annotate(group_key=key)
+        .values('group_key')
+        .annotate(sale_count=Count('id'), quantity_sum=Sum('quantity'), revenue_sum=Sum(_REVENUE))
+    )
+    return {
+        _key_to_json(row['group_key']): [row['sale_count'], row['quantity_sum'] or 0, float(row['revenue_sum'] or 0)]
+        for row in rows
+    }
+
+
+def _whole_day(bound):
+    if bound is None:
+        return True
+    local = timezone.localtime(bound, timezone.get_default_timezone())
+    return local.time() == datetime.min.time()
+
+
+def uses_default_timezone():
+    """Активен ли часовой пояс TIME_ZONE, в котором посчитаны дни сводок и снимков."""
+    return timezone.get_current_timezone_name() == timezone.get_default_timezone_name()
+
+
+def can_use_rollups(query, group_by, date_from=None, date_to=None):
+    """Можно ли ответить по дневным сводкам вместо таблицы Sale."""
+    return (
+        not query
+        and group_by != 'customer'
+        and uses_default_timezone()
+        and _whole_day(date_from)
+        and _whole_day(date_to)
+    )
+
+
+def aggregate_rollups(group_by, date_from=None, date_to=None):
+    """Агрегаты по дневным сводкам БД: {ключ: [count, quantity, revenue]}."""
+    queryset = SaleDailyRollup.objects.all()
+    default_tz = timezone.get_default_timezone()
+    if date_from is not None:
+        queryset = queryset.filter(day__gte=timezone.localtime(date_from, default_tz).date())
+    if date_to is not None:
+        queryset = queryset.filter(day__lt=timezone.localtime(date_to, default_tz).date())
+    key = _TRUNC[group_by]('day') if group_by in _TRUNC else F('product_name')
+    rows = (
+        queryset.order_by()
+        .annotate(group_key=key)
+        .values('group_key')
+        .annotate(sale_count=Sum('sale_count'), quantity_sum=Sum('quantity_sum'), revenue_sum=Sum('revenue_sum'))
+    )
+    return {
+        _key_to_json(row['group_key']): [row['sale_count'], row['quantity_sum'] or 0, float(row['revenue_sum'] or 0)]
+        for row in rows
+    }
+
+
+def _number(value, cast):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def aggregate_records(records, group_by, date_from=None, date_to=None):
+    """Агрегаты по файловым продажам за один проход: {ключ: [count, quantity, revenue]}."""
+    totals = {}
+    by_period = group_by in _TRUNC
+    field = _FIELDS.get(group_by)
+    current_tz = timezone.get_current_timezone()
+    for record in records:
+        sale_date = record.sale_date
+        if isinstance(sale_date, datetime):
+            if timezone.is_naive(sale_date):
+                sale_date = timezone.make_aware(sale_date, current_tz)
+            sale_date = sale_date.astimezone(current_tz)
+        elif by_period or date_from is not None or date_to is not None:
+            # Без корректной даты запись нельзя отнести ни к периоду, ни к диапазону.
+            continue
+        if date_from is not None and sale_date < date_from:
+            continue
+        if date_to is not None and sale_date >= date_to:
+            continue
+
+        key = _period_start(sale_date, group_by).isoformat() if by_period else getattr(record, field)
+        quantity = _number(record.quantity, int)
+        price = _number(record.price, float)
+        bucket = totals.get(key)
+        if bucket is None:
+            totals[key] = [1, quantity, quantity * price]
+        else:
+            bucket[0] += 1
+            bucket[1] += quantity
+            bucket[2] += quantity * price
+    return totals
+
+
+def merge(*parts):
+    """Сливает агрегаты нескольких источников в отсортированный список строк ответа."""
+    merged = {}
+    for part in parts:
+        for key, (count, quantity, revenue) in part.items():
+            bucket = merged.setdefault(key, [0, 0, 0.0])
+            bucket[0] += count
+            bucket[1] += quantity
+            bucket[2] += revenue
+    return [
+        {'key': key, 'count': count, 'quantity': quantity, 'revenue': round(revenue, 2)}
+        for key, (count, quantity, revenue) in sorted(merged.items(), key=lambda item: (item[0] is None, str(item[0])))
+    ]
@@ -0,0 +1,245 @@
+"""
+Нагрузочный прогон представлений на синтетических данных (``manage.py bench_sales``).
+
+Создаёт во временном каталоге uploads/ N файлов продаж (JSON и XML, по
+одной записи и списком) и M строк в таблице Sale, затем прогоняет основные
+представления через тестовый клиент Django и собирает задержки.
+Результат — словарь, пригодный для json.dumps: p50/p95/p99 и среднее в мс,
+пропускная способность в запросах в секунду и пиковый RSS процесса.
+"""
+
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from . import columnar, rollup, shards, views
+from .file_cache import file_cache
+from .models import Sale
+from .sale_index import SaleLocationIndex
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+PRODUCTS = ('Яблоко', 'Банан', 'Груша', 'Apple', 'Orange', 'Laptop', 'Phone', 'Кофе', 'Чай', 'Сыр')
+
+SCENARIOS = (
+    'index', 'search_sales', 'search_sales_q', 'edit_file_sale', 'delete_sale', 'upload_file', 'add_sale',
+)
+
+DB_BATCH_SIZE = 2000
+
+
+def peak_rss_kb():
+    """Пиковый RSS процесса в КиБ или None, если платформа его не сообщает."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В macOS ru_maxrss в байтах, в Linux — в КиБ.
+    return peak // 1024 if os.uname().sysname == 'Darwin' else peak
+
+
+def percentile(sorted_values, fraction):
+    """Процентиль по ближайшему рангу для отсортированного списка."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _sale(rng, i, moment):
+    return {
+        'id': str(uuid.uuid4()),
+        'product_name': f'{rng.choice(PRODUCTS)} {i % 500}',
+        'quantity': rng.randint(1, 20),
+        'price': rng.randint(100, 100000) / 100,
+        'sale_date': (moment - timedelta(minutes=i)).isoformat(),
+        'customer_name': f'Клиент {i % 5000}',
+        'customer_email': f'client{i % 5000}@example.com',
+    }
+
+
+def _fill_xml(elem, sale):
+    for key, value in sale.items():
+        ET.SubElement(elem, key).text = str(value)
+    return elem
+
+
+def _write_file(path, fmt, sales, single):
+    if fmt == 'json':
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(sales[0] if single else sales, f, ensure_ascii=False)
+        return
+    if single:
+        root = _fill_xml(ET.Element('sale'), sales[0])
+    else:
+        root = ET.Element('sales')
+        for sale in sales:
+            _fill_xml(ET.SubElement(root, 'sale'), sale)
+    ET.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def generate_files(directory, count, records_per_file, rng):
+    """Пишет ``count`` файлов по кругу JSON/XML × одна запись/список; возвращает id продаж."""
+    moment = timezone.now()
+    sale_ids = []
+    n = 0
+    for i in range(count):
+        fmt = 'json' if i % 2 == 0 else 'xml'
+        single = i % 4 >= 2
+        sales = [_sale(rng, n + j, moment) for j in range(1 if single else records_per_file)]
+        n += len(sales)
+        _write_file(shards.path_for_write(directory, f'bench_{i:06d}.{fmt}'), fmt, sales, single)
+        sale_ids.extend(sale['id'] for sale in sales)
+    SaleLocationIndex(directory).rebuild()
+    return sale_ids
+
+
+def generate_rows(count, rng):
+    """Добавляет ``count`` продаж в таблицу Sale пачками."""
+    moment = timezone.now()
+    batch = []
+    for i in range(count):
+        data = _sale(rng, i, moment)
+        batch.append(Sale(
+            product_name=data['product_name'], quantity=data['quantity'], price=data['price'],
+            sale_date=moment - timedelta(minutes=i), customer_name=data['customer_name'],
+            customer_email=f'bench{i}@example.com',
+        ))
+        if len(batch) >= DB_BATCH_SIZE:
+            Sale.objects.bulk_create(batch)
+            batch = []
+    Sale.objects.bulk_create(batch)
+    rollup.rebuild()
+
+
+class _Requests:
+    """Запросы сценариев; каждый вызов возвращает ответ тестового клиента."""
+
+    def __init__(self, client, file_sale_ids, rng):
+        self.client = client
+        self.rng = rng
+        # Редактируем первую половину файловых продаж, удаляем вторую.
+        middle = len(file_sale_ids) // 2
+        self.editable = file_sale_ids[:middle] or file_sale_ids
+        self.deletable = list(reversed(file_sale_ids[middle:]))
+        self.counter = 0
+
+    def _next(self):
+        self.counter += 1
+        return self.counter
+
+    def index(self):
+        return self.client.get(reverse('index'))
+
+    def search_sales(self):
+        return self.client.get(reverse('search_sales'))
+
+    def search_sales_q(self):
+        return self.client.get(reverse('search_sales'), {'q': self.rng.choice(PRODUCTS).lower()})
+
+    def edit_file_sale(self):
+        sale_id = self.rng.choice(self.editable)
+        return self.client.post(reverse('edit_file_sale', args=[sale_id]), {
+            'id': sale_id, 'product_name': f'Изменено {self._next()}', 'quantity': 3, 'price': '12.50',
+            'sale_date': '2025-08-04T13:10', 'customer_name': 'Клиент', 'customer_email': 'edit@example.com',
+        })
+
+    def delete_sale(self):
+        if not self.deletable:
+            return None
+        return self.client.get(reverse('delete_sale', args=[self.deletable.pop()]))
+
+    def upload_file(self):
+        sale = _sale(self.rng, self._next(), timezone.now())
+        upload = SimpleUploadedFile('bench_upload.json', json.dumps([sale]).encode('utf-8'))
+        return self.client.post(reverse('upload_file'), {'file': upload})
+
+    def add_sale(self):
+        n = self._next()
+        return self.client.post(reverse('add_sale'), {
+            'product_name': f'Новая продажа {n}', 'quantity': 1, 'price': '5.00',
+            'sale_date': '2025-08-04 13:10', 'customer_name': 'Клиент',
+            'customer_email': f'add{n}@example.com', 'save_to': 'database',
+        })
+
+
+def _measure(request, iterations, warmup):
+    for _ in range(warmup):
+        request()
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        response = request()
+        elapsed = time.perf_counter() - start
+        if response is None:
+            break
+        latencies.append(elapsed * 1000)
+        if response.status_code >= 400:
+            errors += 1
+    total = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'iterations': len(latencies),
+        'errors': errors,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'mean_ms': sum(latencies) / len(latencies) if latencies else None,
+        'throughput_rps': len(latencies) / total if total > 0 else None,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def run(files=200, records_per_file=50, db_rows=10000, iterations=50, warmup=1, scenarios=SCENARIOS, seed=0):
+    """
+    Прогоняет сценарии и возвращает отчёт.
+
+    Файлы создаются во временном каталоге, который подменяет views.UPLOAD_DIR
+    на время прогона; строки Sale пишутся в текущую базу данных, поэтому
+    команда bench_sales запускает прогон на тестовой БД.
+    """
+    rng = random.Random(seed)
+    upload_dir = tempfile.mkdtemp(prefix='bench_sales_')
+    file_cache.clear()
+    columnar.snapshots.clear()
+    try:
+        with mock.patch.object(views, 'UPLOAD_DIR', upload_dir):
+            started = time.perf_counter()
+            file_sale_ids = generate_files(upload_dir, files, records_per_file, rng)
+            generate_rows(db_rows, rng)
+            setup_seconds = time.perf_counter() - started
+
+            requests = _Requests(Client(), file_sale_ids, rng)
+            results = {name: _measure(getattr(requests, name), iterations, warmup) for name in scenarios}
+    finally:
+        file_cache.clear()
+        columnar.snapshots.clear()
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    return {
+        'config': {
+            'files': files, 'records_per_file': records_per_file, 'file_sales': len(file_sale_ids),
+            'db_rows': db_rows, 'iterations': iterations, 'warmup': warmup, 'seed': seed,
+        },
+        'setup_seconds': setup_seconds,
+        'scenarios': results,
+        'peak_rss_kb': peak_rss_kb(),
+    }
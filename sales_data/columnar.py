@@ -0,0 +1,292 @@
+"""
+Колоночный снимок файловых продаж для аналитики.
+
+Снимок строится по всем JSON/XML файлам каталога uploads/ и хранит
+типизированные массивы NumPy, по одному на поле:
+
+* quantity — int32, price_cents — int64 (цена в копейках, фиксированная точка);
+* sale_date — int64, микросекунды от эпохи UTC, и day — int32, номер дня
+  от 1970-01-01 в часовом поясе TIME_ZONE;
+* product_name, customer_name, customer_email — int32 коды словарей,
+  сами словари лежат в meta.json.
+
+Массивы записываются в .npy и открываются через ``mmap_mode='r'``: процессы
+делят страницы файла, а фильтры и суммы считаются векторно, без цикла
+интерпретатора по записям. Снимок лежит в ``uploads/.columnar/<ключ>/``,
+где ключ — хэш имён, mtime и размеров исходных файлов. При изменении
+каталога собирается новый снимок, старые удаляются.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.utils import timezone
+
+from .file_cache import file_cache
+from .shards import iter_entries
+
+
+SNAPSHOT_DIRNAME = '.columnar'
+
+NO_DATE = np.iinfo(np.int64).min
+
+NUMERIC_COLUMNS = {
+    'quantity': np.int32,
+    'price_cents': np.int64,
+    'sale_date': np.int64,
+    'day': np.int32,
+}
+TEXT_COLUMNS = ('product_name', 'customer_name', 'customer_email')
+
+_GROUP_COLUMNS = {'product': 'product_name', 'customer': 'customer_email'}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+_INT32 = np.iinfo(np.int32)
+
+
+def _signature(entries):
+    digest = hashlib.sha1()
+    for name, mtime_ns, size in sorted(entries):
+        digest.update(f'{name}\0{mtime_ns}\0{size}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def directory_signature(directory):
+    """Ключ снимка для текущего состояния каталога (только stat() файлов)."""
+    entries = []
+    for entry in iter_entries(directory):
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((entry.name, st.st_mtime_ns, st.st_size))
+    return _signature(entries)
+
+
+def _aware(moment):
+    # Наивные даты из файлов трактуются в часовом поясе TIME_ZONE.
+    if timezone.is_naive(moment):
+        return timezone.make_aware(moment, timezone.get_default_timezone())
+    return moment
+
+
+def epoch_us(moment):
+    """Микросекунды от эпохи UTC."""
+    return (_aware(moment) - _EPOCH) // _MICROSECOND
+
+
+def _int(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return 0
+    return value if _INT32.min <= value <= _INT32.max else 0
+
+
+def _cents(value):
+    try:
+        return round(float(value) * 100)
+    except (TypeError, ValueError, OverflowError):
+        return 0
+
+
+class _Dictionary:
+    """Словарное кодирование строкового столбца."""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def encode(self, value):
+        if value is not None:
+            value = str(value)
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class ColumnarSnapshot:
+    """Колонки файловых продаж, открытые только для чтения."""
+
+    def __init__(self, path, columns, dictionaries):
+        self.path = path
+        self.columns = columns
+        self.dictionaries = dictionaries
+
+    def __len__(self):
+        return len(self.columns['quantity'])
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        columns = {}
+        for name in list(NUMERIC_COLUMNS) + list(TEXT_COLUMNS):
+            # Пустой файл отобразить в память нельзя, такой столбец читаем целиком.
+            mmap_mode = 'r' if meta['rows'] else None
+            columns[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+        return cls(path, columns, meta['dictionaries'])
+
+    def _text_mask(self, name, query_cf):
+        matches = np.fromiter(
+            (query_cf in (value or '').casefold() for value in self.dictionaries[name]),
+            dtype=bool, count=len(self.dictionaries[name]),
+        )
+        return matches[self.columns[name]]
+
+    def mask(self, query_cf='', date_from=None, date_to=None, require_date=False):
+        """Булев массив записей, прошедших поиск и фильтр по датам [date_from, date_to)."""
+        mask = np.ones(len(self), dtype=bool)
+        if query_cf:
+            mask &= (
+                self._text_mask('product_name', query_cf)
+                | self._text_mask('customer_name', query_cf)
+                | self._text_mask('customer_email', query_cf)
+            )
+        sale_date = self.columns['sale_date']
+        if require_date or date_from is not None or date_to is not None:
+            mask &= sale_date != NO_DATE
+        if date_from is not None:
+            mask &= sale_date >= epoch_us(date_from)
+        if date_to is not None:
+            mask &= sale_date < epoch_us(date_to)
+        return mask
+
+    def _period_keys(self, group_by, mask):
+        days = np.asarray(self.columns['day'][mask], dtype=np.int64)
+        if group_by == 'week':
+            # 1970-01-01 — четверг, понедельник недели на (day + 3) % 7 дней раньше.
+            return days - (days + 3) % 7
+        if group_by == 'month':
+            months = days.astype('datetime64[D]').astype('datetime64[M]')
+            return months.astype('datetime64[D]').astype(np.int64)
+        return days
+
+    def aggregate(self, group_by, query_cf='', date_from=None, date_to=None):
+        """Агрегаты как analytics.aggregate_records: {ключ: [count, quantity, revenue]}."""
+        by_period = group_by in ('day', 'week', 'month')
+        mask = self.mask(query_cf, date_from, date_to, require_date=by_period)
+        if by_period:
+            keys = self._period_keys(group_by, mask)
+        else:
+            keys = np.asarray(self.columns[_GROUP_COLUMNS[group_by]][mask])
+        if not len(keys):
+            return {}
+
+        quantity = np.asarray(self.columns['quantity'][mask], dtype=np.int64)
+        revenue_cents = quantity * self.columns['price_cents'][mask]
+        unique, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(unique))
+        quantities = np.bincount(inverse, weights=quantity, minlength=len(unique))
+        revenues = np.bincount(inverse, weights=revenue_cents, minlength=len(unique)) / 100
+
+        if by_period:
+            labels = [str(day) for day in unique.astype('datetime64[D]')]
+        else:
+            values = self.dictionaries[_GROUP_COLUMNS[group_by]]
+            labels = [values[code] for code in unique]
+        return {
+            label: [int(count), int(total_quantity), float(revenue)]
+            for label, count, total_quantity, revenue in zip(labels, counts, quantities, revenues)
+        }
+
+
+def _write_columns(path, entries):
+    numeric = {name: [] for name in NUMERIC_COLUMNS}
+    codes = {name: [] for name in TEXT_COLUMNS}
+    dictionaries = {name: _Dictionary() for name in TEXT_COLUMNS}
+    default_tz = timezone.get_default_timezone()
+    epoch_day = _EPOCH.date()
+
+    for cached in entries:
+        for record in cached.records:
+            numeric['quantity'].append(_int(record.quantity))
+            numeric['price_cents'].append(_cents(record.price))
+            sale_date = record.sale_date
+            if isinstance(sale_date, datetime):
+                numeric['sale_date'].append(epoch_us(sale_date))
+                local_day = timezone.localtime(_aware(sale_date), default_tz).date()
+                numeric['day'].append((local_day - epoch_day).days)
+            else:
+                numeric['sale_date'].append(NO_DATE)
+                numeric['day'].append(0)
+            for name in TEXT_COLUMNS:
+                codes[name].append(dictionaries[name].encode(getattr(record, name)))
+
+    for name, dtype in NUMERIC_COLUMNS.items():
+        np.save(os.path.join(path, f'{name}.npy'), np.array(numeric[name], dtype=dtype))
+    for name in TEXT_COLUMNS:
+        np.save(os.path.join(path, f'{name}.npy'), np.array(codes[name], dtype=np.int32))
+    meta = {
+        'rows': len(numeric['quantity']),
+        'dictionaries': {name: dictionaries[name].values for name in TEXT_COLUMNS},
+    }
+    with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+
+def build_snapshot(directory):
+    """Собирает снимок по файлам каталога; возвращает путь к нему."""
+    root = os.path.join(directory, SNAPSHOT_DIRNAME)
+    os.makedirs(root, exist_ok=True)
+    entries = file_cache.scan(directory)
+    key = _signature((cached.filename, cached.mtime_ns, cached.size) for cached in entries)
+    path = os.path.join(root, key)
+    if os.path.isdir(path):
+        return path
+
+    tmp_path = tempfile.mkdtemp(prefix='.build-', dir=root)
+    try:
+        _write_columns(tmp_path, entries)
+        os.rename(tmp_path, path)
+    except OSError:
+        # Тот же снимок успел собрать другой процесс.
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    for name in os.listdir(root):
+        if name != key and not name.startswith('.build-'):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    return path
+
+
+class SnapshotStore:
+    """Держит открытым актуальный снимок каталога и пересобирает его по изменениям."""
+
+    def __init__(self):
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def get(self, directory):
+        key = directory_signature(directory)
+        with self._lock:
+            loaded = self._loaded.get(directory)
+            if loaded is not None and loaded[0] == key:
+                return loaded[1]
+            path = os.path.join(directory, SNAPSHOT_DIRNAME, key)
+            if not os.path.isdir(path):
+                path = build_snapshot(directory)
+            snapshot = ColumnarSnapshot.load(path)
+            # Ключ берём из имени каталога: файлы могли измениться во время сборки.
+            self._loaded[directory] = (os.path.basename(path), snapshot)
+            return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._loaded.clear()
+
+
+snapshots = SnapshotStore()
@@ -0,0 +1,94 @@
+"""
+Сжатое хранение загруженных файлов продаж.
+
+При SALES_UPLOAD_COMPRESSION='gzip' upload_file сохраняет загрузку как
+``<имя>.json.gz`` / ``<имя>.xml.gz``, при 'zstd' — как ``.zst`` (нужен пакет
+zstandard; без него загрузки сжимаются gzip). Суффикс сжатия входит в имя
+файла, поэтому уже сохранённые файлы читаются при любой настройке.
+
+Формат файла определяется по расширению под суффиксом (shards.file_format),
+а читатели открывают файлы через open_read: сжатый файл распаковывается
+потоком по мере чтения, целиком в память он не попадает. Правка продажи в
+сжатом файле всегда переписывает его целиком (см. file_writer).
+"""
+
+import gzip
+import io
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import zstandard
+except ImportError:  # необязательная зависимость
+    zstandard = None
+
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+SUFFIXES = {GZIP: '.gz', ZSTD: '.zst'}
+# Повреждённый или оборванный сжатый файл.
+CORRUPT_ERRORS = (EOFError, gzip.BadGzipFile) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def compression_of(filename):
+    """Сжатие файла по суффиксу имени: 'gzip', 'zstd' или None."""
+    for encoding, suffix in SUFFIXES.items():
+        if filename.endswith(suffix):
+            return encoding
+    return None
+
+
+def strip_suffix(filename):
+    """Имя без суффикса сжатия: 'a.json.gz' -> 'a.json'."""
+    encoding = compression_of(filename)
+    return filename[:-len(SUFFIXES[encoding])] if encoding else filename
+
+
+def storage_compression():
+    """Сжатие новых загрузок из SALES_UPLOAD_COMPRESSION: 'gzip', 'zstd' или None."""
+    encoding = getattr(settings, 'SALES_UPLOAD_COMPRESSION', '') or None
+    if encoding is not None and encoding not in SUFFIXES:
+        raise ImproperlyConfigured(f'SALES_UPLOAD_COMPRESSION must be one of: {", ".join(SUFFIXES)}.')
+    if encoding == ZSTD and zstandard is None:
+        return GZIP
+    return encoding
+
+
+def _zstd():
+    if zstandard is None:
+        raise OSError('zstandard is not installed, cannot read .zst files')
+    return zstandard
+
+
+def open_read(path):
+    """Открывает файл продаж на чтение в байтах; сжатый распаковывается на лету."""
+    encoding = compression_of(path)
+    if encoding == GZIP:
+        return gzip.open(path, 'rb')
+    if encoding == ZSTD:
+        reader = _zstd().ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.BufferedReader(reader)
+    return open(path, 'rb')
+
+
+def open_text(path):
+    return io.TextIOWrapper(open_read(path), encoding='utf-8')
+
+
+def writer(out, encoding):
+    """Обёртка над открытым файлом ``out``, сжимающая записываемое; None — без сжатия."""
+    if encoding is None:
+        return out
+    if encoding == GZIP:
+        return gzip.GzipFile(fileobj=out, mode='wb', filename='', mtime=0)
+    return _zstd().ZstdCompressor().stream_writer(out, closefd=False)
+
+
+def compress(data, encoding):
+    """Байты ``data``, сжатые для хранения с ``encoding`` (None — как есть)."""
+    if encoding is None:
+        return data
+    if encoding == GZIP:
+        return gzip.compress(data, mtime=0)
+    return _zstd().ZstdCompressor().compress(data)
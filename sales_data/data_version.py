@@ -0,0 +1,61 @@
+"""
+Версия данных продаж для кэша ответов (см. response_cache).
+
+Счётчик лежит в файле ``uploads/.data_version`` и увеличивается каждым
+путём записи: представлениями, импортом в БД, наблюдателем watch_uploads
+и сжатием сегментов. Файл общий для всех воркеров, поэтому запись в одном
+воркере делает устаревшими закэшированные ответы во всех.
+
+Версия — строка ``<эпоха>:<счётчик>``. Эпоха выбирается при создании
+файла, так что после его удаления (например, на новом томе) счётчик не
+совпадёт с версией, под которой в общем кэше остались старые ответы.
+"""
+
+import os
+import uuid
+
+from . import file_writer
+
+
+VERSION_FILENAME = '.data_version'
+
+
+def _path(directory):
+    return os.path.join(directory, VERSION_FILENAME)
+
+
+def _create(path):
+    # Публикуем файл сразу с содержимым: os.link не заменяет существующий.
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='ascii') as f:
+        f.write(f'{uuid.uuid4().hex[:12]}:0')
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp_path)
+
+
+def current(directory):
+    """Текущая версия данных каталога; файл версии создаётся при первом обращении."""
+    path = _path(directory)
+    try:
+        with open(path, encoding='ascii') as f:
+            return f.read()
+    except FileNotFoundError:
+        _create(path)
+    with open(path, encoding='ascii') as f:
+        return f.read()
+
+
+def bump(directory):
+    """Увеличивает версию данных; возвращает новую."""
+    path = _path(directory)
+    current(directory)
+    with file_writer.locked(path) as st:
+        with open(path, encoding='ascii') as f:
+            epoch, _, counter = f.read().partition(':')
+        version = f'{epoch}:{int(counter) + 1}'
+        file_writer.atomic_write(path, version.encode('ascii'), st)
+    return version
@@ -0,0 +1,87 @@
+"""
+Разбор дат продаж из файлов.
+
+Поддерживаются ISO 8601 (то, что пишут сами представления через
+``isoformat()``: ``2025-08-04T13:10:00+00:00``, а также варианты без
+секунд, с пробелом вместо ``T`` и с ``Z``) и ``дд.мм.гггг чч:мм``.
+
+Форматы проверяются по форме строки до разбора, поэтому неподходящий
+формат не стоит исключения. DateParser запоминает формат, который
+сработал последним, и пробует его первым: внутри одного файла или
+источника даты обычно записаны одинаково. Нераспознанные значения
+возвращаются как есть.
+"""
+
+import re
+from datetime import datetime
+
+
+_DOTTED = re.compile(r'(\d{2})\.(\d{2})\.(\d{4}) (\d{2}):(\d{2})')
+
+
+def _parse_iso(value):
+    if len(value) < 8 or not value[:4].isdigit():
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _parse_dotted(value):
+    match = _DOTTED.fullmatch(value)
+    if match is None:
+        return None
+    day, month, year, hour, minute = map(int, match.groups())
+    try:
+        return datetime(year, month, day, hour, minute)
+    except ValueError:
+        return None
+
+
+_PARSERS = (_parse_iso, _parse_dotted)
+
+
+class DateParser:
+    """Разбор дат одного файла или источника с запоминанием формата."""
+
+    __slots__ = ('_last',)
+
+    def __init__(self):
+        self._last = _parse_iso
+
+    def parse(self, value):
+        """Разбирает дату из строки; нераспознанные значения возвращает как есть."""
+        if not value or not isinstance(value, str):
+            return value
+        result = self._last(value)
+        if result is not None:
+            return result
+        for parser in _PARSERS:
+            if parser is not self._last:
+                result = parser(value)
+                if result is not None:
+                    self._last = parser
+                    return result
+        return value
+
+    def parse_many(self, values):
+        """Разбирает столбец значений; результат в том же порядке."""
+        result = []
+        append = result.append
+        fromisoformat = datetime.fromisoformat
+        for value in values:
+            # Пока столбец в ISO, разбираем без проверок формы и лишних вызовов.
+            if self._last is _parse_iso:
+                try:
+                    append(fromisoformat(value))
+                    continue
+                except (TypeError, ValueError):
+                    pass
+            append(self.parse(value))
+        return result
+
+
+def parse_date(value):
+    """Разбирает одну дату без учёта соседних значений."""
+    return DateParser().parse(value)
@@ -0,0 +1,266 @@
+"""
+Отдача файлов uploads/ для download_file.
+
+Файл не читается в память воркера: под WSGI тело уходит через FileResponse
+и wsgi.file_wrapper (sendfile). Под ASGI sendfile нет, поэтому ответ —
+StreamingHttpResponse над асинхронным генератором, который читает файл
+блоками по BLOCK_SIZE в пуле потоков.
+
+Поддерживается один диапазон Range (``bytes=a-b``, ``bytes=a-``,
+``bytes=-n``) с If-Range по ETag: ответ 206 с Content-Range или 416, если
+диапазон начинается за концом файла. На несколько диапазонов в одном
+запросе отдаётся весь файл — RFC 9110 это разрешает.
+
+Рядом с файлом может лежать его сжатая копия ``.<имя>.gz`` (её пишет
+``manage.py precompress_uploads``). Она отдаётся с Content-Encoding: gzip
+клиентам, принимающим gzip, пока её mtime совпадает с mtime файла: любая
+правка файла сдвигает mtime, и копия считается устаревшей.
+
+Файл, хранящийся сжатым (см. compressed), отдаётся как есть с
+Content-Encoding, если клиент принимает это сжатие, иначе распаковывается
+на лету — без Content-Length и без поддержки Range.
+"""
+
+import asyncio
+import gzip
+import os
+import re
+import shutil
+import tempfile
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import content_disposition_header
+
+from . import compressed
+
+
+CONTENT_TYPE = 'application/octet-stream'
+
+# Размер блока, которым файл читается под ASGI.
+BLOCK_SIZE = 64 * 1024
+
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def variant_path(path):
+    """Путь сжатой копии файла: скрытый файл в том же каталоге."""
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f'.{filename}.gz')
+
+
+def accepts(accept_encoding, encoding):
+    """Принимает ли клиент с заголовком Accept-Encoding ``accept_encoding`` сжатие ``encoding``."""
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        if coding.strip().lower() not in (encoding, '*'):
+            continue
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        return True
+    return False
+
+
+class _Decompressed:
+    """Распакованное содержимое сжатого файла; без fileno(), поэтому отдаётся блоками."""
+
+    def __init__(self, f):
+        self._file = f
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def close(self):
+        self._file.close()
+
+
+def open_file(path, accept_encoding=''):
+    """
+    Открывает файл для отдачи.
+
+    Возвращает (файл, stat исходного файла, Content-Encoding или None). Файл,
+    хранящийся сжатым, открывается как есть, если клиент принимает его
+    сжатие, иначе — с распаковкой на лету. Для несжатого файла, если клиент
+    принимает gzip и есть свежая сжатая копия, открыта она.
+    """
+    f = open(path, 'rb')
+    st = os.fstat(f.fileno())
+    encoding = compressed.compression_of(path)
+    if encoding is not None:
+        if accepts(accept_encoding, encoding):
+            return f, st, encoding
+        f.close()
+        return _Decompressed(compressed.open_read(path)), st, None
+    if not accepts(accept_encoding, compressed.GZIP):
+        return f, st, None
+    try:
+        variant = open(variant_path(path), 'rb')
+    except FileNotFoundError:
+        return f, st, None
+    if os.fstat(variant.fileno()).st_mtime_ns != st.st_mtime_ns:
+        variant.close()
+        return f, st, None
+    f.close()
+    return variant, st, compressed.GZIP
+
+
+def parse_range(header, size):
+    """
+    Диапазон из заголовка Range: (начало, конец включительно) или None,
+    если заголовок не разобран и отдаётся весь файл.
+
+    RangeNotSatisfiable — диапазон за концом файла.
+    """
+    match = _RANGE.fullmatch(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        if int(last) == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+class _FileRange:
+    """Часть открытого файла: read() не выходит за конец диапазона, fileno() — для sendfile."""
+
+    def __init__(self, f, start, length):
+        f.seek(start)
+        self._file = f
+        self._left = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self._left:
+            size = self._left
+        data = self._file.read(size)
+        self._left -= len(data)
+        return data
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+
+
+def _requested_range(request, size, etag):
+    header = request.headers.get('Range')
+    if not header or request.method not in ('GET', 'HEAD'):
+        return None
+    # If-Range с датой не поддерживаем: такой запрос получает весь файл.
+    if_range = request.headers.get('If-Range')
+    if if_range is not None and if_range.strip() != etag:
+        return None
+    return parse_range(header, size)
+
+
+async def _read_blocks(f):
+    try:
+        while block := await asyncio.to_thread(f.read, BLOCK_SIZE):
+            yield block
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+def _body_response(request, f, filename, length=None):
+    """Ответ с телом из файла f: FileResponse под WSGI, асинхронный поток блоков под ASGI."""
+    if not isinstance(request, ASGIRequest):
+        return FileResponse(f, as_attachment=True, filename=filename, content_type=CONTENT_TYPE)
+    response = StreamingHttpResponse(_read_blocks(f), content_type=CONTENT_TYPE)
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    if length is not None:
+        response['Content-Length'] = length
+    return response
+
+
+def file_response(request, f, filename, etag, encoding=None):
+    """Ответ 200, 206 или 416 для файла из open_file; файл закрывается вместе с ответом."""
+    # Клиент сохраняет распакованное содержимое: имя без суффикса сжатия.
+    filename = compressed.strip_suffix(filename)
+    if isinstance(f, _Decompressed):
+        # Размер распакованного содержимого заранее неизвестен.
+        response = _body_response(request, f, filename)
+        response['Accept-Ranges'] = 'none'
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+    size = os.fstat(f.fileno()).st_size
+    try:
+        span = _requested_range(request, size, etag)
+    except RangeNotSatisfiable:
+        f.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if span is None:
+        response = _body_response(request, f, filename, size)
+    else:
+        start, end = span
+        response = _body_response(request, _FileRange(f, start, end - start + 1), filename)
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    if encoding is not None:
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+def precompress(path):
+    """
+    Пишет сжатую копию файла рядом с ним.
+
+    Возвращает размер копии или None, если файл изменился во время сжатия.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.gzip-', suffix='.part')
+    try:
+        with open(path, 'rb') as src, os.fdopen(fd, 'wb') as raw:
+            st = os.fstat(src.fileno())
+            with gzip.GzipFile(fileobj=raw, mode='wb', filename='', mtime=0) as gz:
+                shutil.copyfileobj(src, gz, 1024 * 1024)
+        current = os.stat(path)
+        if (current.st_ino, current.st_mtime_ns, current.st_size) != (st.st_ino, st.st_mtime_ns, st.st_size):
+            os.remove(tmp_path)
+            return None
+        # Копия свежая, пока её mtime совпадает с mtime файла (см. open_file).
+        os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_path, variant_path(path))
+        return os.path.getsize(variant_path(path))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def is_fresh(path):
+    """Есть ли у файла сжатая копия с тем же mtime."""
+    try:
+        return os.stat(variant_path(path)).st_mtime_ns == os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def remove_variant(path):
+    try:
+        os.remove(variant_path(path))
+    except FileNotFoundError:
+        pass
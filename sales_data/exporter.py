@@ -0,0 +1,120 @@
+"""
+Потоковая выгрузка продаж из БД в JSON, XML или CSV.
+
+Строки читаются серверным курсором (``.iterator()``) в виде кортежей,
+без создания экземпляров модели, и сразу сериализуются; при gzip сжатие
+тоже идёт по кускам. Память не зависит от размера таблицы.
+JSON и XML совпадают по структуре с файлами, которые принимает upload_file.
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, time, timedelta
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Sale
+from .streaming import buffered
+
+
+EXPORT_FIELDS = ('id', 'product_name', 'quantity', 'price', 'sale_date', 'customer_name', 'customer_email')
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'xml': 'application/xml',
+    'csv': 'text/csv',
+}
+
+
+def parse_bound(value, end=False):
+    """
+    Граница диапазона дат из параметра запроса: дата или дата-время ISO.
+
+    Для даты без времени правая граница включает весь день.
+    """
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        day = moment = None
+    if day is not None:
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    elif moment is None:
+        raise ValueError(f'Invalid date: {value}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_queryset(query='', date_from=None, date_to=None):
+    """Продажи для выгрузки: поиск как в search_sales и полуинтервал [date_from, date_to)."""
+    queryset = Sale.objects.search(query)
+    if date_from is not None:
+        queryset = queryset.filter(sale_date__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(sale_date__lt=date_to)
+    return queryset.order_by('sale_date', 'id')
+
+
+def _rows(queryset, chunk_size):
+    for sale_id, product_name, quantity, price, sale_date, customer_name, customer_email in (
+        queryset.values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    ):
+        yield (str(sale_id), product_name, quantity, float(price), sale_date.isoformat(),
+               customer_name, customer_email)
+
+
+def _iter_json(rows):
+    yield '['
+    for i, row in enumerate(rows):
+        record = json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False)
+        yield ('\n' if not i else ',\n') + record
+    yield '\n]\n'
+
+
+def _iter_xml(rows):
+    yield "<?xml version='1.0' encoding='utf-8'?>\n<sales>"
+    for row in rows:
+        yield '<sale>' + ''.join(
+            f'<{field}>{escape(str(value))}</{field}>' for field, value in zip(EXPORT_FIELDS, row)
+        ) + '</sale>\n'
+    yield '</sales>\n'
+
+
+def _iter_csv(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow(row)
+        if out.tell() >= 64 * 1024:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+
+
+_WRITERS = {'json': _iter_json, 'xml': _iter_xml, 'csv': _iter_csv}
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_export(queryset, fmt, compress=False):
+    """Генератор байтов выгрузки в формате ``fmt``, при необходимости в gzip."""
+    chunk_size = getattr(settings, 'SALES_STREAM_CHUNK_SIZE', 2000)
+    chunks = buffered(_WRITERS[fmt](_rows(queryset, chunk_size)))
+    return gzip_chunks(chunks) if compress else chunks
@@ -0,0 +1,316 @@
+"""
+Кэш разобранных файлов продаж из каталога uploads/.
+
+Каждый элемент кэша хранит продажи одного файла (SaleData) вместе с
+(mtime, size) на момент разбора. При обходе каталога файл перечитывается
+только если его (mtime, size) изменились, а элементы удалённых файлов
+выбрасываются. Объём кэша ограничен числом файлов и записей, при
+переполнении вытесняются давно не использованные файлы (LRU).
+
+Обход каталога (iter_scan, aiter_scan, parallel) в полный кэш новые файлы
+не добавляет и ничего не вытесняет: иначе каталог больше лимита при каждом
+обходе вытеснял бы сам себя и ни один файл не доживал бы до следующего.
+Так между обходами остаются в кэше уже попавшие в него файлы, а остальные
+разбираются заново. Одиночные чтения (get) вытесняют по LRU, как обычно.
+
+Записи в кэше общие для всех запросов процесса: представления не должны
+их изменять, а при необходимости правки берут копию через ``to_dict()``.
+
+Если рядом с файлами есть хранилище watch_uploads (upload_store), продажи
+изменившегося файла сначала ищутся там и разбираются, только если
+хранилище отстало.
+
+Асинхронные представления обходят каталог через ``aiter_scan``: stat() и
+разбор файлов выполняются в общем ограниченном пуле потоков
+(SALES_FILE_PARSE_WORKERS), файлы выдаются по мере готовности; в пуле
+одновременно не больше SCAN_IN_FLIGHT_PER_WORKER файлов на поток.
+"""
+
+import asyncio
+import functools
+import os
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+
+from .compressed import CORRUPT_ERRORS, open_read, open_text
+from .dates import DateParser
+from .metrics import note_file_records
+from .models import SaleData
+from .segments import read_segment
+from .shards import file_format, iter_entries, root_of
+from .upload_store import store_for
+
+
+CachedFile = namedtuple('CachedFile', 'filename path format mtime_ns size records')
+FileStat = namedtuple('FileStat', 'path filename format stat')
+
+# Сколько файлов на поток parse_pool() aiter_scan отдаёт в пул наперёд.
+SCAN_IN_FLIGHT_PER_WORKER = 2
+
+
+def _sales(items):
+    """SaleData из словарей продаж одного файла; даты разобраны одним проходом."""
+    sales = [SaleData.from_dict(item) for item in items]
+    dates = DateParser().parse_many([sale.sale_date for sale in sales])
+    for sale, sale_date in zip(sales, dates):
+        sale.sale_date = sale_date
+    return sales
+
+
+def _with_numbers(sale):
+    # В XML все значения строковые (и в сегментах, куда сжатие перенесло записи из XML);
+    # числовые поля приводим к числам там, где это возможно.
+    for key, cast in (('quantity', int), ('price', float)):
+        value = sale.get(key)
+        if isinstance(value, str):
+            try:
+                sale[key] = cast(value)
+            except ValueError:
+                pass
+    return sale
+
+
+def _xml_to_dict(elem):
+    return _with_numbers({child.tag: child.text for child in elem})
+
+
+def parse_sale_file(filepath, fmt):
+    """
+    Разбирает JSON/XML файл и возвращает список продаж SaleData.
+
+    Повреждённые файлы дают пустой список, как и раньше в представлениях.
+    """
+    if fmt == 'ndjson':
+        records, _ = read_segment(filepath)
+        return _sales(_with_numbers(record) for record in records)
+    if fmt == 'json':
+        try:
+            with open_text(filepath) as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, UnicodeDecodeError) + CORRUPT_ERRORS:
+            return []
+        if isinstance(data, dict):
+            return _sales([data])
+        if isinstance(data, list):
+            return _sales(item for item in data if isinstance(item, dict))
+        return []
+
+    try:
+        with open_read(filepath) as f:
+            root = ET.parse(f).getroot()
+    except (ET.ParseError,) + CORRUPT_ERRORS:
+        return []
+    if root.tag == 'sale':
+        return _sales([_xml_to_dict(root)])
+    return _sales(_xml_to_dict(elem) for elem in root.findall('sale'))
+
+
+def _stored_records(path, filename, st):
+    store = store_for(root_of(path))
+    if store is None:
+        return None
+    try:
+        return store.load(filename, st.st_mtime_ns, st.st_size)
+    except sqlite3.Error:
+        return None
+
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def parse_workers():
+    return getattr(settings, 'SALES_FILE_PARSE_WORKERS', 4)
+
+
+def parse_pool():
+    """Общий пул потоков процесса для чтения и разбора файлов из асинхронного кода."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ThreadPoolExecutor(max_workers=parse_workers(), thread_name_prefix='sales-parse')
+        return _parse_pool
+
+
+class FileRecordCache:
+    """Потокобезопасный LRU-кэш разобранных файлов продаж."""
+
+    def __init__(self, max_files=None, max_records=None):
+        self.max_files = max_files
+        self.max_records = max_records
+        self._entries = OrderedDict()
+        self._record_count = 0
+        self._lock = threading.Lock()
+
+    def _limits(self):
+        max_files = self.max_files or getattr(settings, 'SALES_FILE_CACHE_MAX_FILES', 10000)
+        max_records = self.max_records or getattr(settings, 'SALES_FILE_CACHE_MAX_RECORDS', 200000)
+        return max_files, max_records
+
+    def _store(self, cached, scan=False):
+        max_files, max_records = self._limits()
+        if scan and cached.path not in self._entries and self._entries and (
+            len(self._entries) >= max_files or self._record_count + len(cached.records) > max_records
+        ):
+            # Кэш полон: обход не вытесняет файлы, попавшие в кэш раньше.
+            return
+
+        old = self._entries.pop(cached.path, None)
+        if old is not None:
+            self._record_count -= len(old.records)
+        self._entries[cached.path] = cached
+        self._record_count += len(cached.records)
+
+        # Последний добавленный файл не вытесняем, даже если он один больше лимита.
+        while len(self._entries) > 1 and (
+            len(self._entries) > max_files or self._record_count > max_records
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            self._record_count -= len(evicted.records)
+
+    def _fresh(self, path, st):
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached.mtime_ns == st.st_mtime_ns and cached.size == st.st_size:
+                self._entries.move_to_end(path)
+                return cached
+        return None
+
+    def _load(self, path, filename, fmt, st, scan=False):
+        """Возвращает (CachedFile, разобран_заново) без учёта в метриках запроса."""
+        cached = self._fresh(path, st)
+        if cached is not None:
+            return cached, False
+
+        records = _stored_records(path, filename, st)
+        if records is None:
+            records = parse_sale_file(path, fmt)
+        cached = CachedFile(filename, path, fmt, st.st_mtime_ns, st.st_size, records)
+        self.store(cached, scan=scan)
+        return cached, True
+
+    def _lookup(self, path, filename, fmt, st, scan=False):
+        cached, parsed = self._load(path, filename, fmt, st, scan)
+        note_file_records(len(cached.records), parsed=parsed)
+        return cached
+
+    def peek(self, file):
+        """CachedFile для FileStat, если он в кэше и не изменился, иначе None (без разбора)."""
+        cached = self._fresh(file.path, file.stat)
+        if cached is not None:
+            note_file_records(len(cached.records), parsed=False)
+        return cached
+
+    def lookup(self, file, scan=False):
+        """
+        CachedFile для FileStat из listing(); при необходимости файл разбирается.
+
+        ``scan`` — чтение в ходе обхода каталога: в полный кэш файл не попадает.
+        """
+        return self._lookup(*file, scan=scan)
+
+    def store(self, cached, scan=False):
+        """Кладёт в кэш CachedFile, разобранный в другом месте (``scan`` — как в lookup)."""
+        with self._lock:
+            self._store(cached, scan)
+
+    def get(self, path):
+        """Возвращает CachedFile для одного файла или None, если файла нет."""
+        fmt = file_format(path)
+        if fmt is None:
+            return None
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(path)
+            return None
+        return self._lookup(path, os.path.basename(path), fmt, st)
+
+    def iter_scan(self, directory):
+        """
+        Лениво обходит каталог и выдаёт CachedFile для каждого JSON/XML файла.
+
+        В установившемся режиме это только stat() по каждому файлу. Элементы
+        удалённых файлов выбрасываются, когда обход доходит до конца.
+        """
+        seen = set()
+        for file in self.listing(directory):
+            seen.add(file.path)
+            yield self._lookup(*file, scan=True)
+        self.prune(directory, seen)
+
+    async def aiter_scan(self, directory):
+        """
+        Асинхронный вариант iter_scan: CachedFile выдаются в порядке готовности.
+
+        Листинг каталога и разбор изменившихся файлов идут в parse_pool(),
+        поэтому цикл событий не ждёт диска. В пул отдаётся не больше окна
+        файлов, следующий — когда готов один из них. Если потребитель прервал
+        обход, ещё не начатые задачи отменяются, а удалённые файлы не выбрасываются.
+        """
+        loop = asyncio.get_running_loop()
+        pool = parse_pool()
+        listing = await loop.run_in_executor(pool, lambda: list(self.listing(directory)))
+        window = parse_workers() * SCAN_IN_FLIGHT_PER_WORKER
+        files = iter(listing)
+        pending = set()
+        try:
+            while True:
+                for file in files:
+                    pending.add(loop.run_in_executor(pool, functools.partial(self._load, *file, scan=True)))
+                    if len(pending) >= window:
+                        break
+                if not pending:
+                    break
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in finished:
+                    cached, parsed = future.result()
+                    note_file_records(len(cached.records), parsed=parsed)
+                    yield cached
+        finally:
+            for future in pending:
+                future.cancel()
+        self.prune(directory, {file.path for file in listing})
+
+    def listing(self, directory):
+        """FileStat файлов продаж каталога и его шардов (см. shards.iter_entries); файлы не читаются."""
+        for entry in iter_entries(directory):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            yield FileStat(entry.path, entry.name, file_format(entry.name), st)
+
+    def scan(self, directory):
+        """Список CachedFile для всех JSON/XML файлов каталога (см. iter_scan)."""
+        return list(self.iter_scan(directory))
+
+    def prune(self, directory, seen):
+        """Выбрасывает элементы файлов каталога, которых нет в ``seen`` (удалённые)."""
+        prefix = os.path.join(directory, '')
+        with self._lock:
+            stale = [p for p in self._entries if p.startswith(prefix) and p not in seen]
+            for path in stale:
+                self._record_count -= len(self._entries.pop(path).records)
+
+    def invalidate(self, path):
+        with self._lock:
+            cached = self._entries.pop(path, None)
+            if cached is not None:
+                self._record_count -= len(cached.records)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._record_count = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+file_cache = FileRecordCache()
@@ -0,0 +1,299 @@
+"""
+Правка отдельных продаж в файлах uploads/ из нескольких воркеров сервера.
+
+Каждая правка читает и меняет файл под исключительной блокировкой этого
+файла (fcntl.flock), поэтому одновременные правки разных продаж одного
+файла из разных воркеров не теряются. Файл переписывается через
+временный файл в том же каталоге и os.replace: читатели без блокировки
+(кэш файлов, наблюдатель) видят либо старую, либо новую версию целиком.
+Блокировка берётся на сам файл; если пока мы ждали, его заменили
+переименованием, блокировка берётся заново уже на новый файл.
+
+В JSON-списке от SALES_INPLACE_MIN_BYTES правка одной продажи пишется на
+место по смещению в байтах, если новая запись не длиннее старой (остаток
+добивается пробелами), а удалённая запись вместе с запятой затирается
+пробелами — мегабайтный файл не переписывается ради одной записи. XML и
+сжатые файлы (см. compressed) всегда переписываются целиком, сжатые — с
+тем же сжатием.
+
+После записи mtime файла строго растёт, даже если размер не изменился и
+часы не успели сдвинуться: кэш файлов и хранилище сверяют (mtime, size).
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .compressed import compress, compression_of, open_read
+from .downloads import remove_variant
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка действует только внутри процесса
+    fcntl = None
+
+
+_process_lock = threading.RLock()
+
+
+@contextmanager
+def locked(path):
+    """
+    Исключительная блокировка файла ``path``; возвращает его os.stat_result.
+
+    FileNotFoundError — файла нет (например, его удалили, пока мы ждали).
+    """
+    if fcntl is None:
+        with _process_lock:
+            yield os.stat(path)
+        return
+    while True:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            st = os.fstat(fd)
+            current = os.stat(path)
+        except BaseException:
+            os.close(fd)
+            raise
+        if (current.st_dev, current.st_ino) == (st.st_dev, st.st_ino):
+            break
+        os.close(fd)
+    try:
+        yield st
+    finally:
+        os.close(fd)
+
+
+def _touch(path, previous):
+    """Делает mtime файла строго больше прежнего ``previous`` (os.stat_result)."""
+    mtime_ns = max(time.time_ns(), previous.st_mtime_ns + 1)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def atomic_write(path, data, previous=None):
+    """
+    Заменяет содержимое файла байтами ``data`` через временный файл и os.replace.
+
+    Вызывается под locked(path); ``previous`` — stat файла до правки.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.write-', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if previous is not None:
+            os.chmod(tmp_path, previous.st_mode & 0o777)
+            _touch(tmp_path, previous)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_at(path, offset, data, previous):
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    _touch(path, previous)
+
+
+def _inplace_min_bytes():
+    return getattr(settings, 'SALES_INPLACE_MIN_BYTES', 1024 * 1024)
+
+
+def json_list_spans(text):
+    """
+    Границы элементов JSON-массива ``text``: список (начало, конец, значение)
+    в символах. ValueError — это не массив или он повреждён.
+    """
+    decoder = json.JSONDecoder()
+    spans = []
+    pos = _skip_space(text, 0)
+    if not text.startswith('[', pos):
+        raise ValueError('JSON list expected')
+    pos = _skip_space(text, pos + 1)
+    if text.startswith(']', pos):
+        return spans
+    while True:
+        value, end = decoder.raw_decode(text, pos)
+        spans.append((pos, end, value))
+        pos = _skip_space(text, end)
+        if text.startswith(']', pos):
+            return spans
+        if not text.startswith(',', pos):
+            raise ValueError(f'Expecting "," at char {pos}')
+        pos = _skip_space(text, pos + 1)
+
+
+def _skip_space(text, pos):
+    while pos < len(text) and text[pos] in ' \t\r\n':
+        pos += 1
+    return pos
+
+
+def _find(spans, sale_id):
+    for number, (_, _, value) in enumerate(spans):
+        if isinstance(value, dict) and value.get('id') == sale_id:
+            return number
+    return None
+
+
+def _byte_offset(text, pos):
+    return len(text[:pos].encode('utf-8'))
+
+
+def _read(path):
+    with open_read(path) as f:
+        return f.read()
+
+
+def _stored(path, data):
+    """Байты для записи в файл ``path``: сжатый файл остаётся сжатым."""
+    return compress(data, compression_of(path))
+
+
+def _inplace(path, raw):
+    return compression_of(path) is None and len(raw) >= _inplace_min_bytes()
+
+
+def _dump_json(data):
+    return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+def update_json_record(path, sale_id, record):
+    """Заменяет продажу ``sale_id`` в JSON-файле записью ``record``; True, если она нашлась."""
+    with locked(path) as st:
+        raw = _read(path)
+        text = raw.decode('utf-8')
+        try:
+            spans = json_list_spans(text)
+        except ValueError:
+            data = json.loads(text)
+            if not (isinstance(data, dict) and data.get('id') == sale_id):
+                return False
+            atomic_write(path, _stored(path, _dump_json(record)), st)
+            return True
+        number = _find(spans, sale_id)
+        if number is None:
+            return False
+        start, end, _ = spans[number]
+        if _inplace(path, raw):
+            new = json.dumps(record, ensure_ascii=False).encode('utf-8')
+            offset = _byte_offset(text, start)
+            old_length = _byte_offset(text, end) - offset
+            if len(new) <= old_length:
+                _write_at(path, offset, new + b' ' * (old_length - len(new)), st)
+                return True
+        data = [value for _, _, value in spans]
+        data[number] = record
+        atomic_write(path, _stored(path, _dump_json(data)), st)
+        return True
+
+
+def delete_json_record(path, sale_id):
+    """
+    Удаляет продажу ``sale_id`` из JSON-файла.
+
+    Возвращает 'removed' (файл с одной продажей удалён), 'deleted' или None,
+    если продажи в файле нет.
+    """
+    with locked(path) as st:
+        raw = _read(path)
+        text = raw.decode('utf-8')
+        try:
+            spans = json_list_spans(text)
+        except ValueError:
+            data = json.loads(text)
+            if isinstance(data, dict) and data.get('id') == sale_id:
+                os.remove(path)
+                remove_variant(path)
+                return 'removed'
+            return None
+        number = _find(spans, sale_id)
+        if number is None:
+            return None
+        if _inplace(path, raw):
+            # Затираем запись вместе с запятой, которая отделяет её от соседней.
+            if number + 1 < len(spans):
+                start, end = spans[number][0], spans[number + 1][0]
+            elif number > 0:
+                start, end = spans[number - 1][1], spans[number][1]
+            else:
+                start, end = spans[number][0], spans[number][1]
+            offset = _byte_offset(text, start)
+            _write_at(path, offset, b' ' * (_byte_offset(text, end) - offset), st)
+            return 'deleted'
+        data = [value for i, (_, _, value) in enumerate(spans) if i != number]
+        atomic_write(path, _stored(path, _dump_json(data)), st)
+        return 'deleted'
+
+
+def _xml_bytes(path, tree):
+    return _stored(path, ET.tostring(tree.getroot(), encoding='utf-8', xml_declaration=True))
+
+
+def _parse_xml(path):
+    with open_read(path) as f:
+        return ET.parse(f)
+
+
+def _set_xml_fields(elem, data):
+    for key, value in data.items():
+        child = elem.find(key)
+        if child is None:
+            child = ET.SubElement(elem, key)
+        child.text = str(value)
+
+
+def _xml_sale(root, sale_id):
+    for sale_elem in root.findall('sale'):
+        id_elem = sale_elem.find('id')
+        if id_elem is not None and id_elem.text == sale_id:
+            return sale_elem
+    return None
+
+
+def update_xml_record(path, sale_id, record):
+    """Заменяет поля продажи ``sale_id`` в XML-файле; True, если она нашлась."""
+    with locked(path) as st:
+        tree = _parse_xml(path)
+        root = tree.getroot()
+        id_elem = root.find('id')
+        if root.tag == 'sale' and id_elem is not None and id_elem.text == sale_id:
+            elem = root
+        else:
+            elem = _xml_sale(root, sale_id)
+        if elem is None:
+            return False
+        _set_xml_fields(elem, record)
+        atomic_write(path, _xml_bytes(path, tree), st)
+        return True
+
+
+def delete_xml_record(path, sale_id):
+    """Удаляет продажу ``sale_id`` из XML-файла; результат как у delete_json_record."""
+    with locked(path) as st:
+        tree = _parse_xml(path)
+        root = tree.getroot()
+        id_elem = root.find('id')
+        if root.tag == 'sale' and id_elem is not None and id_elem.text == sale_id:
+            os.remove(path)
+            remove_variant(path)
+            return 'removed'
+        elem = _xml_sale(root, sale_id)
+        if elem is None:
+            return None
+        root.remove(elem)
+        atomic_write(path, _xml_bytes(path, tree), st)
+        return 'deleted'
@@ -0,0 +1,188 @@
+"""
+Пакетный импорт продаж из файлов uploads/ в таблицу Sale.
+
+Записи читаются из файла потоково (см. streaming.py), проверяются и
+вставляются пачками. Дубликаты по ключу (product_name, customer_email,
+sale_date) отсеиваются одним запросом на пачку, а гонки с параллельными
+вставками гасит ON CONFLICT DO NOTHING. Строки, которые параллельная вставка
+заняла первой, считаются дубликатами: в сводки (rollup.py) и в
+``ImportResult.inserted`` попадают только действительно вставленные продажи —
+на PostgreSQL их возвращает RETURNING, на других СУБД они перечитываются по
+первичным ключам в той же транзакции.
+"""
+
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+
+from .compressed import open_read
+from .dates import DateParser
+from .file_cache import file_format
+from . import rollup
+from .models import Sale
+from .segments import read_segment
+from .streaming import iter_file_records
+
+
+DEFAULT_BATCH_SIZE = 2000
+
+_CENT = Decimal('0.01')
+_MAX_PRICE = Decimal('99999999.99')
+
+
+class ImportResult:
+
+    def __init__(self):
+        self.inserted = 0
+        self.duplicates = 0
+        self.invalid = 0
+
+    @property
+    def total(self):
+        return self.inserted + self.duplicates + self.invalid
+
+    def as_dict(self):
+        return {'inserted': self.inserted, 'duplicates': self.duplicates, 'invalid': self.invalid}
+
+    def __str__(self):
+        return f'inserted: {self.inserted}, duplicates: {self.duplicates}, invalid: {self.invalid}'
+
+
+def _text(value, max_length):
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value or len(value) > max_length:
+        return None
+    return value
+
+
+def build_sale(record, date_parser=None):
+    """
+    Проверяет запись из файла и возвращает несохранённый Sale или None.
+
+    ``date_parser`` — DateParser источника, запоминающий формат дат.
+    """
+    if not isinstance(record, dict):
+        return None
+    product_name = _text(record.get('product_name'), 200)
+    customer_name = _text(record.get('customer_name'), 200)
+    customer_email = _text(record.get('customer_email'), 254)
+    if not (product_name and customer_name and customer_email) or '@' not in customer_email:
+        return None
+
+    try:
+        quantity = int(record.get('quantity'))
+        price = Decimal(str(record.get('price'))).quantize(_CENT)
+    except (TypeError, ValueError, InvalidOperation):
+        return None
+    if quantity <= 0 or price <= 0 or price > _MAX_PRICE:
+        return None
+
+    sale_date = (date_parser or DateParser()).parse(record.get('sale_date'))
+    if not isinstance(sale_date, datetime):
+        return None
+    if sale_date.tzinfo is None:
+        sale_date = sale_date.replace(tzinfo=dt_timezone.utc)
+    # Ключ уникальности сравнивается с датами из БД, которые приходят в UTC.
+    sale_date = sale_date.astimezone(dt_timezone.utc)
+
+    return Sale(
+        product_name=product_name,
+        quantity=quantity,
+        price=price,
+        sale_date=sale_date,
+        customer_name=customer_name,
+        customer_email=customer_email,
+    )
+
+
+def _sale_key(sale):
+    return (sale.product_name, sale.customer_email, sale.sale_date)
+
+
+def _existing_keys(batch):
+    # Кандидатов отбираем только по дате (индекс sale_date, id): условия IN сразу
+    # по трём колонкам планировщик раскрывает в произведение списков.
+    rows = Sale.objects.filter(
+        sale_date__in={s.sale_date for s in batch},
+    ).values_list('product_name', 'customer_email', 'sale_date')
+    return {(name, email, date.astimezone(dt_timezone.utc)) for name, email, date in rows}
+
+
+def _insert_returning(sales):
+    """INSERT ... ON CONFLICT DO NOTHING RETURNING id (PostgreSQL): ключи вставленных строк."""
+    fields = Sale._meta.concrete_fields
+    quote = connection.ops.quote_name
+    row = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    sql = (
+        f'INSERT INTO {quote(Sale._meta.db_table)} ({", ".join(quote(f.column) for f in fields)}) '
+        f'VALUES {", ".join([row] * len(sales))} '
+        f'ON CONFLICT DO NOTHING RETURNING {quote(Sale._meta.pk.column)}'
+    )
+    params = [f.get_db_prep_save(getattr(s, f.attname), connection) for s in sales for f in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _insert(sales):
+    """Вставляет продажи, пропуская занятые ключи; возвращает действительно вставленные."""
+    if not sales:
+        return []
+    if connection.vendor == 'postgresql':
+        inserted = _insert_returning(sales)
+    else:
+        Sale.objects.bulk_create(sales, ignore_conflicts=True)
+        # id генерируются у нас (uuid4), поэтому строка с таким id — наша вставка.
+        inserted = set(Sale.objects.filter(pk__in=[s.pk for s in sales]).values_list('pk', flat=True))
+    return [s for s in sales if s.pk in inserted]
+
+
+def _flush(batch, result):
+    with transaction.atomic():
+        existing = _existing_keys(batch)
+        fresh = _insert([s for s in batch if _sale_key(s) not in existing])
+        rollup.apply(added=fresh)
+    result.inserted += len(fresh)
+    result.duplicates += len(batch) - len(fresh)
+    return fresh
+
+
+def import_records(records, batch_size=DEFAULT_BATCH_SIZE):
+    """Импортирует продажи из итерируемого источника записей; возвращает ImportResult."""
+    result = ImportResult()
+    date_parser = DateParser()
+    batch = []
+    batch_keys = set()
+    for record in records:
+        sale = build_sale(record, date_parser)
+        if sale is None:
+            result.invalid += 1
+            continue
+        key = _sale_key(sale)
+        if key in batch_keys:
+            result.duplicates += 1
+            continue
+        batch.append(sale)
+        batch_keys.add(key)
+        if len(batch) >= batch_size:
+            _flush(batch, result)
+            batch = []
+            batch_keys = set()
+    if batch:
+        _flush(batch, result)
+    return result
+
+
+def import_file(filepath, batch_size=DEFAULT_BATCH_SIZE):
+    """Потоково импортирует JSON/XML файл продаж (или сегмент NDJSON) в БД."""
+    fmt = file_format(filepath)
+    if fmt is None:
+        raise ValueError('Only JSON and XML files can be imported.')
+    if fmt == 'ndjson':
+        # Удалённые и заменённые версии отсеиваются только прочтением сегмента целиком.
+        return import_records(read_segment(filepath)[0], batch_size=batch_size)
+    with open_read(filepath) as f:
+        return import_records(iter_file_records(f, fmt), batch_size=batch_size)
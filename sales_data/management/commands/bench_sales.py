@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from sales_data import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Замеряет задержки представлений на синтетических данных во временной тестовой БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=200, help='Число файлов в uploads/')
+        parser.add_argument('--records-per-file', type=int, default=50, help='Продаж в файле-списке')
+        parser.add_argument('--db-rows', type=int, default=10000, help='Строк в таблице Sale')
+        parser.add_argument('--iterations', type=int, default=50, help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=1, help='Неучитываемых запросов перед замером')
+        parser.add_argument('--scenario', action='append', choices=benchmark.SCENARIOS,
+                            help='Сценарий (можно повторять); по умолчанию все')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('-o', '--output', help='Файл для отчёта JSON (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        for name in ('files', 'records_per_file', 'iterations'):
+            if options[name] < 1:
+                raise CommandError(f'--{name.replace("_", "-")} must be positive.')
+
+        # Данные пишутся во временную тестовую БД, рабочая база не меняется.
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            report = benchmark.run(
+                files=options['files'],
+                records_per_file=options['records_per_file'],
+                db_rows=max(options['db_rows'], 0),
+                iterations=options['iterations'],
+                warmup=max(options['warmup'], 0),
+                scenarios=options['scenario'] or benchmark.SCENARIOS,
+                seed=options['seed'],
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from sales_data import data_version, segments, views
+from sales_data.sale_index import SaleLocationIndex
+
+
+class Command(BaseCommand):
+    help = 'Сливает закрытые сегменты и старые файлы add_sale из uploads/, выбрасывая удалённые и заменённые продажи'
+
+    def handle(self, *args, **options):
+        merged, dropped = segments.compact(views.UPLOAD_DIR, SaleLocationIndex(views.UPLOAD_DIR))
+        if merged:
+            data_version.bump(views.UPLOAD_DIR)
+        self.stdout.write(self.style.SUCCESS(f'Compacted {merged} files, dropped {dropped} records.'))
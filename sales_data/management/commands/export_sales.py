@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales_data import exporter
+
+
+class Command(BaseCommand):
+    help = 'Потоково выгружает продажи из базы данных в JSON, XML или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(exporter.CONTENT_TYPES), default='json')
+        parser.add_argument('--gzip', action='store_true', help='Сжать выгрузку gzip')
+        parser.add_argument('-q', '--query', default='', help='Поиск по продукту, клиенту и email')
+        parser.add_argument('--date-from', help='Начало периода (YYYY-MM-DD или ISO дата-время)')
+        parser.add_argument('--date-to', help='Конец периода включительно (YYYY-MM-DD или ISO дата-время)')
+        parser.add_argument('-o', '--output', help='Файл для записи (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            date_from = exporter.parse_bound(options['date_from'])
+            date_to = exporter.parse_bound(options['date_to'], end=True)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        queryset = exporter.export_queryset(options['query'], date_from, date_to)
+        chunks = exporter.iter_export(queryset, options['format'], compress=options['gzip'])
+
+        if options['output']:
+            with open(options['output'], 'wb') as out:
+                for chunk in chunks:
+                    out.write(chunk)
+        else:
+            out = getattr(self.stdout, 'buffer', None) or sys.stdout.buffer
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
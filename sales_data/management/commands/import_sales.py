@@ -0,0 +1,35 @@
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales_data import compressed, data_version, importer, shards, views
+
+
+class Command(BaseCommand):
+    help = 'Импортирует продажи из JSON/XML файла в базу данных пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='Имена файлов в uploads/ или пути к файлам')
+        parser.add_argument('--batch-size', type=int, default=importer.DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        for name in options['files']:
+            filepath = name if os.path.isfile(name) else shards.locate(views.UPLOAD_DIR, name)
+            if filepath is None:
+                raise CommandError(f'File not found: {name}')
+
+            start = time.perf_counter()
+            try:
+                result = importer.import_file(filepath, batch_size=options['batch_size'])
+            except (ValueError, ET.ParseError) + compressed.CORRUPT_ERRORS as e:
+                raise CommandError(f'{name}: {e}')
+            elapsed = time.perf_counter() - start
+            if result.inserted:
+                data_version.bump(views.UPLOAD_DIR)
+
+            rate = result.total / elapsed if elapsed else 0
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: {result} ({result.total} records in {elapsed:.2f}s, {rate:.0f} records/s)'
+            ))
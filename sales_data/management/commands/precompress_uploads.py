@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from sales_data import compressed, downloads, shards, views
+
+
+class Command(BaseCommand):
+    help = 'Пишет сжатые gzip-копии крупных файлов uploads/ для download_file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-bytes', type=int, default=64 * 1024,
+            help='сжимать файлы не меньше этого размера (по умолчанию 64 КиБ)',
+        )
+
+    def handle(self, *args, **options):
+        written = 0
+        saved = 0
+        for entry in shards.iter_entries(views.UPLOAD_DIR):
+            # Сжатые при загрузке файлы и так отдаются с Content-Encoding.
+            if shards.file_format(entry.name) not in ('json', 'xml') or compressed.compression_of(entry.name):
+                continue
+            try:
+                size = entry.stat().st_size
+                if size < options['min_bytes'] or downloads.is_fresh(entry.path):
+                    continue
+                compressed_size = downloads.precompress(entry.path)
+            except FileNotFoundError:
+                continue
+            if compressed_size is None:
+                self.stderr.write(f'Skipped {entry.name}: changed while compressing.')
+                continue
+            written += 1
+            saved += size - compressed_size
+            if options['verbosity'] >= 2:
+                self.stdout.write(f'{entry.name}: {size} -> {compressed_size} bytes')
+        self.stdout.write(self.style.SUCCESS(f'Compressed {written} files, saved {saved} bytes.'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sales_data import rollup
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает дневные сводки продаж или проверяет их на расхождения с таблицей Sale'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='только сравнить сводки с таблицей Sale, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            total = rollup.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} rollup rows.'))
+            return
+
+        drift = rollup.find_drift()
+        for row in drift:
+            self.stdout.write(
+                f'{row.day} {row.product_name}: expected {row.expected}, found {row.actual}'
+            )
+        if drift:
+            raise CommandError(f'{len(drift)} rollup rows differ from the sales table.')
+        self.stdout.write(self.style.SUCCESS('Rollups match the sales table.'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from sales_data import views
+from sales_data.sale_index import SaleLocationIndex
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает индекс «id продажи → файл» для каталога uploads/'
+
+    def handle(self, *args, **options):
+        total = SaleLocationIndex(views.UPLOAD_DIR).rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} file sales.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from sales_data import shards, views
+
+
+class Command(BaseCommand):
+    help = 'Переносит файлы из корня каталога uploads/ в подкаталоги-шарды uploads/ab/cd/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='только показать, что будет перенесено')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        moved, skipped = shards.move_into_shards(views.UPLOAD_DIR, dry_run=dry_run)
+        if options['verbosity'] >= 2:
+            for filename in moved:
+                self.stdout.write(f'{filename} -> {shards.shard_of(filename)}/')
+        for filename in skipped:
+            self.stderr.write(f'Skipped {filename}: {shards.shard_of(filename)}/{filename} already exists.')
+        verb = 'Would move' if dry_run else 'Moved'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(moved)} files into shards.'))
@@ -0,0 +1,54 @@
+import logging
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from sales_data import views
+from sales_data.watcher import UploadWatcher
+
+
+class Command(BaseCommand):
+    help = 'Следит за каталогом uploads/ и разбирает новые и изменённые файлы в хранилище для представлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='сверить каталог один раз и выйти')
+        parser.add_argument('--poll', action='store_true', help='опрашивать каталог вместо inotify')
+        parser.add_argument(
+            '--interval', type=float, default=2.0,
+            help='период опроса и проверки остановки в секундах (по умолчанию 2)',
+        )
+        parser.add_argument(
+            '--resync', type=float, default=300.0,
+            help='период полной сверки каталога при работе через inotify (по умолчанию 300 с)',
+        )
+        parser.add_argument(
+            '--compact-interval', type=float, default=600.0,
+            help='период сжатия сегментов в секундах, 0 — не сжимать (по умолчанию 600)',
+        )
+
+    def handle(self, *args, **options):
+        watcher = UploadWatcher(
+            views.UPLOAD_DIR, interval=options['interval'], resync=options['resync'],
+            compact_interval=options['compact_interval'],
+        )
+        if options['once']:
+            updated, removed = watcher.sync()
+            watcher.store.close()
+            self.stdout.write(self.style.SUCCESS(f'Synced {updated} files, removed {removed}.'))
+            return
+
+        logger = logging.getLogger('sales_data.watcher')
+        handler = logging.StreamHandler(self.stdout)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO if options['verbosity'] >= 1 else logging.WARNING)
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        try:
+            watcher.run(use_inotify=not options['poll'], should_stop=stop.is_set)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.removeHandler(handler)
@@ -0,0 +1,469 @@
+"""
+Метрики производительности запросов к представлениям sales_data.
+
+RequestMetricsMiddleware собирает для каждого запроса:
+
+* время обработки представлением (до возврата ответа);
+* число SQL-запросов и их суммарное время (обёртка ``execute_wrappers``
+  каждого соединения, см. _count_sql);
+* число файлов uploads/, разобранных заново (промахи кэша), и число
+  записей, выданных кэшем файлов представлению;
+* время рендеринга шаблонов (бэкенд InstrumentedDjangoTemplates).
+
+Значения попадают в гистограммы с меткой ``view`` и отдаются на /metrics/ в
+текстовом формате Prometheus. Запросы дольше SALES_SLOW_REQUEST_SECONDS
+пишутся в лог ``sales_data.metrics``.
+
+Для потоковых ответов (выгрузка, потоковый поиск) работа идёт уже после
+возврата ответа, при отдаче тела: счётчики собираются и во время итерации,
+а запрос учитывается, когда поток закрыт.
+
+Если задан SALES_METRICS_DIR, значения накапливаются в общем для всех
+воркеров файле SQLite в этом каталоге (по одной транзакции на запрос), и
+/metrics/ отдаёт сумму по всем воркерам — как multiprocess-режим
+prometheus_client. Каталог очищается при старте контейнера (entrypoint.sh).
+Без него реестр свой у каждого процесса, что годится для одного воркера.
+Под ASGI запись в хранилище идёт в пуле потоков, а не на цикле событий:
+транзакция SQLite может ждать блокировку, пока пишет другой воркер.
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import FileResponse, StreamingHttpResponse
+from django.template.backends.django import DjangoTemplates
+
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+RECORD_BUCKETS = (0, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+class RequestStats:
+    """Счётчики одного запроса."""
+
+    __slots__ = ('sql_queries', 'sql_seconds', 'files_parsed', 'records_scanned', 'template_seconds')
+
+    def __init__(self):
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.files_parsed = 0
+        self.records_scanned = 0
+        self.template_seconds = 0.0
+
+
+_current = contextvars.ContextVar('sales_request_stats', default=None)
+
+
+def current_stats():
+    """RequestStats текущего запроса или None вне запроса."""
+    return _current.get()
+
+
+def note_file_records(records, parsed):
+    """Учитывает записи файла, выданные кэшем; ``parsed`` — файл разобран заново."""
+    stats = _current.get()
+    if stats is not None:
+        stats.records_scanned += records
+        if parsed:
+            stats.files_parsed += 1
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class _LocalValues:
+    """Значения метрик в памяти процесса."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def add(self, increments):
+        with self._lock:
+            for name, view, vector in increments:
+                series = self._values.get((name, view))
+                if series is None:
+                    series = self._values[(name, view)] = [0] * len(vector)
+                for i, amount in enumerate(vector):
+                    series[i] += amount
+
+    def series(self, name):
+        with self._lock:
+            return {view: list(series) for (metric, view), series in self._values.items() if metric == name}
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class _SharedValues:
+    """Значения метрик всех воркеров в файле SQLite; соединение своё у каждого потока."""
+
+    FILENAME = 'metrics.sqlite3'
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.FILENAME)
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # После fork соединение родителя использовать нельзя.
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # Потеря последних значений при сбое питания для метрик не страшна.
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS samples ('
+            'metric TEXT NOT NULL, view TEXT NOT NULL, idx INTEGER NOT NULL, value REAL NOT NULL, '
+            'PRIMARY KEY (metric, view, idx))'
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def add(self, increments):
+        rows = [
+            (name, view, i, amount)
+            for name, view, vector in increments
+            for i, amount in enumerate(vector)
+            if amount
+        ]
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO samples (metric, view, idx, value) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (metric, view, idx) DO UPDATE SET value = value + excluded.value',
+                rows,
+            )
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def series(self, name, length):
+        values = {}
+        for view, idx, value in self._connect().execute(
+                'SELECT view, idx, value FROM samples WHERE metric = ?', (name,)):
+            series = values.setdefault(view, [0] * length)
+            if idx < length:
+                series[idx] = value
+        return values
+
+    def clear(self):
+        self._connect().execute('DELETE FROM samples')
+
+
+_local_values = _LocalValues()
+_shared_values = {}
+_shared_lock = threading.Lock()
+
+
+def _values():
+    """Хранилище значений: общее для воркеров при SALES_METRICS_DIR, иначе своё у процесса."""
+    directory = getattr(settings, 'SALES_METRICS_DIR', '')
+    if not directory:
+        return _local_values
+    with _shared_lock:
+        values = _shared_values.get(directory)
+        if values is None:
+            values = _shared_values[directory] = _SharedValues(directory)
+        return values
+
+
+def _series(name, length):
+    values = _values()
+    if isinstance(values, _SharedValues):
+        return values.series(name, length)
+    return values.series(name)
+
+
+def _int(value):
+    return int(value) if float(value).is_integer() else value
+
+
+class Histogram:
+    """Гистограмма Prometheus с одной меткой ``view``."""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def increments(self, view, value):
+        """Приращения ряда ``view`` для наблюдения ``value``: счётчики корзин и сумма."""
+        return self.name, view, [1 if value <= bound else 0 for bound in self.buckets] + [value]
+
+    def observe(self, view, value):
+        _values().add([self.increments(view, value)])
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        items = sorted(_series(self.name, len(self.buckets) + 1).items())
+        for view, series in items:
+            label = f'view="{_escape(view)}"'
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label},le="{_format_value(bound)}"}} {_int(count)}')
+            lines.append(f'{self.name}_sum{{{label}}} {_format_value(float(series[-1]))}')
+            lines.append(f'{self.name}_count{{{label}}} {_int(series[-2])}')
+        return lines
+
+
+class Counter:
+    """Счётчик Prometheus с одной меткой ``view``."""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+
+    def increments(self, view, amount=1):
+        return self.name, view, [amount]
+
+    def inc(self, view, amount=1):
+        _values().add([self.increments(view, amount)])
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for view, series in sorted(_series(self.name, 1).items()):
+            lines.append(f'{self.name}{{view="{_escape(view)}"}} {_int(series[0])}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'sales_request_duration_seconds', 'Time spent in the view until the response is returned.', DURATION_BUCKETS)
+SQL_QUERIES = Histogram('sales_sql_queries', 'SQL queries executed per request.', COUNT_BUCKETS)
+SQL_SECONDS = Histogram('sales_sql_duration_seconds', 'Total SQL execution time per request.', DURATION_BUCKETS)
+FILES_PARSED = Histogram('sales_files_parsed', 'Upload files read and parsed per request.', COUNT_BUCKETS)
+RECORDS_SCANNED = Histogram('sales_records_scanned', 'File sale records scanned per request.', RECORD_BUCKETS)
+TEMPLATE_SECONDS = Histogram(
+    'sales_template_render_seconds', 'Template rendering time per request.', DURATION_BUCKETS)
+SLOW_REQUESTS = Counter('sales_slow_requests_total', 'Requests slower than SALES_SLOW_REQUEST_SECONDS.')
+
+METRICS = (REQUEST_SECONDS, SQL_QUERIES, SQL_SECONDS, FILES_PARSED, RECORDS_SCANNED, TEMPLATE_SECONDS, SLOW_REQUESTS)
+
+
+def render_metrics():
+    """Все метрики в текстовом формате Prometheus."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    _values().clear()
+
+
+def _count_sql(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.sql_queries += 1
+        stats.sql_seconds += time.perf_counter() - start
+
+
+def _install_sql_counter(connection, **kwargs):
+    # Соединения свои у каждого потока (в том числе у потоков sync_to_async),
+    # поэтому обёртка ставится навсегда и находит запрос через contextvar.
+    # Вставляем в начало: execute_wrapper() снимает обёртки с конца списка.
+    if _count_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _count_sql)
+
+
+connection_created.connect(_install_sql_counter)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None or not match.func.__module__.startswith('sales_data.'):
+        return None
+    return match.view_name
+
+
+class RequestMetricsMiddleware:
+    """
+    Собирает метрики запросов к представлениям sales_data и логирует медленные.
+
+    Работает и в синхронной, и в асинхронной цепочке: под ASGI не переводит
+    обработку запроса в поток.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        # Соединения этого потока могли открыться до импорта модуля.
+        for connection in connections.all():
+            _install_sql_counter(connection)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        record = self._finish(request, response, start, stats)
+        if record is not None:
+            record()
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        record = self._finish(request, response, start, stats)
+        if record is not None:
+            await asyncio.to_thread(record)
+        return response
+
+    def _finish(self, request, response, start, stats):
+        """
+        Завершает учёт запроса: возвращает функцию записи метрик или None,
+        если запрос не учитывается или будет записан при закрытии потока.
+        """
+        view = _view_name(request)
+        if view is None:
+            return None
+        # FileResponse не трогаем: замена тела лишила бы его sendfile, а работы
+        # представления при отдаче файла нет.
+        if isinstance(response, StreamingHttpResponse) and not isinstance(response, FileResponse):
+            def done():
+                self._record(request, view, time.perf_counter() - start, stats)
+            if response.is_async:
+                response.streaming_content = _ameasured(response.streaming_content, stats, done)
+            else:
+                response.streaming_content = _measured(response.streaming_content, stats, done)
+            return None
+        return functools.partial(self._record, request, view, time.perf_counter() - start, stats)
+
+    def _record(self, request, view, elapsed, stats):
+        increments = [
+            REQUEST_SECONDS.increments(view, elapsed),
+            SQL_QUERIES.increments(view, stats.sql_queries),
+            SQL_SECONDS.increments(view, stats.sql_seconds),
+            FILES_PARSED.increments(view, stats.files_parsed),
+            RECORDS_SCANNED.increments(view, stats.records_scanned),
+            TEMPLATE_SECONDS.increments(view, stats.template_seconds),
+        ]
+        threshold = getattr(settings, 'SALES_SLOW_REQUEST_SECONDS', 1.0)
+        slow = threshold and elapsed >= threshold
+        if slow:
+            increments.append(SLOW_REQUESTS.increments(view))
+        try:
+            _values().add(increments)
+        except sqlite3.Error:
+            # Метрики не должны ронять запрос.
+            logger.exception('Cannot record metrics for %s', view)
+
+        if slow:
+            logger.warning(
+                'Slow request %s %s (%s): %.3fs, sql %d queries %.3fs, files parsed %d, '
+                'records scanned %d, template %.3fs',
+                request.method, request.path, view, elapsed, stats.sql_queries, stats.sql_seconds,
+                stats.files_parsed, stats.records_scanned, stats.template_seconds,
+            )
+
+
+def _measured(iterator, stats, done):
+    """Тело потокового ответа, выдаваемое со счётчиками запроса; ``done`` — когда поток закрыт."""
+    iterator = iter(iterator)
+    try:
+        while True:
+            token = _current.set(stats)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _current.reset(token)
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+        done()
+
+
+async def _ameasured(iterator, stats, done):
+    iterator = aiter(iterator)
+    try:
+        while True:
+            token = _current.set(stats)
+            try:
+                chunk = await anext(iterator)
+            except StopAsyncIteration:
+                return
+            finally:
+                _current.reset(token)
+            yield chunk
+    finally:
+        aclose = getattr(iterator, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+        await asyncio.to_thread(done)
+
+
+class _TimedTemplate:
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return self._template.render(context, request)
+        finally:
+            stats = _current.get()
+            if stats is not None:
+                stats.template_seconds += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Бэкенд шаблонов Django, учитывающий время рендеринга в метриках запроса."""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
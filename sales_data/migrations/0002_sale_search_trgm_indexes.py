@@ -0,0 +1,39 @@
+# Триграммные GIN-индексы для поиска по подстроке (только PostgreSQL).
+#
+# Django строит icontains в PostgreSQL как UPPER("col"::text) LIKE UPPER(%s),
+# поэтому индексируется именно это выражение. На других СУБД миграция
+# ничего не делает.
+
+from django.db import migrations
+
+
+TRGM_COLUMNS = ('product_name', 'customer_name', 'customer_email')
+
+
+def create_trgm_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for column in TRGM_COLUMNS:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS sales_{column}_upper_trgm '
+            f'ON sales USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+        )
+
+
+def drop_trgm_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for column in TRGM_COLUMNS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS sales_{column}_upper_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_data', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trgm_indexes, drop_trgm_indexes),
+    ]
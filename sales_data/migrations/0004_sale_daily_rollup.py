@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:57
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def fill_rollups(apps, schema_editor):
+    # Только исторические модели: код приложения (rollup.py) со временем меняется,
+    # а миграция должна работать на схеме своего момента.
+    Sale = apps.get_model('sales_data', 'Sale')
+    SaleDailyRollup = apps.get_model('sales_data', 'SaleDailyRollup')
+    revenue = ExpressionWrapper(F('quantity') * F('price'), output_field=DecimalField(max_digits=20, decimal_places=2))
+    rows = (
+        Sale.objects.order_by()
+        .annotate(day=TruncDate('sale_date', tzinfo=timezone.get_default_timezone()))
+        .values('day', 'product_name')
+        .annotate(sale_count=Count('id'), quantity_sum=Sum('quantity'), revenue_sum=Sum(revenue))
+        .order_by('day', 'product_name')
+    )
+    batch = []
+    for row in rows.iterator():
+        batch.append(SaleDailyRollup(
+            day=row['day'], product_name=row['product_name'], sale_count=row['sale_count'],
+            quantity_sum=row['quantity_sum'] or 0,
+            revenue_sum=Decimal(row['revenue_sum'] or 0).quantize(Decimal('0.01')),
+        ))
+        if len(batch) >= 1000:
+            SaleDailyRollup.objects.bulk_create(batch)
+            batch = []
+    SaleDailyRollup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_data', '0003_sale_date_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaleDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('product_name', models.CharField(max_length=200)),
+                ('sale_count', models.IntegerField(default=0)),
+                ('quantity_sum', models.BigIntegerField(default=0)),
+                ('revenue_sum', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+            ],
+            options={
+                'db_table': 'sales_daily_rollup',
+                'unique_together': {('day', 'product_name')},
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models
+import re
 import uuid
 from typing import TYPE_CHECKING
 
@@ -7,8 +9,19 @@ if TYPE_CHECKING:
     from django.db.models import QuerySet
 
 class SaleData:
+    """
+    Продажа из файла или БД в компактном виде для представлений.
+
+    Атрибуты хранятся в __slots__, без словаря на каждый экземпляр: на
+    сотнях тысяч записей в кэше файлов это в разы меньше памяти, чем dict.
+    Записи из кэша общие для всех запросов — их не изменяют.
+    """
+    
+    FIELDS = ('id', 'product_name', 'quantity', 'price', 'sale_date', 'customer_name', 'customer_email')
     
-    def __init__(self, id, product_name, quantity, price, sale_date, customer_name, customer_email):
+    __slots__ = FIELDS + ('source',)
+    
+    def __init__(self, id, product_name, quantity, price, sale_date, customer_name, customer_email, source='file'):
         self.id = id
         self.product_name = product_name
         self.quantity = quantity
@@ -16,6 +29,20 @@ class SaleData:
         self.sale_date = sale_date
         self.customer_name = customer_name
         self.customer_email = customer_email
+        self.source = source
+    
+    def __repr__(self):
+        return f"SaleData({self.source}: {self.id})"
+    
+    def matches(self, query_cf):
+        """Подходит ли запись под поисковый запрос (уже приведённый через casefold)."""
+        if not query_cf:
+            return True
+        return (
+            query_cf in str(self.product_name or '').casefold() or
+            query_cf in str(self.customer_name or '').casefold() or
+            query_cf in str(self.customer_email or '').casefold()
+        )
     
     def to_dict(self):
         return {
@@ -25,11 +52,12 @@ class SaleData:
             'price': self.price,
             'sale_date': self.sale_date,
             'customer_name': self.customer_name,
-            'customer_email': self.customer_email
+            'customer_email': self.customer_email,
+            'source': self.source,
         }
     
     @classmethod
-    def from_dict(cls, data):
+    def from_dict(cls, data, source='file'):
         return cls(
             id=data.get('id'),
             product_name=data.get('product_name'),
@@ -37,12 +65,51 @@ class SaleData:
             price=data.get('price'),
             sale_date=data.get('sale_date'),
             customer_name=data.get('customer_name'),
-            customer_email=data.get('customer_email')
+            customer_email=data.get('customer_email'),
+            source=source,
         )
+    
+    @classmethod
+    def from_row(cls, row):
+        """Из кортежа ``values_list(*SaleData.FIELDS)`` таблицы Sale."""
+        sale_id, product_name, quantity, price, sale_date, customer_name, customer_email = row
+        return cls(
+            str(sale_id), product_name, quantity, float(price), sale_date,
+            customer_name, customer_email, source='database',
+        )
+
+
+class SaleDataJSONEncoder(DjangoJSONEncoder):
+    """JSON-кодировщик, понимающий SaleData."""
+    
+    def default(self, o):
+        if isinstance(o, SaleData):
+            return o.to_dict()
+        return super().default(o)
+
+SEARCH_FIELDS = ('product_name', 'customer_name', 'customer_email')
+
+class SaleQuerySet(models.QuerySet):
+    
+    def search(self, query):
+        """Поиск подстроки без учёта регистра по продукту, имени и email клиента"""
+        if not query:
+            return self
+        lookup, value = 'icontains', query
+        if connections[self.db].vendor == 'sqlite' and not query.isascii():
+            # LIKE в SQLite игнорирует регистр только для ASCII. Для кириллицы
+            # используем REGEXP, который Django реализует в SQLite через модуль re.
+            lookup, value = 'iregex', re.escape(query)
+        condition = models.Q()
+        for field in SEARCH_FIELDS:
+            condition |= models.Q(**{f'{field}__{lookup}': value})
+        return self.filter(condition)
 
 class Sale(models.Model):
     if TYPE_CHECKING:
         objects: Manager  # type: ignore
+    
+    objects = SaleQuerySet.as_manager()
         
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     product_name = models.CharField(max_length=200)
@@ -55,6 +122,10 @@ class Sale(models.Model):
     class Meta:
         db_table = 'sales'
         unique_together = ('product_name', 'customer_email', 'sale_date')
+        indexes = [
+            # Keyset-пагинация по (sale_date, id), см. pagination.py
+            models.Index(fields=['sale_date', 'id'], name='sales_sale_date_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.product_name} - {self.customer_name}"
@@ -69,4 +140,20 @@ class Sale(models.Model):
             'sale_date': self.sale_date.isoformat() if hasattr(self.sale_date, 'isoformat') else str(self.sale_date),  # type: ignore
             'customer_name': self.customer_name,
             'customer_email': self.customer_email
-        }
\ No newline at end of file
+        }
+
+class SaleDailyRollup(models.Model):
+    """Сводка продаж из БД за день по продукту, см. rollup.py"""
+    
+    day = models.DateField()
+    product_name = models.CharField(max_length=200)
+    sale_count = models.IntegerField(default=0)
+    quantity_sum = models.BigIntegerField(default=0)
+    revenue_sum = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    
+    class Meta:
+        db_table = 'sales_daily_rollup'
+        unique_together = ('day', 'product_name')
+    
+    def __str__(self):
+        return f"{self.day} {self.product_name}: {self.sale_count}"
@@ -0,0 +1,261 @@
+"""
+Keyset-пагинация продаж сразу по двум источникам: база данных и файлы.
+
+Порядок внутри источника задаётся парой (поле сортировки, id). Курсор
+хранит для каждого источника ключ последней выданной записи, поэтому
+следующая страница в БД — это запрос «после ключа» по индексу, без OFFSET,
+а в файлах — отбор записей после ключа и частичная сортировка heapq.
+Страницы источников сливаются в одну по тому же ключу.
+
+``apaginate`` — то же для асинхронных представлений: страница БД читается
+через async ORM одновременно с подготовкой файловых записей.
+"""
+
+import asyncio
+import base64
+import binascii
+import heapq
+import json
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import SaleData
+
+
+SORT_FIELDS = ('sale_date', 'product_name', 'customer_name', 'customer_email', 'quantity', 'price')
+DEFAULT_SORT = '-sale_date'
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+PageRequest = namedtuple('PageRequest', 'field descending limit positions')
+Page = namedtuple('Page', 'items next_cursor')
+
+
+class InvalidPageRequest(ValueError):
+    pass
+
+
+def sort_value(field, value):
+    """
+    Сравнимое значение поля для сортировки записей обоих источников.
+
+    Возвращает (есть_значение, значение): записи без корректного значения
+    идут в начале по возрастанию и в конце по убыванию.
+    """
+    if field == 'sale_date':
+        if not isinstance(value, datetime):
+            return (0, 0)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=dt_timezone.utc)
+        return (1, (value - _EPOCH) // _MICROSECOND)
+    if field in ('quantity', 'price'):
+        try:
+            return (1, float(value))
+        except (TypeError, ValueError):
+            return (0, 0.0)
+    if value is None:
+        return (0, '')
+    return (1, str(value))
+
+
+def _record_key(field, record):
+    return sort_value(field, getattr(record, field)) + (str(record.id or ''),)
+
+
+def _db_value_to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _db_value_from_json(field, value):
+    if field == 'sale_date':
+        return datetime.fromisoformat(value)
+    if field == 'price':
+        return Decimal(str(value))
+    if field == 'quantity':
+        return int(value)
+    return str(value)
+
+
+def encode_cursor(sort, positions):
+    payload = json.dumps({'sort': sort, **positions}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _valid_db_position(field, position):
+    if not isinstance(position, list) or len(position) != 2 or not isinstance(position[1], str):
+        return False
+    value = position[0]
+    if field in ('quantity', 'price'):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            return False
+    elif not isinstance(value, str):
+        return False
+    try:
+        _db_value_from_json(field, value)
+        uuid.UUID(position[1])
+    except (TypeError, ValueError, InvalidOperation):
+        return False
+    return True
+
+
+def _valid_file_position(field, position):
+    # Ключ _record_key: (есть_значение, значение, id) — типы те же, что у sort_value.
+    if not isinstance(position, list) or len(position) != 3:
+        return False
+    has_value, value, record_id = position
+    if has_value not in (0, 1) or isinstance(has_value, bool) or not isinstance(record_id, str):
+        return False
+    if field == 'sale_date':
+        return isinstance(value, int) and not isinstance(value, bool)
+    if field in ('quantity', 'price'):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, str)
+
+
+def decode_cursor(cursor, sort):
+    """
+    Позиции источников из курсора.
+
+    Курсор приходит от клиента, поэтому типы полей проверяются здесь:
+    неверный курсор — InvalidPageRequest (400), а не TypeError при сравнении.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeError):
+        raise InvalidPageRequest('Invalid cursor.')
+    if not isinstance(data, dict) or data.pop('sort', None) != sort:
+        raise InvalidPageRequest('Cursor does not match the sort order.')
+    field = sort.lstrip('-')
+    validators = {'database': _valid_db_position, 'file': _valid_file_position}
+    for source, position in data.items():
+        if source not in validators or not validators[source](field, position):
+            raise InvalidPageRequest('Invalid cursor.')
+    return data
+
+
+def parse_page_request(params):
+    """Разбирает sort/limit/cursor из GET-параметров запроса."""
+    sort = params.get('sort') or DEFAULT_SORT
+    field = sort.lstrip('-')
+    if field not in SORT_FIELDS:
+        raise InvalidPageRequest(f'Unsupported sort field: {field}')
+
+    default_limit = getattr(settings, 'SALES_PAGE_SIZE', 50)
+    max_limit = getattr(settings, 'SALES_PAGE_SIZE_MAX', 500)
+    try:
+        limit = int(params.get('limit') or default_limit)
+    except ValueError:
+        raise InvalidPageRequest('Invalid limit.')
+    limit = max(1, min(limit, max_limit))
+
+    cursor = params.get('cursor')
+    positions = decode_cursor(cursor, sort) if cursor else {}
+    return PageRequest(field, sort.startswith('-'), limit, positions)
+
+
+def _db_rows(queryset, page):
+    field = page.field
+    op = 'lt' if page.descending else 'gt'
+    after = page.positions.get('database')
+    if after:
+        try:
+            value, sale_id = _db_value_from_json(field, after[0]), after[1]
+        except (TypeError, ValueError, IndexError, InvalidOperation):
+            raise InvalidPageRequest('Invalid cursor.')
+        # Избыточное условие по одному полю позволяет СУБД начать с диапазона индекса.
+        queryset = queryset.filter(**{f'{field}__{op}e': value}).filter(
+            Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': sale_id})
+        )
+    order = (f'-{field}', '-id') if page.descending else (field, 'id')
+    return queryset.order_by(*order).values_list(*SaleData.FIELDS)[:page.limit + 1]
+
+
+def _db_page(queryset, page):
+    return [SaleData.from_row(row) for row in _db_rows(queryset, page)]
+
+
+def _file_page(records, page):
+    field = page.field
+    after = page.positions.get('file')
+    if after:
+        try:
+            after = (after[0], after[1], after[2])
+        except (TypeError, IndexError):
+            raise InvalidPageRequest('Invalid cursor.')
+        if page.descending:
+            records = (r for r in records if _record_key(field, r) < after)
+        else:
+            records = (r for r in records if _record_key(field, r) > after)
+    select = heapq.nlargest if page.descending else heapq.nsmallest
+    return select(page.limit + 1, records, key=lambda r: _record_key(field, r))
+
+
+def paginate(page, queryset=None, records=None):
+    """
+    Возвращает Page: items — список пар (источник, запись), запись — SaleData.
+
+    ``queryset`` или ``records`` можно не передавать, если источник не нужен.
+    """
+    db_items = _db_page(queryset, page) if queryset is not None else None
+    file_items = _file_page(records, page) if records is not None else None
+    return _merge(page, db_items, file_items)
+
+
+async def apaginate(page, queryset=None, records=None):
+    """
+    Асинхронный paginate: ``records`` — awaitable, возвращающий итерируемое
+    файловых записей (или None, если источник не нужен).
+
+    Пока ждём файловые записи, страница БД читается через async ORM; отбор
+    страницы из файлов (фильтрация и heapq) идёт в отдельном потоке.
+    """
+    async def database():
+        if queryset is None:
+            return None
+        return [SaleData.from_row(row) async for row in _db_rows(queryset, page)]
+
+    async def files():
+        if records is None:
+            return None
+        return await asyncio.to_thread(_file_page, await records, page)
+
+    db_items, file_items = await asyncio.gather(database(), files())
+    return _merge(page, db_items, file_items)
+
+
+def _merge(page, db_items, file_items):
+    field = page.field
+    sources = []
+    if db_items is not None:
+        sources.append([(_record_key(field, s), 'database', s) for s in db_items])
+    if file_items is not None:
+        sources.append([(_record_key(field, r), 'file', r) for r in file_items])
+
+    # heapq.merge берёт записи только с головы каждого списка, поэтому из каждого
+    # источника выдаётся префикс его собственного порядка, даже если правила
+    # сравнения строк в СУБД отличаются от Python.
+    candidates = list(heapq.merge(*sources, key=lambda c: (c[0], c[1]), reverse=page.descending))
+    items = candidates[:page.limit]
+
+    if len(candidates) <= page.limit:
+        return Page([(source, item) for _, source, item in items], None)
+
+    positions = dict(page.positions)
+    for key, source, item in items:
+        if source == 'database':
+            positions['database'] = [_db_value_to_json(getattr(item, field)), str(item.id)]
+        else:
+            positions['file'] = list(key)
+    sort = f'-{field}' if page.descending else field
+    return Page([(source, item) for _, source, item in items], encode_cursor(sort, positions))
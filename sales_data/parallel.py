@@ -0,0 +1,171 @@
+"""
+Разбор каталога uploads/ в нескольких процессах.
+
+JSON/XML разбирается под GIL, поэтому потоки одного воркера не ускоряют
+холодный обход большого каталога. Здесь изменившиеся файлы делятся на
+пачки примерно равного объёма и разбираются в ProcessPoolExecutor;
+поисковый фильтр применяется в дочернем процессе, и обратно передаются
+только подошедшие записи.
+
+Файлы, которые есть в кэше и не изменились, фильтруются на месте. Если
+изменившиеся файлы в сумме меньше SALES_PARALLEL_PARSE_MIN_BYTES или
+SALES_PARSE_PROCESSES не больше 1, они разбираются в текущем потоке через
+кэш, как раньше. Без запроса подходят все записи — тогда разобранные в
+процессах файлы кладутся и в кэш.
+
+iter_search_files выдаёт подошедшие записи пачками — по файлу из кэша или
+по пачке файлов из процесса — по мере готовности, и в полёте держит не
+больше IN_FLIGHT_PER_WORKER пачек на процесс: потоковому поиску память
+нужна на несколько пачек, а не на весь результат.
+"""
+
+import heapq
+import multiprocessing
+import threading
+
+import django
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from django.conf import settings
+
+from .file_cache import CachedFile, file_cache, parse_sale_file
+from .metrics import note_file_records
+
+
+# Пачек больше, чем процессов, чтобы один крупный файл не держал остальных.
+CHUNKS_PER_WORKER = 4
+# Сколько пачек на процесс отдано в пул, но ещё не выдано потребителю.
+IN_FLIGHT_PER_WORKER = 2
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def workers():
+    """Число процессов разбора из SALES_PARSE_PROCESSES (0 или 1 — без процессов)."""
+    return getattr(settings, 'SALES_PARSE_PROCESSES', 0)
+
+
+def enabled():
+    return workers() > 1
+
+
+def process_pool():
+    """Общий пул процессов; пересоздаётся, если поменялось число процессов."""
+    global _pool, _pool_workers
+    count = workers()
+    with _pool_lock:
+        if _pool is None or _pool_workers != count:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            # spawn, а не fork: форк многопоточного процесса сервера небезопасен.
+            # Дочерний процесс сначала поднимает Django, затем принимает задачи.
+            _pool = ProcessPoolExecutor(
+                max_workers=count, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup,
+            )
+            _pool_workers = count
+        return _pool
+
+
+def shutdown():
+    """Останавливает пул процессов (тесты, нагрузочные прогоны)."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+        _pool_workers = None
+
+
+def _parse_chunk(files, query_cf):
+    """Выполняется в дочернем процессе: [(path, подошедшие записи, всего записей)]."""
+    result = []
+    for path, fmt in files:
+        records = parse_sale_file(path, fmt)
+        matched = [r for r in records if r.matches(query_cf)] if query_cf else records
+        result.append((path, matched, len(records)))
+    return result
+
+
+def split_by_size(files, count):
+    """Делит FileStat на не более чем ``count`` пачек примерно равного суммарного размера."""
+    bins = [(0, i, []) for i in range(min(count, len(files)))]
+    for file in sorted(files, key=lambda f: f.stat.st_size, reverse=True):
+        size, i, chunk = heapq.heappop(bins)
+        chunk.append(file)
+        heapq.heappush(bins, (size + file.stat.st_size, i, chunk))
+    return [chunk for _, _, chunk in sorted(bins, key=lambda b: b[1]) if chunk]
+
+
+def _iter_chunk_results(chunks, query_cf):
+    """Результаты _parse_chunk по мере готовности; в пуле не больше окна пачек."""
+    pool = process_pool()
+    window = workers() * IN_FLIGHT_PER_WORKER
+    chunks = iter(chunks)
+    pending = set()
+    try:
+        while True:
+            for chunk in chunks:
+                pending.add(pool.submit(_parse_chunk, chunk, query_cf))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                yield future.result()
+    finally:
+        # Потребитель ушёл раньше (клиент отключился): незапущенные пачки не нужны.
+        for future in pending:
+            future.cancel()
+
+
+def iter_search_files(directory, query_cf='', cache=file_cache):
+    """
+    Записи файлов каталога, подходящие под запрос, непустыми списками SaleData.
+
+    ``query_cf`` — запрос после casefold(); пустой — все записи.
+    Удалённые файлы выбрасываются из кэша, как при обычном обходе, —
+    после того как выдано всё.
+    """
+    stale = []
+    seen = set()
+    for file in cache.listing(directory):
+        seen.add(file.path)
+        cached = cache.peek(file)
+        if cached is None:
+            stale.append(file)
+            continue
+        matched = [r for r in cached.records if r.matches(query_cf)]
+        if matched:
+            yield matched
+
+    threshold = getattr(settings, 'SALES_PARALLEL_PARSE_MIN_BYTES', 32 * 1024 * 1024)
+    if enabled() and len(stale) > 1 and sum(f.stat.st_size for f in stale) >= threshold:
+        by_path = {f.path: f for f in stale}
+        chunks = [[(f.path, f.format) for f in chunk]
+                  for chunk in split_by_size(stale, workers() * CHUNKS_PER_WORKER)]
+        for part in _iter_chunk_results(chunks, query_cf):
+            matched = []
+            for path, records, total in part:
+                if not query_cf:
+                    file = by_path[path]
+                    cache.store(CachedFile(
+                        file.filename, path, file.format, file.stat.st_mtime_ns, file.stat.st_size, records,
+                    ), scan=True)
+                note_file_records(total, parsed=True)
+                matched.extend(records)
+            if matched:
+                yield matched
+    else:
+        for file in stale:
+            matched = [r for r in cache.lookup(file, scan=True).records if r.matches(query_cf)]
+            if matched:
+                yield matched
+
+    cache.prune(directory, seen)
+
+
+def search_files(directory, query_cf='', cache=file_cache):
+    """Все записи iter_search_files одним списком (для пагинации с сортировкой)."""
+    return [record for batch in iter_search_files(directory, query_cf, cache) for record in batch]
@@ -0,0 +1,51 @@
+"""
+Кэш готовых ответов index и search_sales.
+
+Ответы хранятся в кэше Django с алиасом SALES_RESPONSE_CACHE (в settings —
+LocMemCache с вытеснением давно не использованных записей, число записей
+ограничено). Ключ складывается из версии данных (data_version) и
+параметров запроса, влияющих на ответ, поэтому любая запись делает все
+прежние ответы недостижимыми, а повторная загрузка страницы без
+изменений не разбирает файлы, не ходит в БД и не рендерит шаблон.
+
+Ответы с ошибками не кэшируются. Из того же ключа получается ETag
+ответа search_sales: клиент с совпавшим If-None-Match получает 304, не
+дожидаясь даже обращения к кэшу.
+"""
+
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _cache():
+    return caches[getattr(settings, 'SALES_RESPONSE_CACHE', 'sales_responses')]
+
+
+def _digest(version, params, names):
+    query = urlencode([(name, params.get(name, '')) for name in names])
+    return hashlib.sha1(f'{version}?{query}'.encode('utf-8')).hexdigest()
+
+
+def cache_key(view, version, params, names):
+    """Ключ ответа представления ``view`` для значений параметров ``names`` из QueryDict ``params``."""
+    return f'sales:{view}:{_digest(version, params, names)}'
+
+
+def etag(view, version, params, names):
+    """Сильный ETag ответа с тем же ключом, что и cache_key."""
+    return f'"{view}-{_digest(version, params, names)}"'
+
+
+async def aget(key):
+    return await _cache().aget(key)
+
+
+async def aset(key, value):
+    await _cache().aset(key, value)
+
+
+def clear():
+    _cache().clear()
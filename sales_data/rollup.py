@@ -0,0 +1,153 @@
+"""
+Дневные сводки продаж из БД: таблица SaleDailyRollup.
+
+Строка сводки — число продаж, сумма количества и выручка за день по
+продукту. День считается в часовом поясе TIME_ZONE из настроек. Сводки
+обновляются в той же транзакции, что и сами продажи (add_sale, edit_sale,
+delete_db_sale, пакетный импорт), поэтому аналитика по длинным периодам
+читает тысячи строк сводки вместо миллионов продаж.
+
+Полная пересборка и проверка расхождений — ``manage.py rebuild_rollup``.
+"""
+
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Sale, SaleDailyRollup
+
+
+REBUILD_BATCH_SIZE = 1000
+
+_CENT = Decimal('0.01')
+
+Drift = namedtuple('Drift', 'day product_name expected actual')
+
+
+def sale_day(sale_date):
+    """День продажи в часовом поясе TIME_ZONE."""
+    return timezone.localtime(sale_date, timezone.get_default_timezone()).date()
+
+
+def _changes(added=(), removed=()):
+    changes = {}
+    for sales, sign in ((added, 1), (removed, -1)):
+        for sale in sales:
+            key = (sale_day(sale.sale_date), sale.product_name)
+            quantity = int(sale.quantity)
+            delta = changes.setdefault(key, [0, 0, Decimal(0)])
+            delta[0] += sign
+            delta[1] += sign * quantity
+            delta[2] += sign * quantity * Decimal(sale.price)
+    return {key: delta for key, delta in changes.items() if any(delta)}
+
+
+def _apply(changes):
+    days = {day for day, _ in changes}
+    products = {product for _, product in changes}
+    rows = {
+        (row.day, row.product_name): row
+        for row in SaleDailyRollup.objects.select_for_update().filter(day__in=days, product_name__in=products)
+        if (row.day, row.product_name) in changes
+    }
+
+    updated, created, emptied = [], [], []
+    for key, (count, quantity, revenue) in changes.items():
+        row = rows.get(key)
+        if row is None:
+            row = SaleDailyRollup(day=key[0], product_name=key[1])
+            created.append(row)
+        else:
+            updated.append(row)
+        row.sale_count += count
+        row.quantity_sum += quantity
+        row.revenue_sum = (Decimal(row.revenue_sum) + revenue).quantize(_CENT)
+        if row.sale_count <= 0 and row.pk is not None:
+            emptied.append(row.pk)
+
+    if updated:
+        SaleDailyRollup.objects.bulk_update(updated, ['sale_count', 'quantity_sum', 'revenue_sum'])
+    if emptied:
+        SaleDailyRollup.objects.filter(pk__in=emptied).delete()
+    created = [row for row in created if row.sale_count > 0]
+    if created:
+        SaleDailyRollup.objects.bulk_create(created)
+
+
+def apply(added=(), removed=()):
+    """
+    Учитывает в сводках добавленные и удалённые продажи.
+
+    Принимает любые объекты с полями Sale (экземпляры модели или их копии
+    со старыми значениями). Вызывать внутри транзакции, меняющей продажи.
+    """
+    changes = _changes(added, removed)
+    if not changes:
+        return
+    try:
+        with transaction.atomic():
+            _apply(changes)
+    except IntegrityError:
+        # Параллельный запрос успел создать ту же строку сводки — теперь
+        # она существует и будет заблокирована и обновлена.
+        with transaction.atomic():
+            _apply(changes)
+
+
+def _expected_rows():
+    revenue = ExpressionWrapper(F('quantity') * F('price'), output_field=DecimalField(max_digits=20, decimal_places=2))
+    return (
+        Sale.objects.order_by()
+        .annotate(day=TruncDate('sale_date', tzinfo=timezone.get_default_timezone()))
+        .values('day', 'product_name')
+        .annotate(sale_count=Count('id'), quantity_sum=Sum('quantity'), revenue_sum=Sum(revenue))
+        .order_by('day', 'product_name')
+    )
+
+
+def _totals(count, quantity, revenue):
+    return (count, quantity or 0, Decimal(revenue or 0).quantize(_CENT))
+
+
+def rebuild():
+    """Пересобирает сводки по таблице Sale; возвращает число строк сводки."""
+    total = 0
+    with transaction.atomic():
+        SaleDailyRollup.objects.all().delete()
+        batch = []
+        for row in _expected_rows().iterator():
+            count, quantity, revenue = _totals(row['sale_count'], row['quantity_sum'], row['revenue_sum'])
+            batch.append(SaleDailyRollup(
+                day=row['day'], product_name=row['product_name'],
+                sale_count=count, quantity_sum=quantity, revenue_sum=revenue,
+            ))
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                SaleDailyRollup.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        SaleDailyRollup.objects.bulk_create(batch)
+        total += len(batch)
+    return total
+
+
+def find_drift():
+    """Список Drift для строк, где сводка не совпадает с таблицей Sale."""
+    expected = {
+        (row['day'], row['product_name']): _totals(row['sale_count'], row['quantity_sum'], row['revenue_sum'])
+        for row in _expected_rows().iterator()
+    }
+    actual = {
+        (day, product): _totals(count, quantity, revenue)
+        for day, product, count, quantity, revenue in SaleDailyRollup.objects.values_list(
+            'day', 'product_name', 'sale_count', 'quantity_sum', 'revenue_sum',
+        ).iterator()
+    }
+    return [
+        Drift(day, product, expected.get((day, product)), actual.get((day, product)))
+        for day, product in sorted(expected.keys() | actual.keys())
+        if expected.get((day, product)) != actual.get((day, product))
+    ]
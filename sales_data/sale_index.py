@@ -0,0 +1,149 @@
+"""
+Постоянный индекс «id продажи → место в файле» для каталога uploads/.
+
+Индекс хранится в SQLite-файле рядом с загруженными файлами и позволяет
+редактировать и удалять файловые продажи без обхода всех файлов.
+Позиция — номер записи среди продаж файла в порядке разбора.
+Индекс можно пересобрать командой ``manage.py rebuild_sale_index``; время
+последней пересборки хранится в индексе (rebuilt_at): файлы старше него
+индекс уже покрывает.
+
+Соединение с файлом индекса одно на поток и открывается один раз, вместе с
+PRAGMA и созданием таблицы; если файл удалён или заменён, соединение
+открывается заново.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from .file_cache import parse_sale_file
+from .shards import file_format, iter_entries
+
+
+INDEX_FILENAME = '.sale_index.sqlite3'
+
+SaleLocation = namedtuple('SaleLocation', 'filename format position')
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS sale_locations ('
+    ' sale_id TEXT PRIMARY KEY,'
+    ' filename TEXT NOT NULL,'
+    ' format TEXT NOT NULL,'
+    ' position INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS sale_locations_filename ON sale_locations (filename)',
+    'CREATE TABLE IF NOT EXISTS index_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)',
+)
+
+
+_local = threading.local()
+
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def _connection(path):
+    """Соединение текущего потока с файлом индекса ``path``."""
+    connections = getattr(_local, 'connections', None)
+    # После fork соединения родителя использовать нельзя.
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+    cached = connections.get(path)
+    if cached is not None:
+        conn, inode = cached
+        if inode == _inode(path):
+            return conn
+        conn.close()
+        # Заодно закрываем соединения с индексами удалённых каталогов.
+        for other in [p for p in connections if p != path and _inode(p) is None]:
+            connections.pop(other)[0].close()
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL')
+    for statement in _SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    connections[path] = (conn, _inode(path))
+    return conn
+
+
+class SaleLocationIndex:
+    """Индекс мест хранения продаж в файлах одного каталога."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_FILENAME)
+
+    def _connect(self):
+        return _connection(self.path)
+
+    @staticmethod
+    def _rows(filename, fmt, sale_ids):
+        for position, sale_id in enumerate(sale_ids):
+            if sale_id is not None:
+                yield str(sale_id), filename, fmt, position
+
+    def lookup(self, sale_id):
+        """Возвращает SaleLocation или None, если id в индексе нет."""
+        row = self._connect().execute(
+            'SELECT filename, format, position FROM sale_locations WHERE sale_id = ?',
+            (sale_id,),
+        ).fetchone()
+        return SaleLocation(*row) if row else None
+
+    def index_ids(self, filename, fmt, sale_ids):
+        """Заменяет записи индекса для файла по id его продаж в порядке следования."""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sale_locations WHERE filename = ?', (filename,))
+            conn.executemany(
+                'INSERT OR REPLACE INTO sale_locations VALUES (?, ?, ?, ?)',
+                self._rows(filename, fmt, sale_ids),
+            )
+
+    def index_sale(self, sale_id, filename, fmt, position):
+        """Добавляет одну продажу, не трогая остальные записи файла (дописывание в сегмент)."""
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sale_locations VALUES (?, ?, ?, ?)',
+                (str(sale_id), filename, fmt, position),
+            )
+
+    def remove_sale(self, sale_id):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sale_locations WHERE sale_id = ?', (sale_id,))
+
+    def index_file(self, filename, fmt, records):
+        """Заменяет записи индекса для файла по списку его продаж."""
+        self.index_ids(filename, fmt, [record.id for record in records])
+
+    def remove_file(self, filename):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sale_locations WHERE filename = ?', (filename,))
+
+    def rebuilt_at(self):
+        """Время начала последней пересборки (нс, как st_mtime_ns) или 0, если её не было."""
+        row = self._connect().execute("SELECT value FROM index_meta WHERE key = 'rebuilt_at'").fetchone()
+        return row[0] if row else 0
+
+    def rebuild(self):
+        """Пересобирает индекс по содержимому каталога; возвращает число записей."""
+        total = 0
+        # Файл, изменённый во время обхода, может не попасть в индекс: отметка
+        # ставится до обхода, чтобы такие файлы считались новее пересборки.
+        started = time.time_ns()
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sale_locations')
+            conn.execute("INSERT OR REPLACE INTO index_meta VALUES ('rebuilt_at', ?)", (started,))
+            for entry in iter_entries(self.directory):
+                fmt = file_format(entry.name)
+                records = parse_sale_file(entry.path, fmt)
+                rows = list(self._rows(entry.name, fmt, [record.id for record in records]))
+                conn.executemany('INSERT OR REPLACE INTO sale_locations VALUES (?, ?, ?, ?)', rows)
+                total += len(rows)
+        return total
@@ -0,0 +1,346 @@
+"""
+Сегменты продаж, добавленных через форму в режиме «файл».
+
+Вместо отдельного файла на каждую продажу add_sale дописывает строку в
+активный сегмент — NDJSON-файл ``segment_<время>_<суффикс>.ndjson`` в
+шардах uploads/ (см. shards), по продаже в строке. Запись идёт под
+файловой блокировкой ``uploads/.segments.lock`` (fcntl.flock), поэтому
+воркеры сервера и watch_uploads не перемешивают строки. Активный сегмент
+записан в ``uploads/.segments.active``; новый начинается, когда текущий
+вырос до SALES_SEGMENT_MAX_BYTES или старше SALES_SEGMENT_MAX_AGE секунд.
+
+Сегменты только дописываются. Правка продажи дописывает в её сегмент
+новую версию записи с тем же id — при чтении она заменяет прежнюю на её
+месте; удаление дописывает надгробие ``{"id": ..., "_deleted": true}``.
+compact() в фоне переписывает закрытые сегменты и мелкие файлы
+``sale_*.json``/``sale_*.xml`` (их создавала add_sale раньше) в новые
+сегменты, выбрасывая удалённые и заменённые записи. Старый файл читается
+и удаляется под его блокировкой file_writer.locked, поэтому правка этого
+файла в другом воркере либо успевает до сжатия, либо ждёт и получает
+FileNotFoundError — представления тогда повторяют её по индексу, уже в
+новом сегменте.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+
+from . import downloads, file_writer, shards
+from .compressed import open_read
+from .streaming import iter_file_records
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка действует только внутри процесса
+    fcntl = None
+
+
+SEGMENT_PREFIX = 'segment_'
+LEGACY_PREFIX = 'sale_'
+LOCK_FILENAME = '.segments.lock'
+ACTIVE_FILENAME = '.segments.active'
+TOMBSTONE = '_deleted'
+# Старых файлов в пачке сжатия не больше этого: каждый держится открытым под блокировкой.
+LEGACY_BATCH_FILES = 256
+
+logger = logging.getLogger(__name__)
+
+_process_lock = threading.Lock()
+
+
+def is_segment(filename):
+    return filename.startswith(SEGMENT_PREFIX) and shards.file_format(filename) == 'ndjson'
+
+
+def max_bytes():
+    return getattr(settings, 'SALES_SEGMENT_MAX_BYTES', 8 * 1024 * 1024)
+
+
+def max_age():
+    return getattr(settings, 'SALES_SEGMENT_MAX_AGE', 3600)
+
+
+@contextmanager
+def locked(directory):
+    """Исключительная блокировка записи в сегменты каталога."""
+    if fcntl is None:
+        with _process_lock:
+            yield
+        return
+    with open(os.path.join(directory, LOCK_FILENAME), 'a+b') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_segment(path):
+    """
+    Действующие записи сегмента в порядке появления и число строк, которые
+    выбросит сжатие (удалённые и заменённые версии).
+    """
+    live = {}
+    lines = 0
+    with open(path, 'rb') as f:
+        for number, line in enumerate(f):
+            if not line.strip():
+                continue
+            lines += 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Оборванная строка: процесс упал посреди записи.
+                continue
+            if not isinstance(record, dict):
+                continue
+            sale_id = record.get('id')
+            key = str(sale_id) if sale_id is not None else ('line', number)
+            if record.get(TOMBSTONE):
+                live.pop(key, None)
+            else:
+                live[key] = record
+    return list(live.values()), lines - len(live)
+
+
+def _encode(records):
+    return b''.join(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n' for record in records)
+
+
+def _append(path, data, create=False):
+    flags = os.O_RDWR | os.O_APPEND | getattr(os, 'O_BINARY', 0) | (os.O_CREAT if create else 0)
+    fd = os.open(path, flags, 0o644)
+    try:
+        if os.fstat(fd).st_size:
+            os.lseek(fd, -1, os.SEEK_END)
+            if os.read(fd, 1) != b'\n':
+                # Не склеиваем новую строку с оборванным хвостом.
+                data = b'\n' + data
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def _read_active(directory):
+    try:
+        with open(os.path.join(directory, ACTIVE_FILENAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_active(directory, state):
+    path = os.path.join(directory, ACTIVE_FILENAME)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def active_segment(directory):
+    """Имя активного сегмента каталога или None."""
+    state = _read_active(directory)
+    return state['filename'] if state else None
+
+
+def _current(directory, now):
+    """Состояние активного сегмента (filename, created, lines); при необходимости начинает новый."""
+    state = _read_active(directory)
+    if state is not None and now - state['created'] < max_age():
+        try:
+            if os.path.getsize(shards.shard_path(directory, state['filename'])) < max_bytes():
+                return state
+        except FileNotFoundError:
+            pass
+    return {'filename': new_segment_name(now), 'created': now, 'lines': 0}
+
+
+def new_segment_name(now=None):
+    stamp = time.strftime('%Y%m%d%H%M%S', time.gmtime(now))
+    return f'{SEGMENT_PREFIX}{stamp}_{uuid.uuid4().hex[:8]}.ndjson'
+
+
+def append(directory, record):
+    """
+    Дописывает продажу в активный сегмент каталога.
+
+    Возвращает (имя сегмента, номер строки) — номер служит подсказкой
+    позиции для индекса продаж.
+    """
+    with locked(directory):
+        state = _current(directory, time.time())
+        path = shards.path_for_write(directory, state['filename'])
+        _append(path, _encode([record]), create=True)
+        position = state['lines']
+        state['lines'] += 1
+        _write_active(directory, state)
+    return state['filename'], position
+
+
+def _append_to(path, record):
+    directory = shards.root_of(path)
+    with locked(directory):
+        # Без O_CREAT: если сегмент успели сжать, правка не должна создать пустой файл с ней одной.
+        _append(path, _encode([record]))
+        state = _read_active(directory)
+        if state is not None and state['filename'] == os.path.basename(path):
+            state['lines'] += 1
+            _write_active(directory, state)
+
+
+def supersede(path, record):
+    """Дописывает в сегмент новую версию продажи (тот же id)."""
+    _append_to(path, record)
+
+
+def delete(path, sale_id):
+    """Дописывает в сегмент надгробие продажи."""
+    _append_to(path, {'id': sale_id, TOMBSTONE: True})
+
+
+def _is_legacy(name):
+    return name.startswith(LEGACY_PREFIX) and shards.file_format(name) in ('json', 'xml')
+
+
+def _candidates(directory, active):
+    """Файлы для сжатия: старые файлы add_sale и закрытые сегменты, которые стоит переписать."""
+    small = max_bytes() // 2
+    for entry in shards.iter_entries(directory):
+        name = entry.name
+        if name == active:
+            continue
+        if _is_legacy(name):
+            yield entry
+        elif is_segment(name):
+            try:
+                if entry.stat().st_size < small:
+                    yield entry
+                # Большой сегмент переписываем, только если в нём есть что выбросить.
+                elif read_segment(entry.path)[1]:
+                    yield entry
+            except FileNotFoundError:
+                continue
+
+
+def _live_records(entry):
+    fmt = shards.file_format(entry.name)
+    if fmt == 'ndjson':
+        return read_segment(entry.path)
+    with open_read(entry.path) as f:
+        records = [record for record in iter_file_records(f, fmt) if isinstance(record, dict)]
+    return records, 0
+
+
+def _write_segment(directory, records, index):
+    filename = new_segment_name()
+    path = shards.path_for_write(directory, filename)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_encode(records))
+    os.replace(tmp_path, path)
+    index.index_ids(filename, 'ndjson', [record.get('id') for record in records])
+    return filename
+
+
+def _merge_records(records, origins, live, source):
+    """
+    Добавляет записи файла ``source`` к пачке ``records`` (ключ — id).
+
+    Продажа с id, уже встреченным в другом файле пачки, заменяет прежнюю на
+    её месте — как новая версия в сегменте; об этом пишется в лог.
+    Возвращает число заменённых записей.
+    """
+    replaced = 0
+    for record in live:
+        sale_id = record.get('id')
+        if sale_id is None:
+            records[('line', len(records))] = record
+            continue
+        key = str(sale_id)
+        previous = origins.get(key)
+        if previous is not None and previous != source:
+            logger.warning('Sale %s is in both %s and %s; keeping the version from %s',
+                           sale_id, previous, source, source)
+        origins[key] = source
+        replaced += key in records
+        records[key] = record
+    return replaced
+
+
+def _compact_batch(directory, batch, index):
+    """Переписывает пачку файлов в один сегмент; возвращает (файлов, выброшено записей)."""
+    merged = dropped = 0
+    records = {}
+    sources = []
+    origins = {}
+    with locked(directory), ExitStack() as file_locks:
+        active = active_segment(directory)
+        for entry in batch:
+            if entry.name == active:
+                continue
+            # Читаем под блокировкой: правки дописываются и в закрытые сегменты, а старые
+            # файлы правит file_writer под блокировкой самого файла — держим её до удаления.
+            try:
+                if _is_legacy(entry.name):
+                    file_locks.enter_context(file_writer.locked(entry.path))
+                live, dead = _live_records(entry)
+            except FileNotFoundError:
+                continue
+            except (ValueError, ET.ParseError):
+                # Повреждённый старый файл не трогаем: его записи не восстановить.
+                continue
+            sources.append(entry)
+            dropped += dead + _merge_records(records, origins, live, entry.name)
+        if records:
+            _write_segment(directory, list(records.values()), index)
+        # Старые файлы удаляем после записи нового сегмента: читатель может на
+        # мгновение увидеть продажи дважды, но не потеряет их.
+        for entry in sources:
+            os.remove(entry.path)
+            downloads.remove_variant(entry.path)
+            index.remove_file(entry.name)
+            merged += 1
+    return merged, dropped
+
+
+def compact(directory, index):
+    """
+    Сливает закрытые сегменты и старые файлы add_sale в новые сегменты.
+
+    Пачки не больше SALES_SEGMENT_MAX_BYTES; блокировка берётся на каждую
+    пачку отдельно, чтобы не задерживать add_sale. Индекс продаж ``index``
+    (SaleLocationIndex) обновляется. Возвращает (слито файлов, выброшено
+    записей).
+    """
+    active = active_segment(directory)
+    candidates = list(_candidates(directory, active))
+    # Одиночный мелкий сегмент переписывать незачем: он не сольётся ни с чем.
+    if len(candidates) == 1 and is_segment(candidates[0].name) and not read_segment(candidates[0].path)[1]:
+        return 0, 0
+    merged = dropped = 0
+    batch = []
+    batch_bytes = 0
+    legacy = 0
+    for entry in candidates:
+        try:
+            size = entry.stat().st_size
+        except FileNotFoundError:
+            continue
+        if batch and (batch_bytes + size > max_bytes() or legacy >= LEGACY_BATCH_FILES):
+            counts = _compact_batch(directory, batch, index)
+            merged, dropped = merged + counts[0], dropped + counts[1]
+            batch, batch_bytes, legacy = [], 0, 0
+        batch.append(entry)
+        batch_bytes += size
+        legacy += _is_legacy(entry.name)
+    if batch:
+        counts = _compact_batch(directory, batch, index)
+        merged, dropped = merged + counts[0], dropped + counts[1]
+    return merged, dropped
@@ -0,0 +1,167 @@
+"""
+Раскладка каталога uploads/ по подкаталогам-шардам.
+
+Файл ``name`` лежит в ``uploads/ab/cd/name``, где ``abcd`` — первые четыре
+шестнадцатеричных знака sha1 от имени. Имя остаётся идентификатором файла
+(в URL, индексе продаж и хранилище watch_uploads), а путь вычисляется по
+имени, поэтому найти файл можно без листинга каталога.
+
+Файлы, лежащие прямо в uploads/ (записанные до перехода на шарды или
+положенные туда вручную), тоже находятся и перечисляются;
+``manage.py shard_uploads`` переносит их в шарды.
+
+Обход идёт по одному шарду за раз в порядке (шард, имя) и не собирает
+весь каталог в память; page_files отдаёт страницу файлов после курсора,
+не читая шарды до него.
+"""
+
+import hashlib
+import os
+from itertools import islice
+
+from .compressed import compression_of, strip_suffix
+
+
+_HEX = frozenset('0123456789abcdef')
+
+
+def file_format(filename):
+    """
+    Формат файла продаж по расширению: 'json', 'xml', 'ndjson' (сегменты) или None.
+
+    Суффикс сжатия (.gz, .zst) у JSON и XML не учитывается (см. compressed).
+    Скрытые файлы (временные, сжатые копии для скачивания) — не файлы продаж.
+    """
+    if os.path.basename(filename).startswith('.'):
+        return None
+    compressed = compression_of(filename) is not None
+    filename = strip_suffix(filename)
+    if filename.endswith('.json'):
+        return 'json'
+    if filename.endswith('.xml'):
+        return 'xml'
+    if filename.endswith('.ndjson') and not compressed:
+        return 'ndjson'
+    return None
+
+
+def shard_of(filename):
+    """Относительный путь шарда для имени файла: 'ab/cd'."""
+    digest = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+    return f'{digest[:2]}/{digest[2:4]}'
+
+
+def shard_path(directory, filename):
+    first, second = shard_of(filename).split('/')
+    return os.path.join(directory, first, second, filename)
+
+
+def root_of(path):
+    """Каталог uploads/, к которому относится путь файла (в шарде или в корне)."""
+    parent, second = os.path.split(os.path.dirname(path))
+    root, first = os.path.split(parent)
+    if f'{first}/{second}' == shard_of(os.path.basename(path)):
+        return root
+    return os.path.dirname(path)
+
+
+def path_for_write(directory, filename):
+    """Путь для нового файла; каталог шарда создаётся при необходимости."""
+    path = shard_path(directory, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def locate(directory, filename):
+    """Путь существующего файла (в шарде или в корне каталога) или None."""
+    for path in (shard_path(directory, filename), os.path.join(directory, filename)):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def is_shard_name(name):
+    return len(name) == 2 and _HEX.issuperset(name)
+
+
+def _subdirs(path, start=''):
+    try:
+        with os.scandir(path) as it:
+            names = [entry.name for entry in it if is_shard_name(entry.name) and entry.is_dir()]
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if name >= start)
+
+
+def _sale_entries(path):
+    try:
+        with os.scandir(path) as it:
+            entries = [entry for entry in it if file_format(entry.name) and entry.is_file()]
+    except FileNotFoundError:
+        return []
+    return sorted(entries, key=lambda entry: entry.name)
+
+
+def iter_shard_dirs(directory):
+    """Пути существующих каталогов-шардов второго уровня в порядке обхода."""
+    for first in _subdirs(directory):
+        for second in _subdirs(os.path.join(directory, first)):
+            yield os.path.join(directory, first, second)
+
+
+def iter_entries(directory, after=''):
+    """
+    os.DirEntry файлов продаж: сначала корень каталога, затем шарды.
+
+    ``after`` — курсор (см. cursor_of): выдаются только файлы после него.
+    """
+    after_shard, _, after_name = after.rpartition('/')
+    start_first, _, start_second = after_shard.partition('/')
+    if not after_shard:
+        for entry in _sale_entries(directory):
+            if entry.name > after_name:
+                yield entry
+        after_name = ''
+    for first in _subdirs(directory, start_first):
+        second_start = start_second if first == start_first else ''
+        for second in _subdirs(os.path.join(directory, first), second_start):
+            skip_to = after_name if (first, second) == (start_first, start_second) else ''
+            for entry in _sale_entries(os.path.join(directory, first, second)):
+                if entry.name > skip_to:
+                    yield entry
+
+
+def cursor_of(directory, path):
+    """Курсор файла для iter_entries/page_files: 'ab/cd/name' или 'name' для корня."""
+    return os.path.relpath(path, directory).replace(os.sep, '/')
+
+
+def page_files(directory, after='', limit=100):
+    """Страница файлов продаж: (список os.DirEntry, курсор следующей страницы или None)."""
+    entries = list(islice(iter_entries(directory, after), limit + 1))
+    if len(entries) <= limit:
+        return entries, None
+    entries = entries[:limit]
+    return entries, cursor_of(directory, entries[-1].path)
+
+
+def move_into_shards(directory, dry_run=False):
+    """
+    Переносит файлы продаж из корня каталога в их шарды.
+
+    Имя файла не меняется, поэтому индекс продаж и хранилище watch_uploads
+    остаются верными. Файл, для которого в шарде уже есть одноимённый,
+    не трогается. Возвращает (перенесённые имена, пропущенные имена).
+    """
+    moved = []
+    skipped = []
+    for entry in _sale_entries(directory):
+        target = shard_path(directory, entry.name)
+        if os.path.exists(target):
+            skipped.append(entry.name)
+            continue
+        if not dry_run:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(entry.path, target)
+        moved.append(entry.name)
+    return moved, skipped
@@ -0,0 +1,246 @@
+"""
+Потоковый разбор файлов продаж по кускам.
+
+Парсеры принимают байты через ``feed()`` и сразу отдают разобранные
+продажи, поэтому в памяти держится только текущая запись, а не весь файл:
+
+* JSON — один объект или массив объектов; элементы массива декодируются
+  по одному через ``JSONDecoder.raw_decode``;
+* XML — ``<sale>`` или корень со списком ``<sale>``; используется
+  ``XMLPullParser`` (аналог ``iterparse`` для данных, приходящих кусками),
+  обработанные элементы очищаются.
+
+``aiter_sync`` отдаёт синхронный поток ответа (экспорт, файл) асинхронным
+итератором. Под ASGI Django иначе сначала собрал бы синхронный итератор
+StreamingHttpResponse целиком в список и только потом начал отправку.
+"""
+
+import codecs
+import json
+import re
+import threading
+import xml.etree.ElementTree as ET
+
+from asgiref.sync import sync_to_async
+
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Запись JSON (элемент массива или единственный объект документа), не
+# уместившаяся в этот объём, считается ошибкой разбора.
+MAX_RECORD_CHARS = 1024 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class UploadLimitExceeded(ValueError):
+    pass
+
+
+class JsonRecordParser:
+    """Инкрементальный разбор JSON-документа с продажами."""
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._state = 'start'
+
+    def _error(self, msg):
+        return json.JSONDecodeError(msg, self._buffer, self._pos)
+
+    def _skip_whitespace(self):
+        self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+        return self._pos < len(self._buffer)
+
+    def _decode_item(self, final):
+        buffer, pos = self._buffer, self._pos
+        try:
+            obj, end = self._decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            incomplete = e.msg.startswith('Unterminated string') or e.pos >= len(buffer) - 8
+            if final or not incomplete:
+                raise
+            if len(buffer) - pos > MAX_RECORD_CHARS:
+                raise self._error('JSON record is too large')
+            return None
+        # Число в конце буфера может продолжиться в следующем куске.
+        if end == len(buffer) and not final and buffer[pos] not in '{["':
+            return None
+        self._pos = end
+        return (obj,)
+
+    def _parse(self, final=False):
+        while True:
+            if self._state == 'single':
+                # Единственный объект разбирается в close(), до тех пор он копится в буфере.
+                if len(self._buffer) - self._pos > MAX_RECORD_CHARS:
+                    raise self._error('JSON record is too large')
+                return
+            if not self._skip_whitespace():
+                return
+            char = self._buffer[self._pos]
+            if self._state == 'start':
+                if char == '[':
+                    self._pos += 1
+                    self._state = 'first'
+                else:
+                    self._state = 'single'
+            elif self._state == 'first' and char == ']':
+                self._pos += 1
+                self._state = 'end'
+            elif self._state in ('first', 'item'):
+                decoded = self._decode_item(final)
+                if decoded is None:
+                    return
+                self._state = 'separator'
+                yield decoded[0]
+            elif self._state == 'separator':
+                if char == ',':
+                    self._pos += 1
+                    self._state = 'item'
+                elif char == ']':
+                    self._pos += 1
+                    self._state = 'end'
+                else:
+                    raise self._error("Expecting ',' delimiter")
+            else:
+                raise self._error('Extra data')
+
+    def _append(self, text):
+        # Сдвигаем буфер только при поступлении нового куска, а не после каждой записи.
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+
+    def _decode(self, data, final=False):
+        # UnicodeDecodeError — тоже ValueError, но обработчики ждут JSONDecodeError:
+        # файл не в UTF-8 — такая же ошибка формата, как битый JSON.
+        try:
+            return self._text.decode(data, final)
+        except UnicodeDecodeError as e:
+            raise self._error(f'Invalid UTF-8 ({e.reason})') from e
+
+    def feed(self, data):
+        self._append(self._decode(data))
+        yield from self._parse()
+
+    def close(self):
+        self._append(self._decode(b'', final=True))
+        yield from self._parse(final=True)
+        if self._state == 'single':
+            yield json.loads(self._buffer[self._pos:])
+        elif self._state != 'end':
+            raise self._error('Unexpected end of JSON data')
+
+
+class XmlRecordParser:
+    """Инкрементальный разбор XML-документа с продажами."""
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._root = None
+        self._depth = 0
+
+    @staticmethod
+    def _to_dict(elem):
+        return {child.tag: child.text for child in elem}
+
+    def _events(self):
+        for event, elem in self._parser.read_events():
+            if event == 'start':
+                if self._root is None:
+                    self._root = elem
+                self._depth += 1
+                continue
+            self._depth -= 1
+            if self._depth == 0 and elem.tag == 'sale':
+                yield self._to_dict(elem)
+            elif self._depth == 1 and elem.tag == 'sale' and self._root.tag != 'sale':
+                yield self._to_dict(elem)
+                # Обработанные записи больше не нужны — освобождаем память.
+                self._root.clear()
+
+    def feed(self, data):
+        self._parser.feed(data)
+        yield from self._events()
+
+    def close(self):
+        self._parser.close()
+        yield from self._events()
+
+
+def record_parser(fmt):
+    return JsonRecordParser() if fmt == 'json' else XmlRecordParser()
+
+
+def iter_file_records(fileobj, fmt, chunk_size=READ_CHUNK_SIZE):
+    """Потоково читает продажи из открытого в двоичном режиме файла."""
+    parser = record_parser(fmt)
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def buffered(parts, size=READ_CHUNK_SIZE):
+    """Склеивает мелкие строковые куски ответа в блоки байтов около ``size``."""
+    buffer = []
+    buffered_size = 0
+    for part in parts:
+        chunk = part.encode('utf-8')
+        buffer.append(chunk)
+        buffered_size += len(chunk)
+        if buffered_size >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered_size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+async def aiter_sync(iterator, thread_sensitive=False):
+    """
+    Асинхронный итератор поверх синхронного: каждый кусок берётся через sync_to_async.
+
+    ``thread_sensitive=True`` — для итераторов, читающих БД серверным курсором:
+    все шаги идут в потоке запроса, где открыто соединение. В конце или при
+    отключении клиента итератор закрывается (генератор — через close()),
+    но не посреди шага, который ещё выполняется в потоке.
+    """
+    iterator = iter(iterator)
+    lock = threading.Lock()
+    finished = object()
+
+    def step():
+        with lock:
+            return next(iterator, finished)
+
+    def close():
+        with lock:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    try:
+        while (part := await sync_to_async(step, thread_sensitive=thread_sensitive)()) is not finished:
+            yield part
+    finally:
+        await sync_to_async(close, thread_sensitive=thread_sensitive)()
+
+
+async def abuffered(parts, size=READ_CHUNK_SIZE):
+    """То же, что buffered, для асинхронного итератора кусков."""
+    buffer = []
+    buffered_size = 0
+    async for part in parts:
+        chunk = part.encode('utf-8')
+        buffer.append(chunk)
+        buffered_size += len(chunk)
+        if buffered_size >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered_size = 0
+    if buffer:
+        yield b''.join(buffer)
@@ -1,9 +1,87 @@
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.core import signals
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+from django.db.models import QuerySet
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.contrib.messages import get_messages
 from django.urls import reverse
-from .models import Sale
+from .models import Sale, SaleDailyRollup, SaleData, SaleQuerySet
 from .forms import SaleForm, SaleEditForm
+from . import (
+    analytics, benchmark, columnar, compressed, data_version, downloads, file_writer, importer, metrics, parallel,
+    pagination, response_cache, rollup, segments, shards, streaming, views,
+)
+from . import file_cache as file_cache_module
+from .file_cache import FileRecordCache, file_cache
+from . import sale_index as sale_index_module
+from .sale_index import SaleLocationIndex
+from .upload_store import UploadStore
+from .watcher import Inotify, UploadWatcher
+from .streaming import JsonRecordParser
+from .dates import DateParser, parse_date
+from sales_project.middleware import WhiteNoiseMiddleware
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from io import StringIO
+from unittest import mock
+import gzip
+import multiprocessing
+import numpy as np
+import json
+import os
+import xml.etree.ElementTree as ET
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
 import uuid
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from django.utils import timezone
+
+
+class TempUploadDirMixin:
+    """Подменяет каталог uploads/ временным каталогом на время теста"""
+
+    def setUp(self):
+        super().setUp()
+        self.upload_dir = tempfile.mkdtemp()
+        patcher = mock.patch.object(views, 'UPLOAD_DIR', self.upload_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.upload_dir, ignore_errors=True)
+        file_cache.clear()
+        self.addCleanup(file_cache.clear)
+        self.addCleanup(columnar.snapshots.clear)
+        response_cache.clear()
+        self.addCleanup(response_cache.clear)
+
+    def write_json(self, filename, data):
+        path = os.path.join(self.upload_dir, filename)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        # Как watch_uploads: файл, положенный мимо представлений, меняет версию данных.
+        data_version.bump(self.upload_dir)
+        return path
+
+    def make_sale(self, **overrides):
+        sale = {
+            'id': str(uuid.uuid4()),
+            'product_name': 'Файловый продукт',
+            'quantity': 2,
+            'price': 10.5,
+            'sale_date': '2025-08-04T13:10:00+00:00',
+            'customer_name': 'Клиент',
+            'customer_email': 'file@example.com',
+        }
+        sale.update(overrides)
+        return sale
 
 class SaleModelTest(TestCase):
     def setUp(self):
@@ -30,6 +108,30 @@ class SaleModelTest(TestCase):
         self.assertIn('customer_name', sale_dict)
         self.assertIn('customer_email', sale_dict)
 
+class SaleSearchTest(TestCase):
+    def setUp(self):
+        for product, email in (('Груша', 'a@example.com'), ('Laptop', 'b@example.com'), ('Сыр', 'pear@example.com')):
+            Sale.objects.create(
+                product_name=product, quantity=1, price=10, sale_date=timezone.now(),
+                customer_name='Клиент', customer_email=email,
+            )
+
+    def test_search_is_case_insensitive_for_cyrillic(self):
+        """Поиск по кириллице не зависит от регистра"""
+        names = list(Sale.objects.search('гРУША').values_list('product_name', flat=True))
+        self.assertEqual(names, ['Груша'])
+
+    def test_search_matches_any_field(self):
+        """Поиск идёт по продукту, имени и email клиента"""
+        self.assertEqual(Sale.objects.search('LAPTOP').count(), 1)
+        self.assertEqual(Sale.objects.search('pear@').get().product_name, 'Сыр')
+        self.assertEqual(Sale.objects.search('клиент').count(), 3)
+        self.assertEqual(Sale.objects.search('').count(), 3)
+
+    def test_search_escapes_regex_characters(self):
+        """Спецсимволы в запросе ищутся буквально"""
+        self.assertEqual(Sale.objects.search('г.уша').count(), 0)
+
 class SaleFormTest(TestCase):
     def test_sale_form_valid_data(self):
         form_data = {
@@ -57,7 +159,7 @@ class SaleFormTest(TestCase):
         self.assertIn('quantity', form.errors)
         self.assertIn('customer_email', form.errors)
 
-class ViewsTest(TestCase):
+class ViewsTest(TempUploadDirMixin, TestCase):
     def test_index_view(self):
         """Тест главной страницы"""
         response = self.client.get(reverse('index'))
@@ -73,4 +175,1759 @@ class ViewsTest(TestCase):
         """Тест поиска продаж"""
         response = self.client.get(reverse('search_sales'), {'q': 'тест'})
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response['Content-Type'], 'application/json')
\ No newline at end of file
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+class FileRecordCacheTest(TempUploadDirMixin, TestCase):
+    def test_reparses_only_changed_files(self):
+        """Неизменённые файлы не перечитываются, изменённые — перечитываются"""
+        self.write_json('a.json', self.make_sale())
+        path_b = self.write_json('b.json', [self.make_sale(), self.make_sale()])
+        cache = FileRecordCache()
+        parse = mock.Mock(wraps=file_cache_module.parse_sale_file)
+        with mock.patch.object(file_cache_module, 'parse_sale_file', parse):
+            cache.scan(self.upload_dir)
+            cache.scan(self.upload_dir)
+            self.assertEqual(parse.call_count, 2)
+
+            self.write_json('b.json', [self.make_sale()])
+            os.utime(path_b, ns=(0, 10 ** 18))
+            entries = cache.scan(self.upload_dir)
+            self.assertEqual(parse.call_count, 3)
+        self.assertEqual(sum(len(e.records) for e in entries), 2)
+
+    def test_drops_deleted_files(self):
+        """Записи удалённых файлов выбрасываются из кэша"""
+        path = self.write_json('a.json', self.make_sale())
+        cache = FileRecordCache()
+        cache.scan(self.upload_dir)
+        os.remove(path)
+        self.assertEqual(cache.scan(self.upload_dir), [])
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction_respects_record_limit(self):
+        """Кэш не держит больше записей, чем позволяет лимит"""
+        for name in ('a.json', 'b.json', 'c.json'):
+            self.write_json(name, [self.make_sale(), self.make_sale()])
+        cache = FileRecordCache(max_records=4)
+        cache.scan(self.upload_dir)
+        self.assertEqual(len(cache), 2)
+
+    def test_scan_larger_than_cache_keeps_cached_files(self):
+        """Обход каталога больше лимита не вытесняет кэш: повторный обход попадает в закэшированные файлы"""
+        for i in range(5):
+            self.write_json(f'{i}.json', self.make_sale())
+        cache = FileRecordCache(max_files=2)
+        parse = mock.Mock(wraps=file_cache_module.parse_sale_file)
+        with mock.patch.object(file_cache_module, 'parse_sale_file', parse):
+            self.assertEqual(len(cache.scan(self.upload_dir)), 5)
+            self.assertEqual(parse.call_count, 5)
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(len(cache.scan(self.upload_dir)), 5)
+            self.assertEqual(parse.call_count, 8)
+        # Одиночное чтение по-прежнему вытесняет по LRU.
+        cache.get(os.path.join(self.upload_dir, '4.json'))
+        self.assertIn(os.path.join(self.upload_dir, '4.json'), cache._entries)
+        self.assertEqual(len(cache), 2)
+
+    async def test_async_scan_bounds_files_in_flight(self):
+        """aiter_scan держит в пуле не больше окна файлов"""
+        for i in range(10):
+            self.write_json(f'{i}.json', self.make_sale())
+        cache = FileRecordCache()
+        started = []
+        load = cache._load
+
+        def slow_load(*args, **kwargs):
+            started.append(args[0])
+            time.sleep(0.01)
+            return load(*args, **kwargs)
+
+        with override_settings(SALES_FILE_PARSE_WORKERS=1), mock.patch.object(cache, '_load', slow_load):
+            scan = cache.aiter_scan(self.upload_dir)
+            await anext(scan)
+            self.assertLessEqual(len(started), file_cache_module.SCAN_IN_FLIGHT_PER_WORKER)
+            await scan.aclose()
+
+    def test_xml_records_are_normalized(self):
+        """Числа и даты из XML приводятся к типам"""
+        path = os.path.join(self.upload_dir, 'a.xml')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('<sale><id>x1</id><quantity>3</quantity><price>9.5</price>'
+                    '<sale_date>2025-08-04T13:10:00</sale_date></sale>')
+        record = file_cache.get(path).records[0]
+        self.assertEqual(record.quantity, 3)
+        self.assertEqual(record.price, 9.5)
+        self.assertIsInstance(record.sale_date, datetime)
+        self.assertEqual(record.source, 'file')
+
+    async def test_async_scan_parses_in_pool(self):
+        """aiter_scan выдаёт все файлы и выбрасывает удалённые"""
+        self.write_json('a.json', self.make_sale())
+        path_b = self.write_json('b.json', [self.make_sale(), self.make_sale()])
+        cache = FileRecordCache()
+        entries = [cached async for cached in cache.aiter_scan(self.upload_dir)]
+        self.assertEqual(sorted(e.filename for e in entries), ['a.json', 'b.json'])
+        self.assertEqual(sum(len(e.records) for e in entries), 3)
+
+        os.remove(path_b)
+        entries = [cached async for cached in cache.aiter_scan(self.upload_dir)]
+        self.assertEqual([e.filename for e in entries], ['a.json'])
+        self.assertEqual(len(cache), 1)
+
+
+class FileSalesViewsTest(TempUploadDirMixin, TestCase):
+    def test_search_finds_file_sales(self):
+        """Поиск находит продажи из файлов"""
+        self.write_json('a.json', [self.make_sale(product_name='Груша'), self.make_sale()])
+        response = self.client.get(reverse('search_sales'), {'q': 'груша', 'source': 'file'})
+        sales = response.json()['sales']
+        self.assertEqual(len(sales), 1)
+        self.assertEqual(sales[0]['product_name'], 'Груша')
+        self.assertEqual(sales[0]['source'], 'file')
+
+    def test_delete_sale_from_list_file(self):
+        """Удаление продажи из файла-списка не затрагивает остальные записи"""
+        keep, drop = self.make_sale(), self.make_sale()
+        self.write_json('a.json', [keep, drop])
+        self.client.get(reverse('search_sales'))
+        self.client.get(reverse('delete_sale', args=[drop['id']]))
+        ids = [s['id'] for s in self.client.get(reverse('search_sales')).json()['sales']]
+        self.assertEqual(ids, [keep['id']])
+
+    def test_delete_single_sale_file_removes_compressed_copy(self):
+        """Файл с единственной продажей удаляется вместе со сжатой копией .<имя>.gz"""
+        sale = self.make_sale()
+        path = self.write_json('single.json', sale)
+        downloads.precompress(path)
+        self.client.get(reverse('delete_sale', args=[sale['id']]))
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(downloads.variant_path(path)))
+
+    def test_edit_file_sale_get(self):
+        """Форма редактирования файловой продажи открывается"""
+        sale = self.make_sale()
+        self.write_json('a.json', sale)
+        response = self.client.get(reverse('edit_file_sale', args=[sale['id']]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '2025-08-04T13:10')
+
+    def test_delete_file_removed_concurrently(self):
+        """Файл, удалённый другим запросом после поиска, даёт «File not found.», а не ошибку"""
+        path = self.write_json('a.json', self.make_sale())
+        os.remove(path)
+        with mock.patch.object(shards, 'locate', return_value=path):
+            response = self.client.post(reverse('delete_file', args=['a.json']))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual([str(m) for m in get_messages(response.wsgi_request)], ['File not found.'])
+
+
+class ParallelParseTest(TempUploadDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_json('a.json', [self.make_sale(product_name='Груша'), self.make_sale(product_name='Слива')])
+        self.write_json('b.json', [self.make_sale(product_name='Груша'), self.make_sale(product_name='Яблоко')])
+        self.write_json('c.json', self.make_sale(product_name='Слива'))
+
+    @override_settings(SALES_PARSE_PROCESSES=2, SALES_PARALLEL_PARSE_MIN_BYTES=0)
+    def test_process_pool_returns_only_matches(self):
+        """Файлы разбираются в процессах, обратно приходят только подошедшие записи"""
+        self.addCleanup(parallel.shutdown)
+        cache = FileRecordCache()
+        matched = parallel.search_files(self.upload_dir, 'груша', cache=cache)
+        self.assertEqual(sorted(r.product_name for r in matched), ['Груша', 'Груша'])
+        self.assertEqual({r.source for r in matched}, {'file'})
+        self.assertEqual(len(cache), 0)
+
+        # Без запроса разобранные файлы целиком попадают в кэш, дальше процессы не нужны.
+        self.assertEqual(len(parallel.search_files(self.upload_dir, cache=cache)), 5)
+        self.assertEqual(len(cache), 3)
+        with mock.patch.object(parallel, 'process_pool') as pool:
+            matched = parallel.search_files(self.upload_dir, 'слива', cache=cache)
+        pool.assert_not_called()
+        self.assertEqual(len(matched), 2)
+
+    @override_settings(SALES_PARSE_PROCESSES=2, SALES_PARALLEL_PARSE_MIN_BYTES=0)
+    def test_iter_search_files_bounds_chunks_in_flight(self):
+        """Пачки выдаются по мере готовности, в пуле не больше окна пачек"""
+        for i in range(10):
+            self.write_json(f'extra_{i}.json', [self.make_sale(product_name='Груша')])
+        pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(pool.shutdown)
+        submitted = []
+        submit = pool.submit
+        pool.submit = lambda *args: submitted.append(args) or submit(*args)
+        with mock.patch.object(parallel, 'process_pool', return_value=pool):
+            batches = parallel.iter_search_files(self.upload_dir, 'груша', cache=FileRecordCache())
+            first = next(batches)
+            self.assertTrue(first)
+            self.assertLessEqual(len(submitted), 2 * parallel.IN_FLIGHT_PER_WORKER)
+            rest = [record for batch in batches for record in batch]
+        self.assertEqual(len(first) + len(rest), 12)
+        self.assertEqual(len(submitted), 2 * parallel.CHUNKS_PER_WORKER)
+
+    @override_settings(SALES_PARSE_PROCESSES=2)
+    def test_small_directory_stays_in_process(self):
+        """Ниже порога по размеру файлы разбираются в текущем процессе через кэш"""
+        with mock.patch.object(parallel, 'process_pool') as pool:
+            response = self.client.get(reverse('search_sales'), {'q': 'слива', 'source': 'file'})
+        pool.assert_not_called()
+        self.assertEqual(len(response.json()['sales']), 2)
+        self.assertEqual(len(file_cache), 3)
+
+    def test_split_by_size_balances_chunks(self):
+        """Пачки получаются близкими по суммарному размеру"""
+        files = [file_cache_module.FileStat(str(i), str(i), 'json', mock.Mock(st_size=size))
+                 for i, size in enumerate([90, 50, 40, 30, 20, 10])]
+        chunks = parallel.split_by_size(files, 2)
+        self.assertEqual(sorted(sum(f.stat.st_size for f in chunk) for chunk in chunks), [120, 120])
+        self.assertEqual(len(parallel.split_by_size(files[:1], 4)), 1)
+
+
+class SaleLocationIndexTest(TempUploadDirMixin, TestCase):
+    def test_upload_and_add_sale_update_index(self):
+        """Загрузка файла и добавление продажи в файл попадают в индекс"""
+        sales = [self.make_sale(), self.make_sale()]
+        upload = SimpleUploadedFile('batch.json', json.dumps(sales).encode('utf-8'))
+        self.client.post(reverse('upload_file'), {'file': upload})
+        location = SaleLocationIndex(self.upload_dir).lookup(sales[1]['id'])
+        self.assertEqual(location.format, 'json')
+        self.assertEqual(location.position, 1)
+        self.assertTrue(location.filename.endswith('_batch.json'))
+
+        self.client.post(reverse('add_sale'), {
+            'product_name': 'Новый', 'quantity': 1, 'price': 5, 'sale_date': '2025-08-04 13:10',
+            'customer_name': 'Клиент', 'customer_email': 'new@example.com', 'save_to': 'file',
+        })
+        record = next(r for e in file_cache.scan(self.upload_dir) for r in e.records if r.product_name == 'Новый')
+        self.assertEqual(SaleLocationIndex(self.upload_dir).lookup(record.id).format, 'ndjson')
+
+    def test_edit_and_delete_do_not_scan_directory(self):
+        """Редактирование и удаление находят файл через индекс без обхода каталога"""
+        first, second = self.make_sale(), self.make_sale()
+        self.write_json('a.json', [first, second])
+        SaleLocationIndex(self.upload_dir).rebuild()
+        with mock.patch.object(file_cache, 'scan', side_effect=AssertionError('scan')):
+            response = self.client.get(reverse('edit_file_sale', args=[second['id']]))
+            self.assertEqual(response.status_code, 200)
+            self.client.get(reverse('delete_sale', args=[first['id']]))
+        self.assertEqual(SaleLocationIndex(self.upload_dir).lookup(second['id']).position, 0)
+        self.assertIsNone(SaleLocationIndex(self.upload_dir).lookup(first['id']))
+
+    def test_stale_index_falls_back_to_scan(self):
+        """Файл, добавленный мимо приложения, находится и дописывается в индекс"""
+        sale = self.make_sale()
+        self.write_json('manual.json', sale)
+        response = self.client.get(reverse('edit_file_sale', args=[sale['id']]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(SaleLocationIndex(self.upload_dir).lookup(sale['id']).filename, 'manual.json')
+
+    def test_fallback_scans_only_files_newer_than_rebuild(self):
+        """После пересборки индекса промах разбирает только файлы, изменённые позже неё"""
+        old, new = self.make_sale(), self.make_sale()
+        old_path = self.write_json('old.json', old)
+        SaleLocationIndex(self.upload_dir).rebuild()
+        SaleLocationIndex(self.upload_dir).remove_file('old.json')
+        past = time.time() - 3600
+        os.utime(old_path, (past, past))
+        self.write_json('new.json', new)
+        file_cache.clear()
+
+        with mock.patch.object(file_cache_module, 'parse_sale_file', wraps=file_cache_module.parse_sale_file) as parse:
+            self.assertEqual(self.client.get(reverse('edit_file_sale', args=[new['id']])).status_code, 200)
+            self.assertEqual(self.client.get(reverse('edit_file_sale', args=[old['id']])).status_code, 302)
+        self.assertEqual([call.args[0] for call in parse.call_args_list], [shards.locate(self.upload_dir, 'new.json')])
+        self.assertEqual(SaleLocationIndex(self.upload_dir).lookup(new['id']).filename, 'new.json')
+
+    def test_connection_is_reused_per_thread(self):
+        """Соединение с индексом открывается один раз на поток и заново — после удаления файла"""
+        connect = mock.Mock(wraps=sqlite3.connect)
+        with mock.patch.object(sale_index_module.sqlite3, 'connect', connect):
+            index = SaleLocationIndex(self.upload_dir)
+            index.index_ids('a.json', 'json', ['s1', 's2'])
+            for _ in range(3):
+                self.assertEqual(SaleLocationIndex(self.upload_dir).lookup('s2').position, 1)
+            self.assertEqual(connect.call_count, 1)
+
+            thread = threading.Thread(target=lambda: index.lookup('s1'))
+            thread.start()
+            thread.join()
+            self.assertEqual(connect.call_count, 2)
+
+            os.remove(index.path)
+            self.assertIsNone(index.lookup('s1'))
+            self.assertEqual(connect.call_count, 3)
+
+    def test_rebuild_command(self):
+        """Команда rebuild_sale_index пересобирает индекс"""
+        self.write_json('a.json', [self.make_sale(), self.make_sale()])
+        out = StringIO()
+        call_command('rebuild_sale_index', stdout=out)
+        self.assertIn('Indexed 2', out.getvalue())
+
+
+class ShardsTest(TempUploadDirMixin, TestCase):
+    def test_writes_go_to_shards(self):
+        """Загрузка и добавление продажи пишут файлы в шарды, скачивание и удаление их находят"""
+        upload = SimpleUploadedFile('batch.json', json.dumps([self.make_sale()]).encode('utf-8'))
+        self.client.post(reverse('upload_file'), {'file': upload})
+        self.client.post(reverse('add_sale'), {
+            'product_name': 'Новый', 'quantity': 1, 'price': 5, 'sale_date': '2025-08-04 13:10',
+            'customer_name': 'Клиент', 'customer_email': 'new@example.com', 'save_to': 'file',
+        })
+        entries = list(shards.iter_entries(self.upload_dir))
+        self.assertEqual(len(entries), 2)
+        self.assertFalse([name for name in os.listdir(self.upload_dir) if shards.file_format(name)])
+        for entry in entries:
+            self.assertEqual(entry.path, shards.shard_path(self.upload_dir, entry.name))
+        self.assertEqual(len(self.client.get(reverse('search_sales'), {'source': 'file'}).json()['sales']), 2)
+
+        filename = entries[0].name
+        self.assertEqual(self.client.get(reverse('download_file', args=[filename])).status_code, 200)
+        self.client.get(reverse('delete_file', args=[filename]))
+        self.assertIsNone(shards.locate(self.upload_dir, filename))
+
+    def test_flat_files_still_found(self):
+        """Файлы в корне uploads/ (до перехода на шарды) находятся и скачиваются"""
+        sale = self.make_sale()
+        path = self.write_json('legacy.json', sale)
+        self.assertEqual(shards.locate(self.upload_dir, 'legacy.json'), path)
+        self.assertIsNone(shards.locate(self.upload_dir, 'missing.json'))
+        response = self.client.get(reverse('download_file', args=['legacy.json']))
+        self.assertEqual(json.loads(response.getvalue()), sale)
+        self.assertEqual(self.client.get(reverse('edit_file_sale', args=[sale['id']])).status_code, 200)
+
+    def test_page_files_walks_shards_by_cursor(self):
+        """Страницы файлов идут по курсору без пропусков и повторов: сначала корень, затем шарды"""
+        self.write_json('root.json', self.make_sale())
+        names = [f'f{i:02d}.json' for i in range(12)]
+        for name in names:
+            with open(shards.path_for_write(self.upload_dir, name), 'w', encoding='utf-8') as f:
+                json.dump(self.make_sale(), f)
+        open(os.path.join(self.upload_dir, 'notes.txt'), 'w').close()
+
+        seen = []
+        after = ''
+        while True:
+            entries, after = shards.page_files(self.upload_dir, after, limit=5)
+            seen.extend(entry.name for entry in entries)
+            if after is None:
+                break
+        self.assertEqual(seen[0], 'root.json')
+        self.assertEqual(sorted(seen[1:]), names)
+        self.assertEqual(seen, [entry.name for entry in shards.iter_entries(self.upload_dir)])
+
+    @override_settings(SALES_FILE_LIST_SIZE=2)
+    def test_index_lists_files_in_pages(self):
+        """Главная страница показывает файлы порциями со ссылкой на следующую"""
+        for name in ('a.json', 'b.json', 'c.json'):
+            self.write_json(name, self.make_sale())
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['json_files'], ['a.json', 'b.json'])
+        self.assertEqual(response.context['next_files_cursor'], 'b.json')
+        response = self.client.get(reverse('index'), {'files_after': 'b.json'})
+        self.assertEqual(response.context['json_files'], ['c.json'])
+        self.assertIsNone(response.context['next_files_cursor'])
+
+    def test_shard_uploads_command(self):
+        """shard_uploads переносит файлы из корня в шарды, индекс продаж остаётся верным"""
+        sale = self.make_sale()
+        self.write_json('a.json', sale)
+        self.write_json('b.json', self.make_sale())
+        SaleLocationIndex(self.upload_dir).rebuild()
+
+        out = StringIO()
+        call_command('shard_uploads', dry_run=True, stdout=out)
+        self.assertIn('Would move 2 files into shards.', out.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(self.upload_dir, 'a.json')))
+
+        # Одноимённый файл уже в шарде: корневой не трогаем.
+        with open(shards.path_for_write(self.upload_dir, 'b.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.make_sale(), f)
+        out, err = StringIO(), StringIO()
+        call_command('shard_uploads', stdout=out, stderr=err)
+        self.assertIn('Moved 1 files into shards.', out.getvalue())
+        self.assertIn('Skipped b.json', err.getvalue())
+        self.assertTrue(os.path.exists(shards.shard_path(self.upload_dir, 'a.json')))
+        self.assertFalse(os.path.exists(os.path.join(self.upload_dir, 'a.json')))
+        self.assertEqual(self.client.get(reverse('edit_file_sale', args=[sale['id']])).status_code, 200)
+
+
+def _stress_editor(path, owner, workers, rounds):
+    """Редактор для FileWriterTest: правит свои записи файла и удаляет последнюю из них."""
+    mine = [f'r{i}' for i in range(owner, 40, workers)]
+    for n in range(rounds):
+        for sale_id in mine:
+            # Через раз запись длиннее прежней — тогда файл переписывается целиком.
+            name = f'{owner}-{n}' + ('-длинное-имя' * 5 if n % 2 else '')
+            file_writer.update_json_record(path, sale_id, {'id': sale_id, 'product_name': name, 'quantity': n})
+    file_writer.delete_json_record(path, mine[-1])
+
+
+class FileWriterTest(TempUploadDirMixin, TestCase):
+    def write_list(self, count=5):
+        return self.write_json('list.json', [self.make_sale(id=f'r{i}', product_name=f'Товар {i}') for i in range(count)])
+
+    def read(self, path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    @override_settings(SALES_INPLACE_MIN_BYTES=0)
+    def test_update_in_place(self):
+        """Правка не длиннее старой записи пишется на место, остальной файл не меняется"""
+        path = self.write_list()
+        with open(path, 'rb') as f:
+            before = f.read()
+        st = os.stat(path)
+        self.assertTrue(file_writer.update_json_record(path, 'r2', {'id': 'r2', 'product_name': 'Ё'}))
+        with open(path, 'rb') as f:
+            after = f.read()
+        self.assertEqual(len(after), len(before))
+        self.assertEqual(os.stat(path).st_ino, st.st_ino)
+        self.assertGreater(os.stat(path).st_mtime_ns, st.st_mtime_ns)
+        changed = [i for i, (a, b) in enumerate(zip(before, after)) if a != b]
+        self.assertLess(changed[-1] - changed[0], len(before) // 4)
+        data = self.read(path)
+        self.assertEqual(data[2], {'id': 'r2', 'product_name': 'Ё'})
+        self.assertEqual([s['id'] for s in data], ['r0', 'r1', 'r2', 'r3', 'r4'])
+
+        # Длиннее старой — файл переписывается через временный.
+        self.assertTrue(file_writer.update_json_record(path, 'r3', self.make_sale(id='r3', product_name='Я' * 500)))
+        self.assertNotEqual(os.stat(path).st_ino, st.st_ino)
+        self.assertEqual(self.read(path)[3]['product_name'], 'Я' * 500)
+        self.assertFalse(file_writer.update_json_record(path, 'missing', {}))
+
+    @override_settings(SALES_INPLACE_MIN_BYTES=0)
+    def test_delete_in_place(self):
+        """Удаление затирает запись с запятой пробелами; файл остаётся корректным JSON"""
+        path = self.write_list()
+        size = os.path.getsize(path)
+        for sale_id, left in (('r2', ['r0', 'r1', 'r3', 'r4']), ('r4', ['r0', 'r1', 'r3']),
+                              ('r0', ['r1', 'r3']), ('r3', ['r1']), ('r1', [])):
+            self.assertEqual(file_writer.delete_json_record(path, sale_id), 'deleted')
+            self.assertEqual([s['id'] for s in self.read(path)], left)
+        self.assertEqual(os.path.getsize(path), size)
+        self.assertIsNone(file_writer.delete_json_record(path, 'r1'))
+
+    def test_small_files_are_rewritten(self):
+        """Небольшие файлы переписываются целиком, одиночная продажа удаляется вместе с файлом"""
+        path = self.write_list(3)
+        self.assertEqual(file_writer.delete_json_record(path, 'r1'), 'deleted')
+        self.assertEqual([s['id'] for s in self.read(path)], ['r0', 'r2'])
+        single = self.write_json('single.json', self.make_sale(id='s1'))
+        self.assertEqual(file_writer.delete_json_record(single, 's1'), 'removed')
+        self.assertFalse(os.path.exists(single))
+        with self.assertRaises(FileNotFoundError):
+            file_writer.update_json_record(single, 's1', {})
+        self.assertFalse([n for n in os.listdir(self.upload_dir) if n.endswith('.part')])
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'fork is required')
+    def test_concurrent_editors(self):
+        """Одновременные правки одного файла из нескольких процессов не теряются"""
+        for inplace_min_bytes in (0, 10 ** 9):
+            with self.subTest(inplace_min_bytes=inplace_min_bytes), \
+                    override_settings(SALES_INPLACE_MIN_BYTES=inplace_min_bytes):
+                path = self.write_json('stress.json', [self.make_sale(id=f'r{i}') for i in range(40)])
+                workers, rounds = 8, 6
+                context = multiprocessing.get_context('fork')
+                editors = [context.Process(target=_stress_editor, args=(path, k, workers, rounds))
+                           for k in range(workers)]
+                for editor in editors:
+                    editor.start()
+                for editor in editors:
+                    editor.join(60)
+                self.assertEqual([editor.exitcode for editor in editors], [0] * workers)
+                data = self.read(path)
+                self.assertEqual(len(data), 40 - workers)
+                for sale in data:
+                    owner = int(sale['id'][1:]) % workers
+                    self.assertEqual(sale['product_name'], f'{owner}-{rounds - 1}' + '-длинное-имя' * 5)
+                    self.assertEqual(sale['quantity'], rounds - 1)
+
+
+class SegmentStoreTest(TempUploadDirMixin, TestCase):
+    def add_sale(self, product_name):
+        self.client.post(reverse('add_sale'), {
+            'product_name': product_name, 'quantity': 1, 'price': 5, 'sale_date': '2025-08-04 13:10',
+            'customer_name': 'Клиент', 'customer_email': 'new@example.com', 'save_to': 'file',
+        })
+
+    def file_sales(self):
+        return self.client.get(reverse('search_sales'), {'source': 'file'}).json()['sales']
+
+    def segment_paths(self):
+        return [entry.path for entry in shards.iter_entries(self.upload_dir) if segments.is_segment(entry.name)]
+
+    def test_add_sale_appends_to_one_segment(self):
+        """Продажи из формы дописываются в один сегмент, а не в файл на каждую"""
+        for name in ('Груша', 'Слива', 'Яблоко'):
+            self.add_sale(name)
+        [path] = self.segment_paths()
+        self.assertEqual(len(list(shards.iter_entries(self.upload_dir))), 1)
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual([json.loads(line)['product_name'] for line in f], ['Груша', 'Слива', 'Яблоко'])
+        sales = {s['product_name']: s for s in self.file_sales()}
+        self.assertEqual(sorted(sales), ['Груша', 'Слива', 'Яблоко'])
+        self.assertEqual(SaleLocationIndex(self.upload_dir).lookup(sales['Яблоко']['id']).position, 2)
+
+    @override_settings(SALES_SEGMENT_MAX_BYTES=1)
+    def test_rollover_by_size(self):
+        """Выросший сегмент закрывается, следующая продажа начинает новый"""
+        self.add_sale('Груша')
+        self.add_sale('Слива')
+        self.assertEqual(len(self.segment_paths()), 2)
+        self.assertEqual(len(self.file_sales()), 2)
+
+    def test_edit_and_delete_append_and_compaction_drops_them(self):
+        """Правка и удаление дописываются в сегмент; сжатие выбрасывает старые версии и удалённые"""
+        for name in ('Груша', 'Слива', 'Яблоко'):
+            self.add_sale(name)
+        first, second, third = (s for s in sorted(self.file_sales(), key=lambda s: s['product_name']))
+        self.client.post(reverse('edit_file_sale', args=[first['id']]), {
+            'id': first['id'], 'product_name': 'Груша спелая', 'quantity': 3, 'price': 7, 'sale_date': '2025-08-04T13:10',
+            'customer_name': 'Клиент', 'customer_email': 'new@example.com',
+        })
+        self.client.get(reverse('delete_sale', args=[second['id']]))
+        self.assertEqual(sorted(s['product_name'] for s in self.file_sales()), ['Груша спелая', 'Яблоко'])
+        self.assertIsNone(SaleLocationIndex(self.upload_dir).lookup(second['id']))
+        [old_path] = self.segment_paths()
+        self.assertEqual(segments.read_segment(old_path)[1], 3)
+
+        # Активный сегмент не сжимается — закрываем его, начав новый.
+        os.remove(os.path.join(self.upload_dir, segments.ACTIVE_FILENAME))
+        self.add_sale('Вишня')
+        with open(os.path.join(self.upload_dir, 'sale_legacy.xml'), 'w', encoding='utf-8') as f:
+            f.write('<sale><id>legacy</id><product_name>Старая</product_name><quantity>4</quantity></sale>')
+        downloads.precompress(os.path.join(self.upload_dir, 'sale_legacy.xml'))
+
+        out = StringIO()
+        call_command('compact_segments', stdout=out)
+        self.assertIn('Compacted 2 files, dropped 3 records.', out.getvalue())
+        self.assertFalse(os.path.exists(old_path))
+        self.assertFalse(os.path.exists(os.path.join(self.upload_dir, 'sale_legacy.xml')))
+        self.assertFalse(os.path.exists(downloads.variant_path(os.path.join(self.upload_dir, 'sale_legacy.xml'))))
+        sales = {s['product_name']: s for s in self.file_sales()}
+        self.assertEqual(sorted(sales), ['Вишня', 'Груша спелая', 'Старая', 'Яблоко'])
+        self.assertEqual(sales['Старая']['quantity'], 4)
+        location = SaleLocationIndex(self.upload_dir).lookup(third['id'])
+        self.assertTrue(segments.is_segment(location.filename))
+        self.assertNotEqual(location.filename, os.path.basename(old_path))
+        self.assertEqual(self.client.get(reverse('edit_file_sale', args=['legacy'])).status_code, 200)
+
+    def race_with_compaction(self, path):
+        """file_writer.locked, перед которым ``path`` сливается в сегмент — как будто правка ждала блокировку."""
+        real_locked = file_writer.locked
+        compacted = []
+
+        def locked(target):
+            if target == path and not compacted:
+                compacted.append(True)
+                segments.compact(self.upload_dir, SaleLocationIndex(self.upload_dir))
+            return real_locked(target)
+        return mock.patch.object(file_writer, 'locked', locked)
+
+    def test_edit_and_delete_retry_after_compaction(self):
+        """Правка и удаление старого файла, слитого в сегмент посреди запроса, повторяются по индексу"""
+        sale, other = self.make_sale(product_name='Груша'), self.make_sale(product_name='Слива')
+        path = self.write_json('sale_legacy.json', [sale, other])
+        SaleLocationIndex(self.upload_dir).rebuild()
+        with self.race_with_compaction(path):
+            response = self.client.post(reverse('edit_file_sale', args=[sale['id']]), {
+                **sale, 'product_name': 'Груша спелая', 'price': 7, 'sale_date': '2025-08-04T13:10',
+            })
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(sorted(s['product_name'] for s in self.file_sales()), ['Груша спелая', 'Слива'])
+
+        third = self.make_sale(product_name='Яблоко')
+        path = self.write_json('sale_legacy2.json', [third])
+        SaleLocationIndex(self.upload_dir).index_ids('sale_legacy2.json', 'json', [third['id']])
+        with self.race_with_compaction(path):
+            self.client.get(reverse('delete_sale', args=[third['id']]))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(sorted(s['product_name'] for s in self.file_sales()), ['Груша спелая', 'Слива'])
+
+    def test_compaction_logs_merged_duplicate_ids(self):
+        """Одна продажа в двух старых файлах сливается в одну запись, слияние пишется в лог"""
+        sale = self.make_sale(product_name='Груша')
+        self.write_json('sale_a.json', [sale])
+        self.write_json('sale_b.json', [dict(sale, product_name='Груша спелая')])
+        with self.assertLogs('sales_data.segments', 'WARNING') as logs:
+            merged, dropped = segments.compact(self.upload_dir, SaleLocationIndex(self.upload_dir))
+        self.assertEqual((merged, dropped), (2, 1))
+        self.assertIn(sale['id'], logs.output[0])
+        [path] = self.segment_paths()
+        records, _ = segments.read_segment(path)
+        self.assertEqual([r['product_name'] for r in records], ['Груша спелая'])
+        self.assertEqual(SaleLocationIndex(self.upload_dir).lookup(sale['id']).position, 0)
+
+    def test_torn_tail_does_not_swallow_next_sale(self):
+        """Оборванная при сбое строка не склеивается со следующей продажей"""
+        self.add_sale('Груша')
+        [path] = self.segment_paths()
+        with open(path, 'ab') as f:
+            f.write(b'{"id": "torn", "product_na')
+        self.add_sale('Слива')
+        self.assertEqual(sorted(s['product_name'] for s in self.file_sales()), ['Груша', 'Слива'])
+
+    def test_concurrent_appends_keep_lines_whole(self):
+        """Параллельные дописывания под блокировкой не перемешивают строки"""
+        def worker(n):
+            for i in range(25):
+                segments.append(self.upload_dir, self.make_sale(product_name=f'{n}-{i}' * 50))
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        [path] = self.segment_paths()
+        records, dead = segments.read_segment(path)
+        self.assertEqual((len(records), dead), (200, 0))
+        self.assertEqual(segments._read_active(self.upload_dir)['lines'], 200)
+
+
+class UploadWatcherTest(TempUploadDirMixin, TestCase):
+    def write_xml(self, filename, sale):
+        path = os.path.join(self.upload_dir, filename)
+        root = ET.Element('sale')
+        for key, value in sale.items():
+            ET.SubElement(root, key).text = str(value)
+        ET.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+        return path
+
+    def test_sync_stores_parsed_sales(self):
+        """Сверка сохраняет разобранные продажи и индекс, удалённые файлы выбрасывает"""
+        json_path = self.write_json('a.json', [self.make_sale(), self.make_sale(quantity='много')])
+        xml_path = self.write_xml('b.xml', self.make_sale(sale_date='04.08.2025 13:10'))
+        watcher = UploadWatcher(self.upload_dir)
+        self.assertEqual(watcher.sync(), (2, 0))
+        self.assertEqual(watcher.sync(), (0, 0))
+
+        store = UploadStore(self.upload_dir)
+        for path, fmt in ((json_path, 'json'), (xml_path, 'xml')):
+            st = os.stat(path)
+            stored = store.load(os.path.basename(path), st.st_mtime_ns, st.st_size)
+            parsed = file_cache_module.parse_sale_file(path, fmt)
+            self.assertEqual([r.to_dict() for r in stored], [r.to_dict() for r in parsed])
+            self.assertIsNone(store.load(os.path.basename(path), st.st_mtime_ns + 1, st.st_size))
+        sale_id = parsed[0].id
+        self.assertEqual(SaleLocationIndex(self.upload_dir).lookup(sale_id).filename, 'b.xml')
+
+        os.remove(xml_path)
+        self.assertEqual(watcher.sync(), (0, 1))
+        self.assertEqual(list(store.files()), ['a.json'])
+        self.assertIsNone(SaleLocationIndex(self.upload_dir).lookup(sale_id))
+        store.close()
+
+    def test_cache_reads_store_instead_of_parsing(self):
+        """Кэш файлов берёт продажи из хранилища, пока файл не изменился"""
+        path = self.write_json('a.json', [self.make_sale(), self.make_sale()])
+        call_command('watch_uploads', once=True, stdout=StringIO())
+        parse = mock.Mock(wraps=file_cache_module.parse_sale_file)
+        with mock.patch.object(file_cache_module, 'parse_sale_file', parse):
+            self.assertEqual(len(FileRecordCache().get(path).records), 2)
+            parse.assert_not_called()
+
+            self.write_json('a.json', [self.make_sale()])
+            os.utime(path, ns=(0, 10 ** 18))
+            self.assertEqual(len(FileRecordCache().get(path).records), 1)
+            parse.assert_called_once()
+
+    def test_watch_uploads_once(self):
+        """watch_uploads --once сверяет каталог и выходит"""
+        self.write_json('a.json', self.make_sale())
+        out = StringIO()
+        call_command('watch_uploads', once=True, stdout=out)
+        self.assertIn('Synced 1 files, removed 0.', out.getvalue())
+
+    def watch(self, **kwargs):
+        stop = threading.Event()
+        watcher = UploadWatcher(self.upload_dir, interval=0.05, debounce=0.05)
+        thread = threading.Thread(target=watcher.run, kwargs={'should_stop': stop.is_set, **kwargs})
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(stop.set)
+        return UploadStore(self.upload_dir)
+
+    def wait_for(self, store, filenames):
+        deadline = time.monotonic() + 5
+        while sorted(store.files()) != filenames and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(sorted(store.files()), filenames)
+
+    @unittest.skipUnless(Inotify.available(), 'inotify is Linux-only')
+    def test_inotify_picks_up_changes(self):
+        """Файлы, созданные и удалённые мимо приложения, попадают в хранилище через inotify"""
+        store = self.watch()
+        self.addCleanup(store.close)
+        self.wait_for(store, [])
+        path = self.write_json('manual.json', self.make_sale())
+        self.wait_for(store, ['manual.json'])
+        os.rename(path, os.path.join(self.upload_dir, 'renamed.json'))
+        self.wait_for(store, ['renamed.json'])
+        # Новый каталог-шард берётся под наблюдение, файл в нём не теряется.
+        with open(shards.path_for_write(self.upload_dir, 'sharded.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.make_sale(), f)
+        self.wait_for(store, ['renamed.json', 'sharded.json'])
+
+    def test_polling_fallback(self):
+        """Без inotify каталог опрашивается"""
+        store = self.watch(use_inotify=False)
+        self.addCleanup(store.close)
+        self.write_json('manual.json', self.make_sale())
+        self.wait_for(store, ['manual.json'])
+
+
+class ResponseCacheTest(TempUploadDirMixin, TestCase):
+    def search(self, **params):
+        return self.client.get(reverse('search_sales'), {'source': 'file', **params}).json()['sales']
+
+    def test_repeated_search_is_served_from_cache(self):
+        """Повторный поиск без изменений данных не перебирает продажи"""
+        self.write_json('a.json', [self.make_sale(product_name='Груша')])
+        first = self.search(q='груша')
+        with mock.patch.object(views, '_paginate_sales', side_effect=AssertionError('paginate')):
+            self.assertEqual(self.search(q='груша'), first)
+        self.assertEqual(self.search(q='слива'), [])
+
+    def test_writes_bump_version(self):
+        """Добавление, правка и удаление продаж сразу видны в ответах"""
+        self.assertEqual(self.search(), [])
+        version = data_version.current(self.upload_dir)
+        self.client.post(reverse('add_sale'), {
+            'product_name': 'Новый', 'quantity': 1, 'price': 5, 'sale_date': '2025-08-04 13:10',
+            'customer_name': 'Клиент', 'customer_email': 'new@example.com', 'save_to': 'file',
+        })
+        self.assertNotEqual(data_version.current(self.upload_dir), version)
+        sales = self.search()
+        self.assertEqual([s['product_name'] for s in sales], ['Новый'])
+
+        self.client.post(reverse('delete_sale', args=[sales[0]['id']]))
+        self.assertEqual(self.search(), [])
+
+        index = self.client.get(reverse('index')).content.decode('utf-8')
+        sale = Sale.objects.create(
+            product_name='Из базы', quantity=1, price=5, sale_date=timezone.now(),
+            customer_name='Клиент', customer_email='db@example.com',
+        )
+        self.client.post(reverse('delete_db_sale', args=[sale.pk]))
+        self.assertNotEqual(self.client.get(reverse('index')).content.decode('utf-8'), index)
+
+    def test_watcher_bumps_version(self):
+        """Наблюдатель, найдя изменения, меняет версию данных"""
+        path = os.path.join(self.upload_dir, 'manual.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.make_sale(), f)
+        version = data_version.current(self.upload_dir)
+        watcher = UploadWatcher(self.upload_dir)
+        self.addCleanup(watcher.store.close)
+        self.assertEqual(watcher.sync(), (1, 0))
+        bumped = data_version.current(self.upload_dir)
+        self.assertNotEqual(bumped, version)
+        self.assertEqual(watcher.sync(), (0, 0))
+        self.assertEqual(data_version.current(self.upload_dir), bumped)
+
+    def test_cached_index_uses_request_csrf_token(self):
+        """Закэшированная главная страница содержит CSRF-токен своего запроса"""
+        self.client.get(reverse('index'))
+        client = self.client_class(enforce_csrf_checks=True)
+        with mock.patch.object(views, 'render_to_string', side_effect=AssertionError('render')):
+            html = client.get(reverse('index')).content.decode('utf-8')
+        self.assertNotIn(views.CSRF_PLACEHOLDER, html)
+        token = html.split('name="csrfmiddlewaretoken" value="', 1)[1].split('"', 1)[0]
+        response = client.post(reverse('add_sale'), {
+            'csrfmiddlewaretoken': token, 'product_name': 'Новый', 'quantity': 1, 'price': 5,
+            'sale_date': '2025-08-04 13:10', 'customer_name': 'Клиент', 'customer_email': 'new@example.com',
+            'save_to': 'database',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Sale.objects.filter(product_name='Новый').exists())
+
+
+class ConditionalGetTest(TempUploadDirMixin, TestCase):
+    def test_search_not_modified(self):
+        """Поиск с совпавшим If-None-Match получает 304 без обращения к данным и кэшу"""
+        self.write_json('a.json', [self.make_sale(product_name='Груша')])
+        url = reverse('search_sales')
+        response = self.client.get(url, {'q': 'груша'})
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotEqual(self.client.get(url, {'q': 'слива'})['ETag'], etag)
+
+        with mock.patch.object(response_cache, 'aget', side_effect=AssertionError('cache')):
+            response = self.client.get(url, {'q': 'груша'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        self.write_json('b.json', [self.make_sale(product_name='Груша')])
+        response = self.client.get(url, {'q': 'груша'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()['sales']), 2)
+
+    def test_download_not_modified(self):
+        """Скачивание с совпавшим If-None-Match получает 304, после правки файла — 200"""
+        sale = self.make_sale()
+        path = self.write_json('a.json', [sale, self.make_sale()])
+        url = reverse('download_file', args=['a.json'])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=f'"other", {etag}').status_code, 304)
+
+        with self.settings(SALES_INPLACE_MIN_BYTES=0):
+            self.assertTrue(file_writer.update_json_record(path, sale['id'], {**sale, 'quantity': 3}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(response.getvalue())[0]['quantity'], 3)
+
+
+class DownloadTest(TempUploadDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = self.write_json('a.json', [self.make_sale() for _ in range(50)])
+        with open(self.path, 'rb') as f:
+            self.data = f.read()
+        self.url = reverse('download_file', args=['a.json'])
+
+    def download(self, **headers):
+        response = self.client.get(self.url, **headers)
+        self.addCleanup(response.close)
+        return response
+
+    def test_full_download_streams_file(self):
+        """Файл отдаётся через FileResponse, не читаясь в память целиком"""
+        # Тестовый клиент оборачивает тело ответа, поэтому file_to_stream
+        # (его берёт wsgi.file_wrapper) проверяем на ответе самого представления.
+        for headers in ({}, {'HTTP_RANGE': 'bytes=10-19'}):
+            response = views.download_file(RequestFactory().get(self.url, **headers), 'a.json')
+            self.assertIsInstance(response.file_to_stream.fileno(), int)
+            response.close()
+
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(int(response['Content-Length']), len(self.data))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="a.json"')
+        self.assertEqual(response.getvalue(), self.data)
+
+    def test_range_requests(self):
+        """Range отдаёт 206 с частью файла, диапазон за концом — 416"""
+        size = len(self.data)
+        for header, start, end in (('bytes=10-19', 10, 19), ('bytes=100-', 100, size - 1),
+                                   ('bytes=-7', size - 7, size - 1), ('bytes=5-999999', 5, size - 1)):
+            response = self.download(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{size}')
+            self.assertEqual(int(response['Content-Length']), end - start + 1)
+            self.assertEqual(response.getvalue(), self.data[start:end + 1])
+
+        response = self.download(HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+        self.assertEqual(self.download(HTTP_RANGE='bytes=0-1,5-6').getvalue(), self.data)
+
+    def test_if_range(self):
+        """С устаревшим If-Range отдаётся весь файл"""
+        etag = self.download()['ETag']
+        self.assertEqual(self.download(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+        response = self.download(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.getvalue(), self.data)
+
+    def test_precompressed_variant(self):
+        """Свежая gzip-копия отдаётся клиентам, принимающим gzip, устаревшая — нет"""
+        out = StringIO()
+        call_command('precompress_uploads', min_bytes=0, stdout=out)
+        self.assertIn('Compressed 1 files', out.getvalue())
+        self.assertEqual(shards.page_files(self.upload_dir)[0][0].name, 'a.json')
+
+        response = self.download(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.getvalue()), self.data)
+        plain = self.download(HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertNotEqual(plain['ETag'], response['ETag'])
+
+        sale = json.loads(self.data)[0]
+        file_writer.update_json_record(self.path, sale['id'], {**sale, 'quantity': 7})
+        response = self.download(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(json.loads(response.getvalue())[0]['quantity'], 7)
+
+        self.client.post(reverse('delete_file', args=['a.json']))
+        self.assertFalse(os.path.exists(downloads.variant_path(self.path)))
+
+    async def asgi_get(self, headers=()):
+        """GET self.url через ASGIHandler: (communicator, стартовое сообщение ответа)"""
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': self.url, 'query_string': b'', 'server': ('testserver', 80),
+            'headers': [(b'host', b'testserver'), *headers],
+        }
+        communicator = ApplicationCommunicator(ASGIHandler(), scope)
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        return communicator, await communicator.receive_output(5)
+
+    async def read_body(self, communicator):
+        body = b''
+        while True:
+            message = await communicator.receive_output(5)
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                await communicator.wait(5)
+                return body
+
+    async def test_asgi_download_streams_blocks(self):
+        """Под ASGI первый блок уходит клиенту до того, как файл прочитан до конца"""
+        released = threading.Event()
+        real_open_file = downloads.open_file
+
+        class GatedFile:
+            # Все чтения после первого ждут, пока тест не получит первый блок.
+            def __init__(self, f):
+                self._file = f
+                self.reads = 0
+
+            def fileno(self):
+                return self._file.fileno()
+
+            def read(self, size=-1):
+                self.reads += 1
+                if self.reads > 1:
+                    released.wait(5)
+                return self._file.read(size)
+
+            def close(self):
+                self._file.close()
+
+        def open_gated(*args):
+            f, st, encoding = real_open_file(*args)
+            return GatedFile(f), st, encoding
+
+        signals.request_started.disconnect(close_old_connections)
+        self.addCleanup(signals.request_started.connect, close_old_connections)
+        with mock.patch.object(downloads, 'BLOCK_SIZE', 1024), \
+                mock.patch.object(downloads, 'open_file', open_gated):
+            communicator, start = await self.asgi_get()
+            self.assertEqual(start['status'], 200)
+            headers = dict(start['headers'])
+            self.assertEqual(int(headers[b'Content-Length']), len(self.data))
+            self.assertIn(b'ETag', headers)
+            first = await communicator.receive_output(5)
+            self.assertEqual(first['body'], self.data[:1024])
+            self.assertTrue(first['more_body'])
+            self.assertFalse(released.is_set())
+            released.set()
+            self.assertEqual(first['body'] + await self.read_body(communicator), self.data)
+
+        size = len(self.data)
+        communicator, start = await self.asgi_get([(b'range', b'bytes=100-')])
+        self.assertEqual(start['status'], 206)
+        headers = dict(start['headers'])
+        self.assertEqual(headers[b'Content-Range'], f'bytes 100-{size - 1}/{size}'.encode())
+        self.assertEqual(int(headers[b'Content-Length']), size - 100)
+        self.assertIn(b'ETag', headers)
+        self.assertEqual(await self.read_body(communicator), self.data[100:])
+
+
+@override_settings(SALES_UPLOAD_COMPRESSION='gzip')
+class CompressedStorageTest(TempUploadDirMixin, TestCase):
+    def upload(self, name, content):
+        self.client.post(reverse('upload_file'), {'file': SimpleUploadedFile(name, content)})
+        [entry] = [entry for entry in shards.iter_entries(self.upload_dir) if entry.name.endswith(name + '.gz')]
+        return entry
+
+    def file_sales(self):
+        return self.client.get(reverse('search_sales'), {'source': 'file'}).json()['sales']
+
+    def test_file_format_ignores_compression_suffix(self):
+        """Формат сжатого файла — по расширению под суффиксом; скрытые файлы не файлы продаж"""
+        self.assertEqual(shards.file_format('a.json.gz'), 'json')
+        self.assertEqual(shards.file_format('/tmp/a.xml.zst'), 'xml')
+        self.assertIsNone(shards.file_format('a.ndjson.gz'))
+        self.assertIsNone(shards.file_format('.a.json.gz'))
+        self.assertIsNone(shards.file_format('a.gz'))
+
+    def test_storage_compression_setting(self):
+        """Без zstandard zstd заменяется gzip, неизвестное значение — ошибка настройки"""
+        with self.settings(SALES_UPLOAD_COMPRESSION=''):
+            self.assertIsNone(compressed.storage_compression())
+        with self.settings(SALES_UPLOAD_COMPRESSION='zstd'), mock.patch.object(compressed, 'zstandard', None):
+            self.assertEqual(compressed.storage_compression(), 'gzip')
+        with self.settings(SALES_UPLOAD_COMPRESSION='lzma'), self.assertRaises(ImproperlyConfigured):
+            compressed.storage_compression()
+
+    def test_uploads_are_stored_compressed_and_read_transparently(self):
+        """Загрузки хранятся сжатыми; поиск, правка, удаление и импорт читают их на лету"""
+        first, second = self.make_sale(product_name='Груша'), self.make_sale(product_name='Слива')
+        entry = self.upload('batch.json', json.dumps([first, second]).encode('utf-8'))
+        with gzip.open(entry.path, 'rb') as f:
+            self.assertEqual([s['id'] for s in json.load(f)], [first['id'], second['id']])
+        root = ET.Element('sales')
+        sale_elem = ET.SubElement(root, 'sale')
+        for key, value in self.make_sale(product_name='Яблоко').items():
+            ET.SubElement(sale_elem, key).text = str(value)
+        self.upload('batch.xml', ET.tostring(root, encoding='utf-8', xml_declaration=True))
+        self.assertEqual(sorted(s['product_name'] for s in self.file_sales()), ['Груша', 'Слива', 'Яблоко'])
+
+        self.client.post(reverse('edit_file_sale', args=[first['id']]), {
+            'id': first['id'], 'product_name': 'Груша спелая', 'quantity': 3, 'price': 7,
+            'sale_date': '2025-08-04T13:10', 'customer_name': 'Клиент', 'customer_email': 'new@example.com',
+        })
+        self.client.get(reverse('delete_sale', args=[second['id']]))
+        with gzip.open(entry.path, 'rb') as f:
+            self.assertEqual([s['product_name'] for s in json.load(f)], ['Груша спелая'])
+        self.assertEqual(sorted(s['product_name'] for s in self.file_sales()), ['Груша спелая', 'Яблоко'])
+
+        result = self.client.post(reverse('import_file', args=[entry.name])).json()
+        self.assertEqual(result['inserted'], 1)
+        self.assertTrue(Sale.objects.filter(product_name='Груша спелая').exists())
+
+    def test_download_passes_compressed_bytes_through(self):
+        """Сжатый файл отдаётся как есть с Content-Encoding или распаковывается для клиента без gzip"""
+        data = json.dumps([self.make_sale() for _ in range(20)]).encode('utf-8')
+        entry = self.upload('batch.json', data)
+        with open(entry.path, 'rb') as f:
+            stored = f.read()
+        url = reverse('download_file', args=[entry.name])
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.addCleanup(response.close)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(int(response['Content-Length']), len(stored))
+        self.assertEqual(response.getvalue(), stored)
+        self.assertTrue(response['Content-Disposition'].endswith('_batch.json"'))
+
+        response = self.client.get(url)
+        self.addCleanup(response.close)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(response.getvalue(), data)
+
+
+class PaginationTest(TempUploadDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        base = datetime(2025, 1, 1, tzinfo=timezone.get_current_timezone())
+        for day in (1, 3, 5):
+            Sale.objects.create(
+                product_name=f'БД {day}', quantity=day, price=10, sale_date=base.replace(day=day),
+                customer_name='Клиент', customer_email=f'db{day}@example.com',
+            )
+        self.write_json('a.json', [
+            self.make_sale(product_name=f'Файл {day}', quantity=day, sale_date=f'2025-01-0{day}T00:00:00+00:00')
+            for day in (2, 4, 6)
+        ])
+
+    def collect(self, **params):
+        names, cursor, pages = [], None, 0
+        while True:
+            query = dict(params, limit=2)
+            if cursor:
+                query['cursor'] = cursor
+            data = self.client.get(reverse('search_sales'), query).json()
+            names.extend(sale['product_name'] for sale in data['sales'])
+            cursor = data['next_cursor']
+            pages += 1
+            if not cursor:
+                return names, pages
+
+    def test_pages_cover_both_sources_in_order(self):
+        """Страницы по курсору выдают каждую запись ровно один раз в порядке сортировки"""
+        names, pages = self.collect()
+        self.assertEqual(names, ['Файл 6', 'БД 5', 'Файл 4', 'БД 3', 'Файл 2', 'БД 1'])
+        self.assertEqual(pages, 3)
+
+    def test_sort_by_quantity_ascending(self):
+        """Сортировка задаётся на сервере параметром sort"""
+        names, _ = self.collect(sort='quantity', source='file')
+        self.assertEqual(names, ['Файл 2', 'Файл 4', 'Файл 6'])
+
+    def test_invalid_parameters(self):
+        """Неверный курсор или поле сортировки дают 400"""
+        self.assertEqual(self.client.get(reverse('search_sales'), {'cursor': 'garbage'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('search_sales'), {'sort': 'id'}).status_code, 400)
+
+    def test_cursor_with_wrong_types_is_rejected(self):
+        """Поля курсора неверного типа дают 400, а не ошибку при сравнении"""
+        sale_id = str(uuid.uuid4())
+        for positions in (
+            {'file': [1, 'not-a-number', sale_id]},
+            {'file': [1, 10, 5]},
+            {'file': 'abc'},
+            {'database': [123, sale_id]},
+            {'database': ['2025-01-01T00:00:00+00:00', 'not-a-uuid']},
+            {'other': [1, 2]},
+        ):
+            cursor = pagination.encode_cursor('-sale_date', positions)
+            for view in ('search_sales', 'index'):
+                with self.subTest(positions=positions, view=view):
+                    response = self.client.get(reverse(view), {'cursor': cursor})
+                    self.assertEqual(response.status_code, 400 if view == 'search_sales' else 200)
+        cursor = pagination.encode_cursor('quantity', {'file': [1, 'x', sale_id]})
+        self.assertEqual(self.client.get(reverse('search_sales'), {'cursor': cursor, 'sort': 'quantity'}).status_code, 400)
+
+    def test_index_renders_next_page_link(self):
+        """Главная страница показывает ограниченную страницу и ссылку на следующую"""
+        response = self.client.get(reverse('index'), {'limit': 4})
+        self.assertEqual(len(response.context['all_sales']), 4)
+        self.assertTrue(response.context['next_cursor'])
+        self.assertContains(response, 'Следующая страница')
+
+
+class StreamingSearchTest(TempUploadDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_json('a.json', [self.make_sale(product_name='Груша'), self.make_sale(product_name='Слива')])
+        Sale.objects.create(
+            product_name='Груша из БД', quantity=1, price=10, sale_date=timezone.now(),
+            customer_name='Клиент', customer_email='db@example.com',
+        )
+
+    def test_ndjson_stream(self):
+        """format=ndjson отдаёт по одной продаже на строку"""
+        response = self.client.get(reverse('search_sales'), {'q': 'груша', 'format': 'ndjson'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        sales = [json.loads(line) for line in lines]
+        self.assertEqual([(s['product_name'], s['source']) for s in sales],
+                         [('Груша', 'file'), ('Груша из БД', 'database')])
+
+    def test_json_array_stream(self):
+        """format=json-stream отдаёт тот же конверт, что и обычный ответ"""
+        response = self.client.get(reverse('search_sales'), {'format': 'json-stream'})
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(data['sales']), 3)
+
+    async def test_async_stream_merges_sources(self):
+        """Под ASGI файлы и БД читаются одновременно, в ответе продажи обоих источников"""
+        response = await self.async_client.get(reverse('search_sales'), {'q': 'груша', 'format': 'ndjson'})
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        sales = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+        self.assertCountEqual([(s['product_name'], s['source']) for s in sales],
+                              [('Груша', 'file'), ('Груша из БД', 'database')])
+
+    @override_settings(SALES_PARSE_PROCESSES=2, SALES_PARALLEL_PARSE_MIN_BYTES=0)
+    async def test_async_stream_with_process_pool_is_incremental(self):
+        """С разбором в процессах поток берёт записи пачками, а не полным списком"""
+        self.write_json('b.json', [self.make_sale(product_name='Груша')])
+        pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(pool.shutdown)
+        with mock.patch.object(parallel, 'process_pool', return_value=pool), \
+                mock.patch.object(parallel, 'search_files', side_effect=AssertionError):
+            response = await self.async_client.get(reverse('search_sales'), {'q': 'груша', 'format': 'ndjson'})
+            body = b''.join([chunk async for chunk in response.streaming_content])
+        sales = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+        self.assertEqual(sorted(s['source'] for s in sales), ['database', 'file', 'file'])
+
+    @override_settings(SALES_STREAM_CHUNK_SIZE=1)
+    async def test_async_stream_closes_db_cursor_when_abandoned(self):
+        """Если клиент ушёл посреди потока, серверный курсор БД закрывается"""
+        for i in range(3):
+            await Sale.objects.acreate(
+                product_name='Груша', quantity=1, price=10, sale_date=timezone.now(),
+                customer_name='Клиент', customer_email=f'db{i}@example.com',
+            )
+        closed = []
+        iterator = SaleQuerySet.iterator
+
+        def tracked(queryset, *args, **kwargs):
+            try:
+                yield from iterator(queryset, *args, **kwargs)
+            finally:
+                closed.append(True)
+
+        with mock.patch.object(SaleQuerySet, 'iterator', tracked):
+            sales = views._aiter_search_results('груша', 'database')
+            self.assertEqual((await anext(sales)).source, 'database')
+            await sales.aclose()
+        self.assertEqual(closed, [True])
+
+    async def test_async_paginated_search(self):
+        """Страница поиска под ASGI совпадает с синхронной"""
+        response = await self.async_client.get(reverse('search_sales'), {'q': 'груша', 'limit': 1})
+        data = json.loads(response.content)
+        self.assertEqual(len(data['sales']), 1)
+        self.assertIsNotNone(data['next_cursor'])
+        response = await self.async_client.get(reverse('search_sales'), {'q': 'груша', 'cursor': data['next_cursor'], 'limit': 1})
+        self.assertEqual(len(json.loads(response.content)['sales']), 1)
+
+
+class SaleDataTest(TempUploadDirMixin, TestCase):
+    def test_record_is_slotted(self):
+        """Записи без словаря атрибутов, лишние поля не сохраняются"""
+        sale = SaleData.from_dict({'id': 'x1', 'quantity': 2, 'extra': 1})
+        self.assertFalse(hasattr(sale, '__dict__'))
+        with self.assertRaises(AttributeError):
+            sale.extra = 1
+        self.assertEqual(sale.to_dict()['source'], 'file')
+
+    def test_both_sources_serialized_alike(self):
+        """Продажи из БД и файлов попадают в JSON с одинаковым набором полей"""
+        self.write_json('a.json', self.make_sale(extra='лишнее поле'))
+        Sale.objects.create(
+            product_name='Продукт из БД', quantity=1, price='10.50', sale_date=timezone.now(),
+            customer_name='Клиент', customer_email='db@example.com',
+        )
+        sales = self.client.get(reverse('search_sales')).json()['sales']
+        self.assertEqual({s['source'] for s in sales}, {'file', 'database'})
+        self.assertEqual({frozenset(s) for s in sales}, {frozenset(SaleData.FIELDS + ('source',))})
+        self.assertEqual(next(s for s in sales if s['source'] == 'database')['price'], 10.5)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Продукт из БД')
+        self.assertContains(response, 'Файловый продукт')
+
+
+class StreamingUploadTest(TempUploadDirMixin, TestCase):
+    def upload(self, name, content):
+        return self.client.post(reverse('upload_file'), {'file': SimpleUploadedFile(name, content)})
+
+    def test_valid_xml_upload_is_stored(self):
+        """Корректный XML сохраняется под итоговым именем без временных файлов"""
+        self.upload('list.xml', b'<sales><sale><id>x1</id></sale><sale><id>x2</id></sale></sales>')
+        names = [name for _, _, filenames in os.walk(self.upload_dir) for name in filenames]
+        self.assertEqual(len([n for n in names if n.endswith('_list.xml')]), 1)
+        self.assertFalse([n for n in names if n.endswith('.part')])
+        self.assertEqual(SaleLocationIndex(self.upload_dir).lookup('x2').position, 1)
+
+    @override_settings(SALES_UPLOAD_COMPRESSION='gzip')
+    def test_compressed_upload_is_indexed(self):
+        """id продаж индексируются по сохранённому (сжатому) файлу"""
+        self.upload('list.json', json.dumps([{'id': 'j1'}, 'junk', {'id': 'j2'}]).encode('utf-8'))
+        location = SaleLocationIndex(self.upload_dir).lookup('j2')
+        self.assertTrue(location.filename.endswith('_list.json.gz'))
+        self.assertEqual(location.position, 1)
+
+    def test_invalid_json_is_rejected(self):
+        """Повреждённый JSON не сохраняется"""
+        self.upload('broken.json', b'[{"id": "1"}, {"id": ')
+        self.assertFalse([n for n in os.listdir(self.upload_dir) if n.endswith('.json') or n.endswith('.part')])
+
+    def test_non_utf8_json_is_invalid_format(self):
+        """JSON не в UTF-8 отклоняется при загрузке и импорте как ошибка формата, а не 500"""
+        content = json.dumps([self.make_sale(product_name='Café', customer_name='Zoé')], ensure_ascii=False).encode('latin-1')
+        response = self.upload('latin1.json', content)
+        [message] = [str(m) for m in get_messages(response.wsgi_request)]
+        self.assertTrue(message.startswith('Invalid file format: Invalid UTF-8'), message)
+        self.assertFalse([n for n in os.listdir(self.upload_dir) if n.endswith('.json') or n.endswith('.part')])
+
+        with open(os.path.join(self.upload_dir, 'latin1.json'), 'wb') as f:
+            f.write(content)
+        response = self.client.post(reverse('import_file', args=['latin1.json']))
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()['error'].startswith('Invalid file format: Invalid UTF-8'))
+
+    @override_settings(SALES_UPLOAD_MAX_BYTES=100)
+    def test_size_limit(self):
+        """Файл больше SALES_UPLOAD_MAX_BYTES отклоняется"""
+        self.upload('big.json', json.dumps([self.make_sale() for _ in range(5)]).encode('utf-8'))
+        self.assertFalse([n for n in os.listdir(self.upload_dir) if n.endswith('.json')])
+
+    @override_settings(SALES_UPLOAD_MAX_RECORDS=2)
+    def test_record_limit(self):
+        """Файл с числом продаж больше SALES_UPLOAD_MAX_RECORDS отклоняется"""
+        self.upload('many.json', json.dumps([self.make_sale() for _ in range(3)]).encode('utf-8'))
+        self.assertFalse([n for n in os.listdir(self.upload_dir) if n.endswith('.json')])
+
+
+class JsonRecordParserTest(TestCase):
+    def parse(self, data, chunk_size):
+        parser = JsonRecordParser()
+        records = []
+        for i in range(0, len(data), chunk_size):
+            records.extend(parser.feed(data[i:i + chunk_size]))
+        records.extend(parser.close())
+        return records
+
+    def test_records_split_across_chunks(self):
+        """Записи, разрезанные границами кусков, собираются корректно"""
+        sales = [{'id': str(i), 'product_name': 'Груша "зелёная"', 'price': i * 1.5} for i in range(20)]
+        data = json.dumps(sales, ensure_ascii=False).encode('utf-8')
+        for chunk_size in (1, 7, 4096):
+            self.assertEqual(self.parse(data, chunk_size), sales)
+
+    def test_single_object_size_limit(self):
+        """Единственный объект документа тоже ограничен MAX_RECORD_CHARS и не копится без предела"""
+        data = json.dumps({'id': '1', 'product_name': 'x' * 100}).encode('utf-8')
+        with mock.patch.object(streaming, 'MAX_RECORD_CHARS', 50):
+            with self.assertRaisesRegex(ValueError, 'too large'):
+                self.parse(data, 16)
+        self.assertEqual(self.parse(data, 16), [json.loads(data)])
+
+    def test_malformed_input(self):
+        """Ошибки синтаксиса обнаруживаются"""
+        for data in (b'[{"id": 1}{"id": 2}]', b'[1,]', b'[1] x', b''):
+            with self.assertRaises(ValueError):
+                self.parse(data, 3)
+
+
+class DateParserTest(TestCase):
+    def test_supported_shapes(self):
+        """ISO с часовым поясом и без, с пробелом, без секунд и дд.мм.гггг чч:мм"""
+        cases = {
+            '2025-08-04T13:10:00+00:00': datetime(2025, 8, 4, 13, 10, tzinfo=dt_timezone.utc),
+            '2025-08-04T13:10:00Z': datetime(2025, 8, 4, 13, 10, tzinfo=dt_timezone.utc),
+            '2025-08-04T13:10:05.250000': datetime(2025, 8, 4, 13, 10, 5, 250000),
+            '2025-08-04 13:10': datetime(2025, 8, 4, 13, 10),
+            '2025-08-04': datetime(2025, 8, 4),
+            '04.08.2025 13:10': datetime(2025, 8, 4, 13, 10),
+        }
+        for value, expected in cases.items():
+            self.assertEqual(parse_date(value), expected, value)
+        for value in ('', None, 'не дата', '2025-02-30T10:00', '31.02.2025 10:00', 5):
+            self.assertEqual(parse_date(value), value)
+
+    def test_parse_many_remembers_format(self):
+        """Пакетный разбор запоминает последний удачный формат и не путает значения"""
+        parser = DateParser()
+        values = ['04.08.2025 13:10', '05.08.2025 14:00', '2025-08-06T10:00:00', 'мусор', None]
+        self.assertEqual(parser.parse_many(values), [
+            datetime(2025, 8, 4, 13, 10), datetime(2025, 8, 5, 14, 0), datetime(2025, 8, 6, 10, 0), 'мусор', None,
+        ])
+        parser.parse('07.08.2025 09:00')
+        with mock.patch('sales_data.dates.datetime') as patched:
+            patched.side_effect = datetime
+            parser.parse('08.08.2025 09:00')
+            patched.fromisoformat.assert_not_called()
+
+
+class BulkImportTest(TempUploadDirMixin, TestCase):
+    def test_import_counts_inserted_duplicates_and_invalid(self):
+        """Импорт вставляет новые записи и считает дубликаты и ошибочные"""
+        existing = self.make_sale(product_name='Уже в БД', sale_date='2025-01-01T10:00:00+00:00')
+        Sale.objects.create(
+            product_name=existing['product_name'], quantity=1, price=1, sale_date=datetime.fromisoformat(existing['sale_date']),
+            customer_name='Клиент', customer_email=existing['customer_email'],
+        )
+        fresh = [self.make_sale(product_name=f'Новый {i}') for i in range(5)]
+        self.write_json('batch.json', fresh + [existing, fresh[0], self.make_sale(quantity=-1), {'id': 'x'}])
+
+        response = self.client.post(reverse('import_file', args=['batch.json']))
+        self.assertEqual(response.json(), {'inserted': 5, 'duplicates': 2, 'invalid': 2})
+        self.assertEqual(Sale.objects.count(), 6)
+
+        again = self.client.post(reverse('import_file', args=['batch.json'])).json()
+        self.assertEqual(again, {'inserted': 0, 'duplicates': 7, 'invalid': 2})
+
+    def test_import_command_with_small_batches(self):
+        """Команда import_sales импортирует XML пачками"""
+        path = os.path.join(self.upload_dir, 'list.xml')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('<sales>')
+            for i in range(7):
+                f.write(f'<sale><product_name>P{i}</product_name><quantity>1</quantity><price>2.50</price>'
+                        f'<sale_date>2025-01-0{i + 1}T10:00:00</sale_date><customer_name>C</customer_name>'
+                        f'<customer_email>c@example.com</customer_email></sale>')
+            f.write('</sales>')
+        out = StringIO()
+        call_command('import_sales', path, batch_size=3, stdout=out)
+        self.assertIn('inserted: 7', out.getvalue())
+        self.assertEqual(Sale.objects.count(), 7)
+
+    def test_import_command_finds_sharded_file_by_name(self):
+        """Команда import_sales находит файл в шарде uploads/ по имени"""
+        path = shards.shard_path(self.upload_dir, 'sharded.json')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump([self.make_sale(product_name=f'Товар {i}') for i in range(2)], f)
+        out = StringIO()
+        call_command('import_sales', 'sharded.json', stdout=out)
+        self.assertIn('inserted: 2', out.getvalue())
+        with self.assertRaisesMessage(CommandError, 'File not found: missing.json'):
+            call_command('import_sales', 'missing.json', stdout=out)
+
+    def test_import_requires_post(self):
+        """Импорт выполняется только POST-запросом"""
+        self.write_json('a.json', self.make_sale())
+        self.assertEqual(self.client.get(reverse('import_file', args=['a.json'])).status_code, 405)
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        for day, product in ((1, 'Груша'), (2, 'Слива'), (3, 'Груша <сорт>')):
+            Sale.objects.create(
+                product_name=product, quantity=day, price='10.50', sale_date=datetime(2025, 1, day, 12, tzinfo=dt_timezone.utc),
+                customer_name='Клиент', customer_email=f'c{day}@example.com',
+            )
+
+    def export(self, **params):
+        response = self.client.get(reverse('export_sales'), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_with_date_range(self):
+        """CSV учитывает диапазон дат, правая граница включает день целиком"""
+        _, body = self.export(format='csv', date_from='2025-01-02', date_to='2025-01-03')
+        lines = body.decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'id,product_name,quantity,price,sale_date,customer_name,customer_email')
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['Слива', 'Груша <сорт>'])
+
+    def test_gzip_json_with_search(self):
+        """JSON в gzip с фильтром поиска"""
+        response, body = self.export(format='json', gzip='1', q='груша')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        sales = json.loads(gzip.decompress(body))
+        self.assertEqual([s['product_name'] for s in sales], ['Груша', 'Груша <сорт>'])
+        self.assertEqual(sales[0]['price'], 10.5)
+
+    def test_xml_is_well_formed(self):
+        """XML-выгрузка разбирается тем же парсером, что и загрузки"""
+        _, body = self.export(format='xml')
+        root = ET.fromstring(body)
+        self.assertEqual(len(root.findall('sale')), 3)
+        self.assertEqual(root.findall('sale')[2].find('product_name').text, 'Груша <сорт>')
+
+    def test_invalid_parameters(self):
+        """Неизвестный формат или дата дают 400"""
+        self.assertEqual(self.client.get(reverse('export_sales'), {'format': 'pdf'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export_sales'), {'date_from': 'вчера'}).status_code, 400)
+
+    async def test_asgi_export_streams_asynchronously(self):
+        """Под ASGI выгрузка — асинхронный поток, строки читаются .iterator() по кускам"""
+        request = AsyncRequestFactory().get(reverse('export_sales'), {'format': 'csv'})
+        with override_settings(SALES_STREAM_CHUNK_SIZE=1), \
+                mock.patch.object(QuerySet, 'iterator', autospec=True, side_effect=QuerySet.iterator) as iterator:
+            response = await sync_to_async(views.export_sales)(request)
+            self.assertTrue(response.is_async)
+            body = b''.join([chunk async for chunk in response])
+        self.assertEqual(iterator.call_args.kwargs, {'chunk_size': 1})
+        self.assertEqual(len(body.decode('utf-8').splitlines()), 4)
+
+    def test_export_command(self):
+        """Команда export_sales пишет выгрузку в файл"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'sales.csv')
+            call_command('export_sales', format='csv', output=path)
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(len(f.read().splitlines()), 4)
+
+
+class AnalyticsTest(TempUploadDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for day, product, quantity in ((1, 'Груша', 2), (1, 'Слива', 1), (9, 'Груша', 3)):
+            Sale.objects.create(
+                product_name=product, quantity=quantity, price='10.00', sale_date=datetime(2025, 1, day, 12, tzinfo=dt_timezone.utc),
+                customer_name='Клиент', customer_email=f'{product}@example.com',
+            )
+        rollup.rebuild()
+        self.write_json('a.json', [
+            self.make_sale(product_name='Груша', quantity=1, price=5, sale_date='2025-01-01T08:00:00'),
+            self.make_sale(product_name='Яблоко', quantity=4, price=2.5, sale_date='2025-02-03T08:00:00+00:00'),
+        ])
+
+    def get(self, **params):
+        response = self.client.get(reverse('sales_analytics'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_group_by_product_merges_sources(self):
+        """Агрегаты из БД и файлов сливаются по продукту"""
+        data = self.get(group_by='product')
+        rows = {row['key']: row for row in data['results']}
+        self.assertEqual(rows['Груша'], {'key': 'Груша', 'count': 3, 'quantity': 6, 'revenue': 55.0})
+        self.assertEqual(rows['Яблоко']['revenue'], 10.0)
+        self.assertEqual(data['totals'], {'count': 5, 'quantity': 11, 'revenue': 75.0})
+
+    def test_group_by_period(self):
+        """Группировка по дню, неделе и месяцу"""
+        days = {row['key']: row['count'] for row in self.get(group_by='day')['results']}
+        self.assertEqual(days, {'2025-01-01': 3, '2025-01-09': 1, '2025-02-03': 1})
+        weeks = {row['key']: row['count'] for row in self.get(group_by='week')['results']}
+        self.assertEqual(weeks, {'2024-12-30': 3, '2025-01-06': 1, '2025-02-03': 1})
+        months = {row['key']: row['quantity'] for row in self.get(group_by='month', source='database')['results']}
+        self.assertEqual(months, {'2025-01-01': 6})
+
+    def test_date_range_and_search(self):
+        """Фильтры по датам и поиску применяются к обоим источникам"""
+        data = self.get(group_by='product', date_from='2025-01-01', date_to='2025-01-01', q='груша')
+        self.assertEqual(data['results'], [{'key': 'Груша', 'count': 2, 'quantity': 3, 'revenue': 25.0}])
+
+    def test_invalid_group_by(self):
+        """Неизвестная группировка даёт 400"""
+        self.assertEqual(self.client.get(reverse('sales_analytics'), {'group_by': 'year'}).status_code, 400)
+
+    def test_rollups_used_for_whole_days(self):
+        """Без поиска и с границами по дням БД читается из сводок, а не из Sale"""
+        SaleDailyRollup.objects.filter(product_name='Слива').update(sale_count=10)
+        rows = {row['key']: row['count'] for row in self.get(group_by='product', source='database')['results']}
+        self.assertEqual(rows['Слива'], 10)
+        rows = {row['key']: row['count'] for row in self.get(group_by='product', source='database', q='слива')['results']}
+        self.assertEqual(rows, {'Слива': 1})
+
+
+class ColumnarSnapshotTest(TempUploadDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_json('a.json', [
+            self.make_sale(product_name='Груша', quantity=2, price=10.5, sale_date='2025-01-01T23:30:00+00:00'),
+            self.make_sale(product_name='Слива', quantity='3', price='1.25', customer_email='plum@example.com', sale_date='2025-01-06T08:00:00'),
+            self.make_sale(product_name='Груша', quantity=1, price=4, sale_date='не дата'),
+        ])
+        self.write_json('b.json', self.make_sale(product_name='Груша', quantity=5, price=2, sale_date='2025-02-28T12:00:00+03:00'))
+
+    def test_matches_record_aggregation(self):
+        """Векторные агрегаты совпадают с проходом по записям"""
+        snapshot = columnar.snapshots.get(self.upload_dir)
+        self.assertEqual(len(snapshot), 4)
+        self.assertIsInstance(snapshot.columns['quantity'], np.memmap)
+        records = [r for cached in file_cache.scan(self.upload_dir) for r in cached.records]
+        date_from = timezone.make_aware(datetime(2025, 1, 2))
+        for group_by in analytics.GROUPINGS:
+            for query_cf, bounds in (('', (None, None)), ('груш', (None, None)), ('', (date_from, None))):
+                expected = analytics.aggregate_records(
+                    (r for r in records if r.matches(query_cf)), group_by, *bounds,
+                )
+                self.assertEqual(snapshot.aggregate(group_by, query_cf, *bounds), expected, (group_by, query_cf))
+
+    def test_rebuilt_when_files_change(self):
+        """Изменение каталога даёт новый снимок, старый удаляется"""
+        first = columnar.snapshots.get(self.upload_dir)
+        self.assertIs(columnar.snapshots.get(self.upload_dir), first)
+        os.remove(os.path.join(self.upload_dir, 'b.json'))
+        second = columnar.snapshots.get(self.upload_dir)
+        self.assertEqual(len(second), 3)
+        self.assertEqual(os.listdir(os.path.join(self.upload_dir, columnar.SNAPSHOT_DIRNAME)), [os.path.basename(second.path)])
+
+    def test_empty_directory(self):
+        """Пустой каталог даёт пустой снимок"""
+        for name in ('a.json', 'b.json'):
+            os.remove(os.path.join(self.upload_dir, name))
+        self.assertEqual(columnar.snapshots.get(self.upload_dir).aggregate('day'), {})
+
+
+class SaleDailyRollupTest(TempUploadDirMixin, TestCase):
+    def rollups(self):
+        return {
+            (str(r.day), r.product_name): (r.sale_count, r.quantity_sum, str(r.revenue_sum))
+            for r in SaleDailyRollup.objects.all()
+        }
+
+    def test_views_keep_rollups_in_sync(self):
+        """Добавление, редактирование и удаление в БД обновляют сводки"""
+        form = {
+            'product_name': 'Груша', 'quantity': 2, 'price': '10.50', 'sale_date': '2025-03-01 10:00',
+            'customer_name': 'Клиент', 'customer_email': 'pear@example.com', 'save_to': 'database',
+        }
+        self.client.post(reverse('add_sale'), form)
+        self.client.post(reverse('add_sale'), {**form, 'quantity': 1, 'customer_email': 'pear2@example.com'})
+        self.assertEqual(self.rollups(), {('2025-03-01', 'Груша'): (2, 3, '31.50')})
+
+        sale = Sale.objects.get(customer_email='pear2@example.com')
+        self.client.post(reverse('edit_sale', args=[sale.id]), {**form, 'product_name': 'Слива', 'sale_date': '2025-03-02T10:00', 'customer_email': 'pear2@example.com'})
+        self.assertEqual(self.rollups(), {
+            ('2025-03-01', 'Груша'): (1, 2, '21.00'),
+            ('2025-03-02', 'Слива'): (1, 2, '21.00'),
+        })
+
+        self.client.post(reverse('delete_db_sale', args=[sale.id]))
+        self.assertEqual(self.rollups(), {('2025-03-01', 'Груша'): (1, 2, '21.00')})
+        self.assertEqual(rollup.find_drift(), [])
+
+    def test_import_updates_rollups(self):
+        """Пакетный импорт учитывает в сводках только вставленные продажи"""
+        sales = [self.make_sale(product_name='Груша', quantity=i + 1, price=2, sale_date=f'2025-04-0{i + 1}T12:00:00') for i in range(3)]
+        path = self.write_json('a.json', sales + sales[:1])
+        importer.import_file(path, batch_size=2)
+        importer.import_file(path, batch_size=2)
+        self.assertEqual(self.rollups()[('2025-04-02', 'Груша')], (1, 2, '4.00'))
+        self.assertEqual(len(self.rollups()), 3)
+        self.assertEqual(rollup.find_drift(), [])
+
+    def test_import_skips_rows_inserted_concurrently(self):
+        """Строки, занятые параллельной вставкой после проверки дубликатов, не попадают в сводки и счётчики"""
+        sales = [self.make_sale(product_name='Груша', quantity=i + 1, price=2, sale_date=f'2025-04-0{i + 1}T12:00:00') for i in range(2)]
+        path = self.write_json('a.json', sales)
+        Sale.objects.create(
+            product_name='Груша', quantity=1, price='2.00', sale_date=datetime(2025, 4, 1, 12, tzinfo=dt_timezone.utc),
+            customer_name=sales[0]['customer_name'], customer_email=sales[0]['customer_email'],
+        )
+        with mock.patch.object(importer, '_existing_keys', return_value=set()):
+            result = importer.import_file(path)
+        self.assertEqual((result.inserted, result.duplicates), (1, 1))
+        self.assertEqual(self.rollups(), {('2025-04-02', 'Груша'): (1, 2, '4.00')})
+
+    def test_rebuild_command_checks_and_fixes_drift(self):
+        """rebuild_rollup --check находит расхождения, без флага пересобирает сводки"""
+        Sale.objects.create(
+            product_name='Груша', quantity=2, price='3.00', sale_date=datetime(2025, 5, 1, 12, tzinfo=dt_timezone.utc),
+            customer_name='Клиент', customer_email='pear@example.com',
+        )
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollup', '--check', stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_rollup', stdout=out)
+        self.assertIn('Rebuilt 1 rollup rows.', out.getvalue())
+        call_command('rebuild_rollup', '--check', stdout=StringIO())
+        self.assertEqual(self.rollups(), {('2025-05-01', 'Груша'): (1, 2, '6.00')})
+
+
+class RequestMetricsTest(TempUploadDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.reset_metrics()
+        self.addCleanup(metrics.reset_metrics)
+
+    def samples(self):
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode('utf-8').splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_index_metrics(self):
+        """Для index учитываются SQL, разобранные файлы, записи и рендеринг шаблона"""
+        self.write_json('a.json', [self.make_sale(), self.make_sale()])
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        samples = self.samples()
+        self.assertEqual(samples['sales_request_duration_seconds_count{view="index"}'], 2)
+        self.assertEqual(samples['sales_files_parsed_sum{view="index"}'], 1)
+        # Второй запрос отдан из кэша ответов: файлы и записи не читаются заново.
+        self.assertEqual(samples['sales_records_scanned_sum{view="index"}'], 2)
+        self.assertGreater(samples['sales_sql_queries_sum{view="index"}'], 0)
+        self.assertGreater(samples['sales_template_render_seconds_sum{view="index"}'], 0)
+        self.assertEqual(samples['sales_sql_queries_bucket{view="index",le="+Inf"}'], 2)
+
+    async def test_async_middleware_counts_sql(self):
+        """Под ASGI метрики собираются без перевода запроса в поток"""
+        self.write_json('a.json', [self.make_sale()])
+        await self.async_client.get(reverse('index'))
+        samples = await sync_to_async(self.samples)()
+        self.assertEqual(samples['sales_files_parsed_sum{view="index"}'], 1)
+        self.assertGreater(samples['sales_sql_queries_sum{view="index"}'], 0)
+
+    async def test_async_middleware_records_off_event_loop(self):
+        """Под ASGI запись в общий файл метрик идёт не в потоке цикла событий"""
+        loop_thread = threading.get_ident()
+        threads = []
+        real_add = metrics._SharedValues.add
+
+        def add(values, increments):
+            threads.append(threading.get_ident())
+            real_add(values, increments)
+
+        with self.settings(SALES_METRICS_DIR=os.path.join(self.upload_dir, 'metrics')), \
+                mock.patch.object(metrics._SharedValues, 'add', add):
+            await self.async_client.get(reverse('search_sales'))
+            response = await self.async_client.get(reverse('search_sales'), {'format': 'ndjson'})
+            self.assertTrue(response.is_async)
+            [chunk async for chunk in response.streaming_content]
+            self.assertEqual(len(threads), 2)
+            self.assertNotIn(loop_thread, threads)
+            samples = await sync_to_async(self.samples)()
+        self.assertEqual(samples['sales_request_duration_seconds_count{view="search_sales"}'], 2)
+
+    def test_slow_request_is_logged(self):
+        """Запрос дольше порога попадает в лог и счётчик медленных"""
+        with self.settings(SALES_SLOW_REQUEST_SECONDS=1e-9), self.assertLogs('sales_data.metrics', 'WARNING') as logs:
+            self.client.get(reverse('search_sales'))
+        self.assertIn('Slow request GET /search_sales/', logs.output[0])
+        self.assertEqual(self.samples()['sales_slow_requests_total{view="search_sales"}'], 1)
+
+    def test_streaming_response_counted_when_closed(self):
+        """Работа потокового ответа учитывается при отдаче тела, запрос — когда поток закрыт"""
+        for day in (1, 2, 3):
+            Sale.objects.create(
+                product_name='Груша', quantity=1, price=2, sale_date=datetime(2025, 5, day, tzinfo=dt_timezone.utc),
+                customer_name='Клиент', customer_email=f'{day}@example.com',
+            )
+        response = self.client.get(reverse('export_sales'), {'format': 'csv'})
+        self.assertNotIn('sales_sql_queries_count{view="export_sales"}', self.samples())
+        b''.join(response.streaming_content)
+        samples = self.samples()
+        self.assertEqual(samples['sales_sql_queries_count{view="export_sales"}'], 1)
+        self.assertGreater(samples['sales_sql_queries_sum{view="export_sales"}'], 0)
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'fork is required')
+    def test_shared_store_sums_workers(self):
+        """С SALES_METRICS_DIR /metrics/ отдаёт сумму по всем процессам-воркерам"""
+        with self.settings(SALES_METRICS_DIR=os.path.join(self.upload_dir, 'metrics')):
+            metrics.reset_metrics()
+            self.client.get(reverse('search_sales'))
+            context = multiprocessing.get_context('fork')
+            workers = [context.Process(target=metrics.REQUEST_SECONDS.observe, args=('search_sales', 0.5))
+                       for _ in range(2)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join(30)
+            self.assertEqual([worker.exitcode for worker in workers], [0, 0])
+            samples = self.samples()
+        self.assertEqual(samples['sales_request_duration_seconds_count{view="search_sales"}'], 3)
+        self.assertGreaterEqual(samples['sales_request_duration_seconds_sum{view="search_sales"}'], 1.0)
+        self.assertEqual(samples['sales_sql_queries_count{view="search_sales"}'], 1)
+
+
+class AsyncStreamingTest(TestCase):
+    async def test_aiter_sync_yields_lazily_and_closes(self):
+        """aiter_sync берёт куски по одному и закрывает генератор, если поток бросили"""
+        taken = []
+        closed = []
+
+        def parts():
+            try:
+                for i in range(100):
+                    taken.append(i)
+                    yield b'x'
+            finally:
+                closed.append(True)
+
+        stream = streaming.aiter_sync(parts())
+        self.assertEqual(await anext(stream), b'x')
+        self.assertEqual(len(taken), 1)
+        await stream.aclose()
+        self.assertEqual(closed, [True])
+
+    async def test_static_files_stream_asynchronously(self):
+        """Под ASGI WhiteNoise отдаёт файл асинхронным итератором, блоками"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        data = os.urandom(300 * 1024)
+        with open(os.path.join(directory, 'app.js'), 'wb') as f:
+            f.write(data)
+
+        async def get_response(request):
+            raise AssertionError('static file expected')
+
+        middleware = WhiteNoiseMiddleware(get_response)
+        middleware.add_files(directory, prefix='static/')
+        response = await middleware(RequestFactory().get('/static/app.js'))
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response]
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), data)
+        await sync_to_async(response.close)()
+
+
+class BenchmarkTest(TestCase):
+    def test_percentile(self):
+        """Процентиль по ближайшему рангу"""
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 0.5), 50)
+        self.assertEqual(benchmark.percentile(values, 0.99), 99)
+        self.assertEqual(benchmark.percentile([7], 0.95), 7)
+        self.assertIsNone(benchmark.percentile([], 0.5))
+
+    def test_run_reports_all_scenarios(self):
+        """Прогон на маленьких данных даёт отчёт по всем сценариям без ошибок"""
+        report = benchmark.run(files=4, records_per_file=3, db_rows=5, iterations=2, warmup=0)
+        json.dumps(report)
+        self.assertEqual(report['config']['file_sales'], 8)
+        self.assertEqual(set(report['scenarios']), set(benchmark.SCENARIOS))
+        for name, result in report['scenarios'].items():
+            self.assertEqual(result['iterations'], 2, name)
+            self.assertEqual(result['errors'], 0, name)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertEqual(Sale.objects.filter(product_name__startswith='Новая продажа').count(), 2)
@@ -0,0 +1,137 @@
+"""
+Постоянное хранилище разобранных продаж каталога uploads/.
+
+Процесс ``manage.py watch_uploads`` разбирает новые и изменённые файлы в
+фоне и кладёт их продажи сюда: по строке на продажу, значения уже
+приведены к типам (даты хранятся в ISO 8601). Для каждого файла
+запоминаются (mtime, size) на момент разбора.
+
+Кэш файлов читает продажи отсюда вместо разбора JSON/XML, если (mtime,
+size) файла совпадают с сохранёнными; иначе файл разбирается как обычно,
+поэтому устаревшее хранилище или остановленный наблюдатель не дают
+неверных данных, а только медленнее первый запрос.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from .dates import DateParser
+from .models import SaleData
+
+
+STORE_FILENAME = '.sales_store.sqlite3'
+
+# Столбцы продаж без объявленного типа: SQLite сохраняет значения как есть,
+# и строка, не приведённая к числу при разборе, остаётся строкой.
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS store_files ('
+    ' filename TEXT PRIMARY KEY,'
+    ' format TEXT NOT NULL,'
+    ' mtime_ns INTEGER NOT NULL,'
+    ' size INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS store_sales ('
+    ' filename TEXT NOT NULL,'
+    ' position INTEGER NOT NULL,'
+    ' id, product_name, quantity, price, sale_date, customer_name, customer_email,'
+    ' PRIMARY KEY (filename, position))',
+)
+
+
+def _stored_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class UploadStore:
+    """Хранилище продаж файлов одного каталога (SQLite-файл в самом каталоге)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, STORE_FILENAME)
+        self._local = threading.local()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _connect(self):
+        # Соединение своё у каждого потока: представления читают из пула потоков.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def files(self):
+        """Словарь filename → (mtime_ns, size) сохранённых файлов."""
+        rows = self._connect().execute('SELECT filename, mtime_ns, size FROM store_files')
+        return {filename: (mtime_ns, size) for filename, mtime_ns, size in rows}
+
+    def stat(self, filename):
+        """(mtime_ns, size) файла на момент сохранения или None."""
+        return self._connect().execute(
+            'SELECT mtime_ns, size FROM store_files WHERE filename = ?', (filename,),
+        ).fetchone()
+
+    def load(self, filename, mtime_ns, size):
+        """Продажи файла или None, если файла нет в хранилище или он с тех пор изменился."""
+        # Одним запросом: наблюдатель может перезаписать файл между двумя чтениями.
+        sales = [SaleData(*row) for row in self._connect().execute(
+            'SELECT s.id, s.product_name, s.quantity, s.price, s.sale_date, s.customer_name, s.customer_email '
+            'FROM store_sales s JOIN store_files f ON f.filename = s.filename '
+            'WHERE s.filename = ? AND f.mtime_ns = ? AND f.size = ? ORDER BY s.position',
+            (filename, mtime_ns, size),
+        )]
+        if not sales and self.stat(filename) != (mtime_ns, size):
+            return None
+        dates = DateParser().parse_many([sale.sale_date for sale in sales])
+        for sale, sale_date in zip(sales, dates):
+            sale.sale_date = sale_date
+        return sales
+
+    def save(self, filename, fmt, mtime_ns, size, records):
+        """Заменяет сохранённые продажи файла."""
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM store_sales WHERE filename = ?', (filename,))
+            conn.execute(
+                'INSERT OR REPLACE INTO store_files VALUES (?, ?, ?, ?)', (filename, fmt, mtime_ns, size),
+            )
+            conn.executemany(
+                'INSERT INTO store_sales VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (filename, position) + tuple(_stored_value(getattr(r, f)) for f in SaleData.FIELDS)
+                    for position, r in enumerate(records)
+                ),
+            )
+
+    def remove(self, filename):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM store_sales WHERE filename = ?', (filename,))
+            conn.execute('DELETE FROM store_files WHERE filename = ?', (filename,))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store_for(directory):
+    """UploadStore каталога, если хранилище в нём уже создано, иначе None."""
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            store = UploadStore(directory)
+            if not store.exists():
+                return None
+            _stores[directory] = store
+        return store
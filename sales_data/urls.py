@@ -8,8 +8,12 @@ urlpatterns = [
     path('upload_file/', views.upload_file, name='upload_file'),
     path('download/<str:filename>/', views.download_file, name='download_file'),
     path('delete/<str:filename>/', views.delete_file, name='delete_file'),
+    path('import/<str:filename>/', views.import_file, name='import_file'),
     path('delete_sale/<str:sale_id>/', views.delete_sale, name='delete_sale'),
     path('search_sales/', views.search_sales, name='search_sales'),
+    path('export/', views.export_sales, name='export_sales'),
+    path('analytics/', views.sales_analytics, name='sales_analytics'),
+    path('metrics/', views.metrics_view, name='metrics'),
     path('edit_sale/<uuid:sale_id>/', views.edit_sale, name='edit_sale'),
     path('delete_db_sale/<uuid:sale_id>/', views.delete_db_sale, name='delete_db_sale'),
     path('edit_file_sale/<str:sale_id>/', views.edit_file_sale, name='edit_file_sale'),
@@ -1,165 +1,220 @@
+import asyncio
+import copy
+import itertools
 import os
 import json
+import threading
 import xml.etree.ElementTree as ET
 from datetime import datetime
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse
+from django.template.loader import render_to_string
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.conf import settings
-from django.db.models import Q
+from django.db import transaction
 from django.contrib import messages
+import tempfile
 import uuid
 from .forms import SaleForm, SaleEditForm, FileSaleForm
-from .models import SaleData, Sale
+from .models import SaleData, SaleDataJSONEncoder, Sale
+from . import (
+    analytics, columnar, compressed, data_version, downloads, exporter, file_writer, importer, metrics, parallel,
+    response_cache, rollup, segments, shards,
+)
+from .file_cache import file_cache, file_format
+from .streaming import UploadLimitExceeded, abuffered, aiter_sync, buffered, iter_file_records, record_parser
+from .sale_index import SaleLocationIndex
+from .pagination import InvalidPageRequest, Page, apaginate, parse_page_request
 
 UPLOAD_DIR = os.path.join(settings.BASE_DIR, 'uploads')
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-def index(request):
+def _sale_index():
+    return SaleLocationIndex(UPLOAD_DIR)
+
+def _data_changed():
+    """Делает устаревшими закэшированные ответы index и search_sales во всех воркерах."""
+    data_version.bump(UPLOAD_DIR)
+
+def _file_etag(st, encoding=None):
+    """Сильный ETag файла: любая запись меняет inode (замена) или mtime (правка на месте)."""
+    suffix = f'-{encoding}' if encoding else ''
+    return f'"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}{suffix}"'
+
+def _with_etag(response, etag):
+    response['ETag'] = etag
+    # Last-Modified не отдаём: правки на месте в пределах секунды он не различает.
+    # Браузер переспрашивает сервер при каждом обращении и получает 304, пока данные те же.
+    patch_cache_control(response, no_cache=True)
+    return response
+
+def _not_modified(request, etag):
+    """Ответ 304 (или 412) на условный запрос, если ``etag`` совпал; иначе None."""
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        _with_etag(response, etag)
+    return response
+
+def _find_file_sale(sale_id):
+    """Ищет продажу по id; возвращает (CachedFile, запись) или (None, None)."""
+    index = _sale_index()
+    location = index.lookup(sale_id)
+    if location is not None:
+        filepath = shards.locate(UPLOAD_DIR, location.filename)
+        cached = file_cache.get(filepath) if filepath is not None else None
+        if cached is not None:
+            records = cached.records
+            if location.position < len(records) and records[location.position].id == sale_id:
+                return cached, records[location.position]
+            for item in records:
+                if item.id == sale_id:
+                    return cached, item
+    
+    # Индекс отстал (например, файл положили вручную). Файлы старше последней
+    # пересборки индекс покрывает, поэтому разбираем только более новые и
+    # дописываем в индекс найденный.
+    rebuilt_at = index.rebuilt_at()
+    for file in file_cache.listing(UPLOAD_DIR):
+        if file.stat.st_mtime_ns < rebuilt_at:
+            continue
+        cached = file_cache.lookup(file, scan=True)
+        for item in cached.records:
+            if item.id == sale_id:
+                index.index_file(cached.filename, cached.format, cached.records)
+                return cached, item
+    return None, None
+
+def _change_file_sale(sale_id, cached, change):
+    """
+    Применяет ``change(cached)`` к файлу с продажей; возвращает (CachedFile, результат).
+
+    Если файл, пока мы ждали его блокировку, слили в новый сегмент
+    (segments.compact), продажа ищется заново по индексу и правка повторяется там.
+    """
+    try:
+        return cached, change(cached)
+    except FileNotFoundError:
+        file_cache.invalidate(cached.path)
+        moved, _ = _find_file_sale(sale_id)
+        if moved is None or moved.path == cached.path:
+            return cached, None
+        return moved, change(moved)
+
+def _update_file_sale(cached, sale_id, data):
+    if cached.format == 'ndjson':
+        segments.supersede(cached.path, data)
+        return True
+    if cached.format == 'json':
+        return file_writer.update_json_record(cached.path, sale_id, data)
+    return file_writer.update_xml_record(cached.path, sale_id, data)
+
+def _delete_file_sale(cached, sale_id):
+    if cached.format == 'ndjson':
+        segments.delete(cached.path, sale_id)
+        return True
+    if cached.format == 'json':
+        return file_writer.delete_json_record(cached.path, sale_id) is not None
+    return file_writer.delete_xml_record(cached.path, sale_id) is not None
+
+async def _scan_files():
+    """CachedFile всех файлов uploads/; разбор идёт параллельно в пуле потоков."""
+    return [cached async for cached in file_cache.aiter_scan(UPLOAD_DIR)]
+
+async def _list_files(after):
+    """Страница имён файлов uploads/ после курсора ``after`` и курсор следующей (см. shards.page_files)."""
+    limit = getattr(settings, 'SALES_FILE_LIST_SIZE', 200)
+    entries, next_cursor = await asyncio.to_thread(shards.page_files, UPLOAD_DIR, after, limit)
+    return [entry.name for entry in entries], next_cursor
+
+async def _paginate_sales(page, query, source):
+    """
+    Страница продаж из выбранных источников (см. pagination.apaginate).
+
+    Запрос к БД идёт, пока файлы разбираются. В режиме разбора процессами
+    (parallel.enabled()) файлы ищутся через parallel.search_files.
+    """
+    query_cf = query.casefold() if query else ''
+    
+    async def file_records():
+        if parallel.enabled():
+            return await asyncio.to_thread(parallel.search_files, UPLOAD_DIR, query_cf)
+        try:
+            entries = await _scan_files()
+        except Exception:
+            # Продажи из БД нужны, даже если каталог прочитать не удалось.
+            entries = []
+        return (item for cached in entries for item in cached.records if item.matches(query_cf))
+    
+    records = file_records() if source in ('file', 'all') else None
+    queryset = Sale.objects.search(query) if source in ('database', 'all') else None
+    return await apaginate(page, queryset=queryset, records=records)
+
+CSRF_PLACEHOLDER = '__SALES_CSRF_TOKEN__'
+INDEX_CACHE_PARAMS = ('q', 'source', 'sort', 'limit', 'cursor', 'files_after')
+SEARCH_CACHE_PARAMS = ('q', 'source', 'sort', 'limit', 'cursor')
+
+async def _render_index(request):
+    """HTML главной страницы и признак того, что его можно кэшировать (не было ошибок)."""
+    failed = False
     sales_from_files = []
     sales_from_db = []
     all_sales = []
     
     search_query = request.GET.get('q', '')
-    search_query_cf = search_query.casefold() if search_query else ''
 
     source = request.GET.get('source', 'all')
     
-    def _parse_date(value):
-        if not value:
-            return value
-        if isinstance(value, datetime):
-            return value
-        try:
-            return datetime.fromisoformat(value)
-        except Exception:
-            pass
-        formats = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%d.%m.%Y %H:%M']
-        for fmt in formats:
-            try:
-                return datetime.strptime(value, fmt)
-            except Exception:
-                continue
-        return value
+    try:
+        page = parse_page_request(request.GET)
+    except InvalidPageRequest as e:
+        messages.error(request, str(e))
+        failed = True
+        page = parse_page_request({})
 
+    files_after = request.GET.get('files_after', '')
+    listing = asyncio.ensure_future(_list_files(files_after))
+    paginated = asyncio.ensure_future(_paginate_sales(page, search_query, source))
     json_files = []
     xml_files = []
+    segment_files = []
+    next_files_cursor = None
     try:
-        json_files = [f for f in os.listdir(UPLOAD_DIR) if f.endswith('.json')]
-        xml_files = [f for f in os.listdir(UPLOAD_DIR) if f.endswith('.xml')]
-        
-        for filename in json_files:
-            filepath = os.path.join(UPLOAD_DIR, filename)
-            with open(filepath, 'r', encoding='utf-8') as f:
-                try:
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        for item in data:
-                            if 'sale_date' in item and isinstance(item['sale_date'], str):
-                                try:
-                                    item['sale_date'] = datetime.fromisoformat(item['sale_date'])
-                                except ValueError:
-                                    item['sale_date'] = _parse_date(item.get('sale_date'))
-                            
-                            if not search_query or (
-                                search_query_cf in str(item.get('product_name', '') or '').casefold() or
-                                search_query_cf in str(item.get('customer_name', '') or '').casefold() or
-                                search_query_cf in str(item.get('customer_email', '') or '').casefold()
-                            ):
-                                item['source'] = 'file'
-                                sales_from_files.append(item)
-                    elif isinstance(data, dict):
-                        if 'sale_date' in data and isinstance(data['sale_date'], str):
-                            try:
-                                data['sale_date'] = datetime.fromisoformat(data['sale_date'])
-                            except ValueError:
-                                data['sale_date'] = _parse_date(data.get('sale_date'))
-                        
-                        if not search_query or (
-                            search_query_cf in str(data.get('product_name', '') or '').casefold() or
-                            search_query_cf in str(data.get('customer_name', '') or '').casefold() or
-                            search_query_cf in str(data.get('customer_email', '') or '').casefold()
-                        ):
-                            data['source'] = 'file'
-                            sales_from_files.append(data)
-                except json.JSONDecodeError:
-                    pass
-        
-        for filename in xml_files:
-            filepath = os.path.join(UPLOAD_DIR, filename)
-            try:
-                tree = ET.parse(filepath)
-                root = tree.getroot()
-                
-                if root.tag == 'sale':
-                    sale_data = {}
-                    for child in root:
-                        if child.tag == 'sale_date' or child.tag == 'date' or child.tag == 'created_at':
-                            sale_data[child.tag] = _parse_date(child.text)
-                        else:
-                            sale_data[child.tag] = child.text
-                    
-                    if 'sale_date' in sale_data and isinstance(sale_data['sale_date'], str):
-                        sale_data['sale_date'] = _parse_date(sale_data['sale_date'])
-                    
-                    if not search_query or (
-                        search_query_cf in str(sale_data.get('product_name', '') or '').casefold() or
-                        search_query_cf in str(sale_data.get('customer_name', '') or '').casefold() or
-                        search_query_cf in str(sale_data.get('customer_email', '') or '').casefold()
-                    ):
-                        sale_data['source'] = 'file'
-                        sales_from_files.append(sale_data)
-                else:
-                    for sale_elem in root.findall('sale'):
-                        sale_data = {}
-                        for child in sale_elem:
-                            if child.tag == 'sale_date' or child.tag == 'date' or child.tag == 'created_at':
-                                sale_data[child.tag] = _parse_date(child.text)
-                            else:
-                                sale_data[child.tag] = child.text
-                        
-                        if 'sale_date' in sale_data and isinstance(sale_data['sale_date'], str):
-                            sale_data['sale_date'] = _parse_date(sale_data['sale_date'])
-                        
-                        if not search_query or (
-                            search_query_cf in str(sale_data.get('product_name', '') or '').casefold() or
-                            search_query_cf in str(sale_data.get('customer_name', '') or '').casefold() or
-                            search_query_cf in str(sale_data.get('customer_email', '') or '').casefold()
-                        ):
-                            sale_data['source'] = 'file'
-                            sales_from_files.append(sale_data)
-            except ET.ParseError:
-                pass
+        filenames, next_files_cursor = await listing
+        for filename in filenames:
+            fmt = file_format(filename)
+            if fmt == 'json':
+                json_files.append(filename)
+            elif fmt == 'xml':
+                xml_files.append(filename)
+            else:
+                segment_files.append(filename)
     except Exception as e:
         messages.error(request, f"Error reading files: {str(e)}")
+        failed = True
     
+    next_cursor = None
     try:
-        db_sales = Sale.objects.all()
-        if search_query:
-            db_sales = [s for s in db_sales if (
-                search_query_cf in (s.product_name or '').casefold() or
-                search_query_cf in (s.customer_name or '').casefold() or
-                search_query_cf in (s.customer_email or '').casefold()
-            )]
+        result = await paginated
+        next_cursor = result.next_cursor
         
-        for sale in db_sales:
-            sale_dict = sale.to_dict()
-            try:
-                sale_dict['sale_date'] = sale.sale_date
-            except Exception:
-                pass
-            sale_dict['source'] = 'database'
-            sales_from_db.append(sale_dict)
+        for item_source, item in result.items:
+            if item_source == 'database':
+                sales_from_db.append(item)
+            else:
+                sales_from_files.append(item)
+            all_sales.append(item)
     except Exception as e:
-        messages.error(request, f"Error reading database: {str(e)}")
+        messages.error(request, f"Error reading sales: {str(e)}")
+        failed = True
     
-    if source == 'database':
-        all_sales = sales_from_db
-    elif source == 'file':
-        all_sales = sales_from_files
-    else:
-        all_sales = sales_from_files + sales_from_db
-    
-    return render(request, 'sales_data/index.html', {
+    current_sort = f"-{page.field}" if page.descending else page.field
+    # Рендерим без запроса: вместо CSRF-токена — заглушка, которую index заменяет
+    # токеном каждого запроса, поэтому готовый HTML можно отдавать всем.
+    html = await sync_to_async(render_to_string)('sales_data/index.html', {
+        'csrf_token': CSRF_PLACEHOLDER,
         'form': SaleForm(),
         'all_sales': all_sales,
         'sales_from_files': sales_from_files,
@@ -167,8 +222,26 @@ def index(request):
         'search_query': search_query,
         'json_files': json_files,
         'xml_files': xml_files,
+        'segment_files': segment_files,
+        'files_after': files_after,
+        'next_files_cursor': next_files_cursor,
         'current_source': source,
+        'current_sort': current_sort,
+        'page_limit': page.limit,
+        'next_cursor': next_cursor,
+        'is_first_page': not page.positions,
     })
+    return html, not failed
+
+async def index(request):
+    version = await asyncio.to_thread(data_version.current, UPLOAD_DIR)
+    key = response_cache.cache_key('index', version, request.GET, INDEX_CACHE_PARAMS)
+    html = await response_cache.aget(key)
+    if html is None:
+        html, cacheable = await _render_index(request)
+        if cacheable:
+            await response_cache.aset(key, html)
+    return HttpResponse(html.replace(CSRF_PLACEHOLDER, get_token(request)))
 
 def add_sale(request):
     if request.method == 'POST':
@@ -195,7 +268,10 @@ def add_sale(request):
                             customer_name=form.cleaned_data['customer_name'],
                             customer_email=form.cleaned_data['customer_email']
                         )
-                        sale.save()
+                        with transaction.atomic():
+                            sale.save()
+                            rollup.apply(added=[sale])
+                        _data_changed()
                         messages.success(request, 'Sale successfully added to database.')
                 except Exception as e:
                     messages.error(request, f'Error saving to database: {str(e)}')
@@ -210,24 +286,12 @@ def add_sale(request):
                     'customer_email': form.cleaned_data['customer_email']
                 }
                 
-                format_type = request.POST.get('format', 'json')
-                
-                filename = f"sale_{uuid.uuid4().hex}.{format_type}"
-                filepath = os.path.join(UPLOAD_DIR, filename)
-                
                 try:
-                    if format_type == 'json':
-                        with open(filepath, 'w', encoding='utf-8') as f:
-                            json.dump(sale_data, f, indent=2, ensure_ascii=False)
-                    else:
-                        root = ET.Element('sale')
-                        for key, value in sale_data.items():
-                            elem = ET.SubElement(root, key)
-                            elem.text = str(value)
-                        tree = ET.ElementTree(root)
-                        tree.write(filepath, encoding='utf-8', xml_declaration=True)
-                    
-                    messages.success(request, f'Sale successfully saved to {format_type.upper()} file.')
+                    # Дописываем в общий сегмент вместо отдельного файла на каждую продажу.
+                    filename, position = segments.append(UPLOAD_DIR, sale_data)
+                    _sale_index().index_sale(sale_data['id'], filename, 'ndjson', position)
+                    _data_changed()
+                    messages.success(request, 'Sale successfully saved to file.')
                 except Exception as e:
                     messages.error(request, f'Error saving to file: {str(e)}')
             
@@ -239,6 +303,46 @@ def add_sale(request):
     
     return render(request, 'sales_data/index.html', {'form': form})
 
+def _receive_upload(uploaded_file, fmt, out):
+    """
+    Пишет загрузку в ``out`` по кускам, попутно проверяя формат и лимиты.
+
+    Возвращает число продаж; сами записи не копятся, память не зависит от файла.
+    """
+    max_bytes = getattr(settings, 'SALES_UPLOAD_MAX_BYTES', 500 * 1024 * 1024)
+    max_records = getattr(settings, 'SALES_UPLOAD_MAX_RECORDS', 1000000)
+    if uploaded_file.size is not None and uploaded_file.size > max_bytes:
+        raise UploadLimitExceeded(f'File is larger than {max_bytes} bytes.')
+
+    parser = record_parser(fmt)
+    count = 0
+    received = 0
+
+    def collect(records):
+        nonlocal count
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            if count >= max_records:
+                raise UploadLimitExceeded(f'File contains more than {max_records} sales.')
+            count += 1
+
+    for chunk in uploaded_file.chunks():
+        received += len(chunk)
+        if received > max_bytes:
+            raise UploadLimitExceeded(f'File is larger than {max_bytes} bytes.')
+        out.write(chunk)
+        collect(parser.feed(chunk))
+    collect(parser.close())
+    return count
+
+def _iter_sale_ids(path, fmt):
+    """id продаж сохранённого файла в порядке следования; файл читается потоково."""
+    with compressed.open_read(path) as f:
+        for record in iter_file_records(f, fmt):
+            if isinstance(record, dict):
+                yield record.get('id')
+
 def upload_file(request):
     if request.method == 'POST' and request.FILES.get('file'):
         uploaded_file = request.FILES['file']
@@ -247,55 +351,105 @@ def upload_file(request):
         filename = "".join(c for c in filename if c.isalnum() or c in (' ', '.', '_')).rstrip()
         filename = f"{uuid.uuid4().hex}_{filename}"
         
-        filepath = os.path.join(UPLOAD_DIR, filename)
+        fmt = file_format(filename)
+        if fmt not in ('json', 'xml') or compressed.compression_of(filename):
+            messages.error(request, 'Unsupported file format. Please upload JSON or XML files only.')
+            return redirect('index')
+        encoding = compressed.storage_compression()
+        if encoding is not None:
+            filename += compressed.SUFFIXES[encoding]
         
+        # Пишем во временный файл в том же каталоге и переименовываем только после
+        # успешной проверки, чтобы недописанный файл не попал в выборки.
+        fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, prefix='.upload-', suffix='.part')
         try:
-            file_content = uploaded_file.read()
+            with os.fdopen(fd, 'wb') as out, compressed.writer(out, encoding) as sink:
+                _receive_upload(uploaded_file, fmt, sink)
+            path = shards.path_for_write(UPLOAD_DIR, filename)
+            os.replace(tmp_path, path)
             
-            if filename.endswith('.json'):
-                json.loads(file_content.decode('utf-8'))
-            elif filename.endswith('.xml'):
-                ET.fromstring(file_content)
-            else:
-                messages.error(request, 'Unsupported file format. Please upload JSON or XML files only.')
-                return redirect('index')
-            
-            with open(filepath, 'wb') as f:
-                f.write(file_content)
+            # id не держим списком на всю загрузку: индекс читает их из сохранённого файла.
+            _sale_index().index_ids(filename, fmt, _iter_sale_ids(path, fmt))
+            _data_changed()
             
             messages.success(request, f'File {filename} uploaded successfully.')
         except (json.JSONDecodeError, ET.ParseError) as e:
-            if os.path.exists(filepath):
-                os.remove(filepath)
             messages.error(request, f'Invalid file format: {str(e)}')
+        except UploadLimitExceeded as e:
+            messages.error(request, f'File rejected: {str(e)}')
         except Exception as e:
-            if os.path.exists(filepath):
-                os.remove(filepath)
             messages.error(request, f'Error uploading file: {str(e)}')
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
     
     return redirect('index')
 
 def download_file(request, filename):
-    filepath = os.path.join(UPLOAD_DIR, filename)
+    filepath = shards.locate(UPLOAD_DIR, filename)
     
-    if not os.path.exists(filepath):
+    if filepath is None:
         messages.error(request, 'File not found.')
         return redirect('index')
     
-    if not (filename.endswith('.json') or filename.endswith('.xml')):
+    if file_format(filename) is None:
         messages.error(request, 'Invalid file type.')
         return redirect('index')
     
-    with open(filepath, 'rb') as f:
-        response = HttpResponse(f.read(), content_type='application/octet-stream')
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
+    try:
+        f, st, encoding = downloads.open_file(filepath, request.headers.get('Accept-Encoding', ''))
+    except FileNotFoundError:
+        messages.error(request, 'File not found.')
+        return redirect('index')
+    # Валидаторы берём с открытого файла: его могли заменить после locate.
+    etag = _file_etag(st, encoding)
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        f.close()
+        return not_modified
+    return _with_etag(downloads.file_response(request, f, filename, etag, encoding), etag)
+
+def import_file(request, filename):
+    """Импортирует загруженный файл в БД и возвращает счётчики в JSON."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required.'}, status=405)
+    
+    if file_format(filename) is None:
+        return JsonResponse({'error': 'Invalid file type.'}, status=400)
+    
+    filepath = shards.locate(UPLOAD_DIR, filename)
+    if filepath is None:
+        return JsonResponse({'error': 'File not found.'}, status=404)
+    
+    try:
+        result = importer.import_file(filepath)
+    except (json.JSONDecodeError, ET.ParseError) + compressed.CORRUPT_ERRORS as e:
+        return JsonResponse({'error': f'Invalid file format: {str(e)}'}, status=400)
+    
+    if result.inserted:
+        _data_changed()
+    return JsonResponse(result.as_dict())
 
 def delete_file(request, filename):
-    filepath = os.path.join(UPLOAD_DIR, filename)
+    filepath = shards.locate(UPLOAD_DIR, filename)
+    
+    if file_format(filename) is None:
+        messages.error(request, 'Invalid file type.')
+        return redirect('index')
     
-    if os.path.exists(filepath):
-        os.remove(filepath)
+    if filepath is not None:
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            # Файл успели удалить в другом воркере или слить в сегмент (segments.compact).
+            file_cache.invalidate(filepath)
+            filepath = None
+    
+    if filepath is not None:
+        downloads.remove_variant(filepath)
+        file_cache.invalidate(filepath)
+        _sale_index().remove_file(filename)
+        _data_changed()
         messages.success(request, f'File {filename} deleted successfully.')
     else:
         messages.error(request, 'File not found.')
@@ -305,177 +459,292 @@ def delete_file(request, filename):
 def delete_sale(request, sale_id):
     deleted = False
     try:
-        for filename in os.listdir(UPLOAD_DIR):
-            if filename.endswith('.json'):
-                filepath = os.path.join(UPLOAD_DIR, filename)
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        if isinstance(data, dict) and data.get('id') == sale_id:
-                            os.remove(filepath)
-                            deleted = True
-                            break
-                        elif isinstance(data, list):
-                            for i, sale in enumerate(data):
-                                if isinstance(sale, dict) and sale.get('id') == sale_id:
-                                    data.pop(i)
-                                    with open(filepath, 'w', encoding='utf-8') as f_out:
-                                        json.dump(data, f_out, indent=2, ensure_ascii=False)
-                                    
-                                    deleted = True
-                                    break
-                except (json.JSONDecodeError, IOError):
-                    pass
-        
-        for filename in os.listdir(UPLOAD_DIR):
-            if filename.endswith('.xml'):
-                filepath = os.path.join(UPLOAD_DIR, filename)
-                try:
-                    tree = ET.parse(filepath)
-                    root = tree.getroot()
-                    id_elem = root.find('id')
-                    if root.tag == 'sale' and id_elem is not None and id_elem.text == sale_id:
-                        os.remove(filepath)
-                        deleted = True
-                    else:
-                        for sale_elem in root.findall('sale'):
-                            id_elem = sale_elem.find('id')
-                            if id_elem is not None and id_elem.text == sale_id:
-                                root.remove(sale_elem)
-                                tree.write(filepath, encoding='utf-8', xml_declaration=True)
-                                deleted = True
-                except (ET.ParseError, IOError):
-                    pass
+        cached, _ = _find_file_sale(sale_id)
+        if cached is not None:
+            cached, deleted = _change_file_sale(
+                sale_id, cached, lambda target: _delete_file_sale(target, sale_id),
+            )
+            filepath = cached.path
+            file_cache.invalidate(filepath)
+            if cached.format == 'ndjson':
+                # Остальные записи сегмента остаются на своих местах.
+                _sale_index().remove_sale(sale_id)
+            else:
+                # Позиции последующих записей сдвинулись — переиндексируем файл целиком.
+                remaining = file_cache.get(filepath)
+                if remaining is not None:
+                    _sale_index().index_file(remaining.filename, remaining.format, remaining.records)
+                else:
+                    _sale_index().remove_file(cached.filename)
     except Exception as e:
         messages.error(request, f'Error deleting sale: {str(e)}')
     
     if deleted:
+        _data_changed()
         messages.success(request, 'Sale deleted successfully.')
     else:
         messages.error(request, 'Sale not found.')
     
     return redirect('index')
 
-def search_sales(request):
-    query = request.GET.get('q', '')
-    source = request.GET.get('source', 'all')
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json-stream': 'application/json',
+}
+
+def _iter_search_results(query, source):
+    """Генератор результатов поиска: файлы через кэш, затем БД через серверный курсор."""
     query_cf = query.casefold() if query else ''
+    if source in ('file', 'all') and parallel.enabled():
+        for batch in parallel.iter_search_files(UPLOAD_DIR, query_cf):
+            yield from batch
+    elif source in ('file', 'all'):
+        for cached in file_cache.iter_scan(UPLOAD_DIR):
+            for item in cached.records:
+                if item.matches(query_cf):
+                    yield item
+    if source in ('database', 'all'):
+        chunk_size = getattr(settings, 'SALES_STREAM_CHUNK_SIZE', 2000)
+        rows = Sale.objects.search(query).values_list(*SaleData.FIELDS)
+        for row in rows.iterator(chunk_size=chunk_size):
+            yield SaleData.from_row(row)
 
-    results = []
+def _stream_search_results(query, source, stream_format):
+    encoder = SaleDataJSONEncoder(ensure_ascii=False)
+    sales = _iter_search_results(query, source)
+    if stream_format == 'ndjson':
+        return buffered(encoder.encode(item) + '\n' for item in sales)
+    
+    def json_array():
+        yield '{"sales": ['
+        for i, item in enumerate(sales):
+            yield (',' if i else '') + encoder.encode(item)
+        yield ']}'
+    return buffered(json_array())
 
-    def matches(item):
-        if not query_cf:
-            return True
-        return (
-            query_cf in str(item.get('product_name', '') or '').casefold() or
-            query_cf in str(item.get('customer_name', '') or '').casefold() or
-            query_cf in str(item.get('customer_email', '') or '').casefold()
-        )
+async def _aiter_search_results(query, source):
+    """
+    Асинхронный генератор результатов поиска: файлы и БД читаются одновременно.
+
+    Файлы разбираются в пуле потоков, строки БД читаются пачками серверного курсора;
+    пачки записей выдаются в порядке поступления через ограниченную очередь.
+    """
+    query_cf = query.casefold() if query else ''
+    chunk_size = getattr(settings, 'SALES_STREAM_CHUNK_SIZE', 2000)
+    queue = asyncio.Queue(maxsize=4)
+    done = object()
     
-    def _parse_date(value):
-        if not value:
-            return value
-        if isinstance(value, datetime):
-            return value
-        try:
-            return datetime.fromisoformat(value)
-        except Exception:
-            pass
-        formats = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%d.%m.%Y %H:%M']
-        for fmt in formats:
+    async def files():
+        if parallel.enabled():
+            # Генератор двигаем в потоке по пачке; закрываем под той же блокировкой,
+            # чтобы не закрыть его, пока поток ещё внутри next().
+            batches = parallel.iter_search_files(UPLOAD_DIR, query_cf)
+            lock = threading.Lock()
+            
+            def step():
+                with lock:
+                    return next(batches, None)
+            
+            def close():
+                with lock:
+                    batches.close()
+            
             try:
-                return datetime.strptime(value, fmt)
-            except Exception:
-                continue
-        return value
-
-    if source in ('file', 'all'):
+                while (batch := await asyncio.to_thread(step)) is not None:
+                    await queue.put(batch)
+            finally:
+                asyncio.get_running_loop().run_in_executor(None, close)
+            return
+        async for cached in file_cache.aiter_scan(UPLOAD_DIR):
+            matched = [item for item in cached.records if item.matches(query_cf)]
+            if matched:
+                await queue.put(matched)
+    
+    async def database():
+        # aiterator() у values_list выполняет запрос прямо в цикле событий,
+        # поэтому серверный курсор читаем пачками через sync_to_async сами.
+        rows = Sale.objects.search(query).values_list(*SaleData.FIELDS).iterator(chunk_size=chunk_size)
+        fetch = sync_to_async(lambda: [SaleData.from_row(row) for row in itertools.islice(rows, chunk_size)])
         try:
-            for filename in os.listdir(UPLOAD_DIR):
-                filepath = os.path.join(UPLOAD_DIR, filename)
-                if filename.endswith('.json'):
-                    try:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                        if isinstance(data, list):
-                            for item in data:
-                                if isinstance(item, dict) and matches(item):
-                                    item_copy = dict(item)
-                                    item_copy['source'] = 'file'
-                                    results.append(item_copy)
-                        elif isinstance(data, dict):
-                            if matches(data):
-                                data_copy = dict(data)
-                                data_copy['source'] = 'file'
-                                results.append(data_copy)
-                    except (json.JSONDecodeError, IOError):
-                        continue
-                elif filename.endswith('.xml'):
-                    try:
-                        tree = ET.parse(filepath)
-                        root = tree.getroot()
-
-                        if root.tag == 'sale':
-                            sale_data = {}
-                            for child in root:
-                                if child.tag == 'sale_date' or child.tag == 'date' or child.tag == 'created_at':
-                                    sale_data[child.tag] = _parse_date(child.text)
-                                else:
-                                    sale_data[child.tag] = child.text
-                            
-                            if 'sale_date' in sale_data and isinstance(sale_data['sale_date'], str):
-                                sale_data['sale_date'] = _parse_date(sale_data['sale_date'])
-                            
-                            if matches(sale_data):
-                                sale_data['source'] = 'file'
-                                results.append(sale_data)
-                        else:
-                            for sale_elem in root.findall('sale'):
-                                sale_data = {}
-                                for child in sale_elem:
-                                    if child.tag == 'sale_date' or child.tag == 'date' or child.tag == 'created_at':
-                                        sale_data[child.tag] = _parse_date(child.text)
-                                    else:
-                                        sale_data[child.tag] = child.text
-                                
-                                if 'sale_date' in sale_data and isinstance(sale_data['sale_date'], str):
-                                    sale_data['sale_date'] = _parse_date(sale_data['sale_date'])
-                                
-                                if matches(sale_data):
-                                    sale_data['source'] = 'file'
-                                    results.append(sale_data)
-                    except (ET.ParseError, IOError):
-                        continue
-        except Exception:
-            pass
-
-    if source in ('database', 'all'):
+            while True:
+                batch = await fetch()
+                if batch:
+                    await queue.put(batch)
+                if len(batch) < chunk_size:
+                    break
+        finally:
+            # Закрытие генератора закрывает серверный курсор, в том же потоке, что и чтение:
+            # иначе при отключении клиента курсор остался бы открытым до сборки мусора.
+            await sync_to_async(rows.close)()
+    
+    async def produce(producer):
         try:
-            db_qs = Sale.objects.all()
-            if query_cf:
-                db_qs = [s for s in db_qs if (
-                    query_cf in (s.product_name or '').casefold() or
-                    query_cf in (s.customer_name or '').casefold() or
-                    query_cf in (s.customer_email or '').casefold()
-                )]
-
-            for s in db_qs:
-                d = s.to_dict()
-                try:
-                    d['sale_date'] = s.sale_date.isoformat()
-                except Exception:
-                    pass
-                d['source'] = 'database'
-                results.append(d)
-        except Exception:
-            pass
+            await producer()
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(done)
+    
+    producers = []
+    if source in ('file', 'all'):
+        producers.append(asyncio.create_task(produce(files)))
+    if source in ('database', 'all'):
+        producers.append(asyncio.create_task(produce(database)))
+    try:
+        running = len(producers)
+        while running:
+            batch = await queue.get()
+            if batch is done:
+                running -= 1
+            elif isinstance(batch, Exception):
+                raise batch
+            else:
+                for item in batch:
+                    yield item
+    finally:
+        for task in producers:
+            task.cancel()
+        # Дожидаемся, пока производители закроют курсор и генератор файлов.
+        await asyncio.gather(*producers, return_exceptions=True)
+
+def _astream_search_results(query, source, stream_format):
+    encoder = SaleDataJSONEncoder(ensure_ascii=False)
+    sales = _aiter_search_results(query, source)
+    
+    async def ndjson():
+        async for item in sales:
+            yield encoder.encode(item) + '\n'
+    
+    async def json_array():
+        yield '{"sales": ['
+        first = True
+        async for item in sales:
+            yield ('' if first else ',') + encoder.encode(item)
+            first = False
+        yield ']}'
+    return abuffered(ndjson() if stream_format == 'ndjson' else json_array())
+
+async def search_sales(request):
+    query = request.GET.get('q', '')
+    source = request.GET.get('source', 'all')
 
-    return JsonResponse({'sales': results})
+    # Потоковые форматы отдают все найденные продажи без пагинации и сортировки;
+    # память воркера и время до первого байта не зависят от размера результата.
+    stream_format = request.GET.get('format')
+    if stream_format in STREAM_FORMATS:
+        # Под WSGI Django собрал бы асинхронный итератор целиком в память,
+        # поэтому там остаётся синхронный генератор.
+        stream = _astream_search_results if isinstance(request, ASGIRequest) else _stream_search_results
+        return StreamingHttpResponse(
+            stream(query, source, stream_format),
+            content_type=STREAM_FORMATS[stream_format],
+        )
+
+    version = await asyncio.to_thread(data_version.current, UPLOAD_DIR)
+    etag = response_cache.etag('search', version, request.GET, SEARCH_CACHE_PARAMS)
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    key = response_cache.cache_key('search', version, request.GET, SEARCH_CACHE_PARAMS)
+    content = await response_cache.aget(key)
+    if content is not None:
+        return _with_etag(HttpResponse(content, content_type='application/json'), etag)
+
+    cacheable = True
+    try:
+        page = parse_page_request(request.GET)
+        result = await _paginate_sales(page, query, source)
+    except InvalidPageRequest as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception:
+        result = Page([], None)
+        cacheable = False
+
+    results = [item for _, item in result.items]
+    response = JsonResponse({'sales': results, 'next_cursor': result.next_cursor}, encoder=SaleDataJSONEncoder)
+    if cacheable:
+        await response_cache.aset(key, response.content)
+        _with_etag(response, etag)
+    return response
+
+def export_sales(request):
+    """Потоковая выгрузка продаж из БД: format=json|xml|csv, gzip=1, q, date_from, date_to."""
+    fmt = request.GET.get('format', 'json')
+    if fmt not in exporter.CONTENT_TYPES:
+        return JsonResponse({'error': f'Unsupported format: {fmt}'}, status=400)
+    compress = request.GET.get('gzip') in ('1', 'true')
+    try:
+        date_from = exporter.parse_bound(request.GET.get('date_from'))
+        date_to = exporter.parse_bound(request.GET.get('date_to'), end=True)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    queryset = exporter.export_queryset(request.GET.get('q', ''), date_from, date_to)
+    filename = f"sales_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    if compress:
+        filename += '.gz'
+    
+    content = exporter.iter_export(queryset, fmt, compress=compress)
+    if isinstance(request, ASGIRequest):
+        # Под ASGI синхронный поток был бы собран в список целиком. Серверный
+        # курсор привязан к соединению потока запроса, поэтому куски берутся в нём.
+        content = aiter_sync(content, thread_sensitive=True)
+    response = StreamingHttpResponse(
+        content,
+        content_type='application/gzip' if compress else exporter.CONTENT_TYPES[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def sales_analytics(request):
+    """Выручка и количество по продукту, клиенту или периоду из БД и файлов."""
+    group_by = request.GET.get('group_by', 'day')
+    if group_by not in analytics.GROUPINGS:
+        return JsonResponse({'error': f'Unsupported group_by: {group_by}'}, status=400)
+    source = request.GET.get('source', 'all')
+    query = request.GET.get('q', '')
+    try:
+        date_from = exporter.parse_bound(request.GET.get('date_from'))
+        date_to = exporter.parse_bound(request.GET.get('date_to'), end=True)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    parts = []
+    if source in ('database', 'all') and analytics.can_use_rollups(query, group_by, date_from, date_to):
+        parts.append(analytics.aggregate_rollups(group_by, date_from, date_to))
+    elif source in ('database', 'all'):
+        queryset = Sale.objects.search(query)
+        if date_from is not None:
+            queryset = queryset.filter(sale_date__gte=date_from)
+        if date_to is not None:
+            queryset = queryset.filter(sale_date__lt=date_to)
+        parts.append(analytics.aggregate_queryset(queryset, group_by))
+    if source in ('file', 'all'):
+        query_cf = query.casefold() if query else ''
+        if analytics.uses_default_timezone():
+            snapshot = columnar.snapshots.get(UPLOAD_DIR)
+            parts.append(snapshot.aggregate(group_by, query_cf, date_from, date_to))
+        else:
+            records = (
+                item for cached in file_cache.iter_scan(UPLOAD_DIR)
+                for item in cached.records if item.matches(query_cf)
+            )
+            parts.append(analytics.aggregate_records(records, group_by, date_from, date_to))
+    
+    results = analytics.merge(*parts)
+    totals = {
+        'count': sum(row['count'] for row in results),
+        'quantity': sum(row['quantity'] for row in results),
+        'revenue': round(sum(row['revenue'] for row in results), 2),
+    }
+    return JsonResponse({'group_by': group_by, 'source': source, 'results': results, 'totals': totals})
 
 def edit_sale(request, sale_id):
     sale = get_object_or_404(Sale, id=sale_id)
     
     if request.method == 'POST':
+        # Форма меняет экземпляр при проверке, старые значения нужны для сводок.
+        previous = copy.copy(sale)
         form = SaleEditForm(request.POST, instance=sale)
         if form.is_valid():
             existing_sale = Sale.objects.filter(
@@ -487,7 +756,10 @@ def edit_sale(request, sale_id):
             if existing_sale:
                 messages.warning(request, 'A sale with the same product, customer email, and date already exists.')
             else:
-                form.save()
+                with transaction.atomic():
+                    form.save()
+                    rollup.apply(added=[sale], removed=[previous])
+                _data_changed()
                 messages.success(request, 'Sale updated successfully.')
                 return redirect('index')
     else:
@@ -497,90 +769,22 @@ def edit_sale(request, sale_id):
 
 def delete_db_sale(request, sale_id):
     sale = get_object_or_404(Sale, id=sale_id)
-    sale.delete()
+    with transaction.atomic():
+        sale.delete()
+        rollup.apply(removed=[sale])
+    _data_changed()
     messages.success(request, 'Sale deleted successfully.')
     return redirect('index')
 
 def edit_file_sale(request, sale_id):
     sale_data = None
-    sale_file_path = None
-    file_format = None
-    
-    def _parse_date(value):
-        if not value:
-            return value
-        if isinstance(value, datetime):
-            return value
-        try:
-            return datetime.fromisoformat(value)
-        except Exception:
-            pass
-        formats = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%d.%m.%Y %H:%M']
-        for fmt in formats:
-            try:
-                return datetime.strptime(value, fmt)
-            except Exception:
-                continue
-        return value
     
-    for filename in os.listdir(UPLOAD_DIR):
-        if filename.endswith('.json'):
-            filepath = os.path.join(UPLOAD_DIR, filename)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if isinstance(data, dict) and data.get('id') == sale_id:
-                        sale_data = data
-                        sale_file_path = filepath
-                        file_format = 'json'
-                        break
-                    elif isinstance(data, list):
-                        for sale in data:
-                            if isinstance(sale, dict) and sale.get('id') == sale_id:
-                                sale_data = sale
-                                sale_file_path = filepath
-                                file_format = 'json'
-                                break
-                        if sale_data:
-                            break
-            except (json.JSONDecodeError, IOError):
-                pass
+    cached, record = _find_file_sale(sale_id)
+    if cached is not None:
+        # Записи кэша общие для всех запросов — работаем с копией.
+        sale_data = record.to_dict()
     
     if not sale_data:
-        for filename in os.listdir(UPLOAD_DIR):
-            if filename.endswith('.xml'):
-                filepath = os.path.join(UPLOAD_DIR, filename)
-                try:
-                    tree = ET.parse(filepath)
-                    root = tree.getroot()
-                    
-                    def xml_to_dict(elem):
-                        result = {}
-                        for child in elem:
-                            result[child.tag] = child.text
-                        return result
-                    
-                    if root.tag == 'sale':
-                        data = xml_to_dict(root)
-                        if data.get('id') == sale_id:
-                            sale_data = data
-                            sale_file_path = filepath
-                            file_format = 'xml'
-                            break
-                    else:
-                        for sale_elem in root.findall('sale'):
-                            data = xml_to_dict(sale_elem)
-                            if data.get('id') == sale_id:
-                                sale_data = data
-                                sale_file_path = filepath
-                                file_format = 'xml'
-                                break
-                        if sale_data:
-                            break
-                except (ET.ParseError, IOError):
-                    pass
-    
-    if not sale_data or not sale_file_path:
         messages.error(request, 'Sale not found.')
         return redirect('index')
     
@@ -602,55 +806,27 @@ def edit_file_sale(request, sale_id):
             }
             
             try:
-                if file_format == 'json':
-                    with open(sale_file_path, 'r', encoding='utf-8') as f:
-                        file_data = json.load(f)
-                        
-                    if isinstance(file_data, dict):
-                        file_data = updated_data
-                    else:
-                        for i, item in enumerate(file_data):
-                            if item.get('id') == sale_id:
-                                file_data[i] = updated_data
-                                break
-                    
-                    with open(sale_file_path, 'w', encoding='utf-8') as f:
-                        json.dump(file_data, f, indent=2, ensure_ascii=False)
-                else:
-                    tree = ET.parse(sale_file_path)
-                    root = tree.getroot()
-                    
-                    def update_xml_element(elem, data):
-                        for key, value in data.items():
-                            child = elem.find(key)
-                            if child is None:
-                                child = ET.SubElement(elem, key)
-                            child.text = str(value)
-                    
-                    if root.tag == 'sale':
-                        update_xml_element(root, updated_data)
-                    else:
-                        for sale_elem in root.findall('sale'):
-                            id_elem = sale_elem.find('id')
-                            if id_elem is not None and id_elem.text == sale_id:
-                                update_xml_element(sale_elem, updated_data)
-                                break
-                    
-                    tree.write(sale_file_path, encoding='utf-8', xml_declaration=True)
-                
+                cached, found = _change_file_sale(
+                    sale_id, cached, lambda target: _update_file_sale(target, sale_id, updated_data),
+                )
+                file_cache.invalidate(cached.path)
+                if not found:
+                    # Продажу успели удалить или перенести в другом воркере.
+                    messages.error(request, 'Sale not found.')
+                    return redirect('index')
+                _data_changed()
                 messages.success(request, 'Sale updated successfully.')
                 return redirect('index')
             except Exception as e:
                 messages.error(request, f'Error updating sale: {str(e)}')
     else:
-        if isinstance(sale_data.get('sale_date'), str):
-            try:
-                date_obj = datetime.fromisoformat(sale_data['sale_date'])
-            except ValueError:
-                date_obj = _parse_date(sale_data['sale_date'])
-            
-            sale_data['sale_date'] = date_obj.strftime('%Y-%m-%dT%H:%M')
+        if isinstance(sale_data.get('sale_date'), datetime):
+            sale_data['sale_date'] = sale_data['sale_date'].strftime('%Y-%m-%dT%H:%M')
         
         form = FileSaleForm(initial=sale_data)
     
-    return render(request, 'sales_data/edit_file_sale.html', {'form': form, 'sale_id': sale_id})
\ No newline at end of file
+    return render(request, 'sales_data/edit_file_sale.html', {'form': form, 'sale_id': sale_id})
+
+def metrics_view(request):
+    """Метрики запросов в текстовом формате Prometheus."""
+    return HttpResponse(metrics.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
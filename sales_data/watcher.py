@@ -0,0 +1,286 @@
+"""
+Фоновый разбор каталога uploads/ для ``manage.py watch_uploads``.
+
+UploadWatcher сверяет каталог с хранилищем upload_store: новые и
+изменённые файлы разбираются и сохраняются, удалённые выбрасываются;
+индекс мест продаж (sale_index) обновляется там же, поэтому подхватываются
+и файлы, положенные вручную или через ``docker cp``.
+
+В Linux изменения приходят через inotify (ctypes, без зависимостей): под
+наблюдением корень каталога и каталоги-шарды (см. shards), новые шарды
+добавляются по мере появления. На других системах, если inotify недоступен
+или кончился лимит наблюдений (fs.inotify.max_user_watches), каталог
+опрашивается раз в ``interval`` секунд. Полная сверка выполняется и при
+старте, и после переполнения очереди событий inotify, и раз в ``resync``
+секунд. Раз в ``compact_interval`` секунд наблюдатель сжимает сегменты
+(segments.compact). Найдя изменения, наблюдатель увеличивает версию данных
+(data_version), чтобы кэш ответов не отдавал прежние страницы.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import sqlite3
+import struct
+import sys
+import time
+
+from .file_cache import parse_sale_file
+from . import data_version, segments
+from .sale_index import SaleLocationIndex
+from .shards import file_format, is_shard_name, iter_entries, locate
+from .upload_store import UploadStore
+
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+# Корень и шарды первого уровня: ещё и появление подкаталогов.
+PARENT_MASK = WATCH_MASK | IN_CREATE
+SHARD_DEPTH = 2
+
+_EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    """Минимальная обёртка над inotify для каталога и его шардов."""
+
+    def __init__(self, directory):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}
+        try:
+            self._root = self._watch(directory, 0)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    @classmethod
+    def available(cls):
+        return sys.platform.startswith('linux')
+
+    def _watch(self, path, depth):
+        """Подписывается на каталог глубины ``depth`` и его шарды; возвращает wd каталога."""
+        mask = PARENT_MASK if depth < SHARD_DEPTH else WATCH_MASK
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f'inotify_add_watch failed for {path}: {os.strerror(errno)}')
+        self._dirs[wd] = (path, depth)
+        if depth < SHARD_DEPTH:
+            with os.scandir(path) as it:
+                subdirs = [entry.path for entry in it if is_shard_name(entry.name) and entry.is_dir()]
+            for subdir in subdirs:
+                self._watch(subdir, depth + 1)
+        return wd
+
+    def _added(self, path, depth):
+        """Подписывается на новый шард; возвращает имена уже лежащих в нём файлов."""
+        self._watch(path, depth)
+        # Файлы могли появиться до подписки, событий о них не будет.
+        names = set()
+        for _, _, filenames in os.walk(path):
+            names.update(filename for filename in filenames if file_format(filename))
+        return names
+
+    def read(self, timeout):
+        """
+        Имена изменившихся файлов за ``timeout`` секунд (множество).
+
+        None — события потеряны (переполнение очереди или каталог удалён или
+        перемещён), нужна полная сверка.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if wd == self._root:
+                    return None
+                continue
+            parent, depth = self._dirs.get(wd, (None, 0))
+            if mask & IN_ISDIR:
+                if parent is not None and depth < SHARD_DEPTH and is_shard_name(name) \
+                        and mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        names |= self._added(os.path.join(parent, name), depth + 1)
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        # Например, ENOSPC: исчерпан fs.inotify.max_user_watches. Файлы этого
+                        # шарда подхватит полная сверка (сейчас и раз в resync секунд).
+                        logger.warning('Cannot watch %s (%s)', os.path.join(parent, name), e)
+                        return None
+                continue
+            # Созданный файл ещё пишут: ждём IN_CLOSE_WRITE.
+            if name and not mask & IN_CREATE:
+                names.add(name)
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class UploadWatcher:
+    """Поддерживает хранилище и индекс продаж каталога в актуальном состоянии."""
+
+    def __init__(self, directory, interval=2.0, debounce=0.2, resync=300.0, compact_interval=0):
+        self.directory = directory
+        self.interval = interval
+        self.debounce = debounce
+        self.resync = resync
+        self.compact_interval = compact_interval
+        self.store = UploadStore(directory)
+        self.index = SaleLocationIndex(directory)
+
+    def sync_file(self, filename):
+        """
+        Сверяет один файл с хранилищем.
+
+        Возвращает 'updated', 'removed' или None, если ничего не изменилось.
+        """
+        fmt = file_format(filename)
+        if fmt is None:
+            return None
+        path = locate(self.directory, filename)
+        try:
+            st = os.stat(path) if path is not None else None
+        except FileNotFoundError:
+            st = None
+        known = self.store.stat(filename)
+        if st is None:
+            if known is None:
+                return None
+            self.store.remove(filename)
+            self.index.remove_file(filename)
+            return 'removed'
+        if known == (st.st_mtime_ns, st.st_size):
+            return None
+        records = parse_sale_file(path, fmt)
+        self.store.save(filename, fmt, st.st_mtime_ns, st.st_size, records)
+        self.index.index_file(filename, fmt, records)
+        return 'updated'
+
+    def sync(self):
+        """Полная сверка каталога; возвращает (обновлено файлов, удалено файлов)."""
+        known = self.store.files()
+        on_disk = set()
+        updated = removed = 0
+        for entry in iter_entries(self.directory):
+            on_disk.add(entry.name)
+            if self.sync_file(entry.name) == 'updated':
+                updated += 1
+        for filename in known.keys() - on_disk:
+            if self.sync_file(filename) == 'removed':
+                removed += 1
+        if updated or removed:
+            data_version.bump(self.directory)
+        return updated, removed
+
+    def _apply(self, names):
+        changed = False
+        for filename in sorted(names):
+            change = self.sync_file(filename)
+            if change is not None:
+                changed = True
+                logger.info('%s %s', change.capitalize(), filename)
+        if changed:
+            data_version.bump(self.directory)
+
+    def run(self, use_inotify=True, should_stop=lambda: False):
+        """Следит за каталогом, пока ``should_stop()`` не вернёт True."""
+        # Подписываемся до первой сверки, чтобы не потерять файлы, появившиеся во время неё.
+        inotify = None
+        if use_inotify and Inotify.available():
+            try:
+                inotify = Inotify(self.directory)
+            except OSError as e:
+                logger.warning('inotify unavailable (%s), falling back to polling', e)
+        try:
+            updated, removed = self.sync()
+            logger.info('Initial sync: %d files updated, %d removed', updated, removed)
+            logger.info('Watching %s (%s)', self.directory,
+                        'inotify' if inotify else f'polling every {self.interval}s')
+            last_sync = last_compact = time.monotonic()
+            while not should_stop():
+                try:
+                    last_sync = self._step(inotify, last_sync)
+                    if self.compact_interval and time.monotonic() - last_compact >= self.compact_interval:
+                        self.compact()
+                        last_compact = time.monotonic()
+                except (OSError, sqlite3.Error):
+                    # Например, хранилище заблокировано или файл недоступен: повторим позже.
+                    logger.exception('Sync failed, retrying in %ss', self.interval)
+                    time.sleep(self.interval)
+        finally:
+            if inotify is not None:
+                inotify.close()
+            self.store.close()
+
+    def _step(self, inotify, last_sync):
+        """Одна итерация наблюдения; возвращает время последней полной сверки."""
+        if inotify is None:
+            time.sleep(self.interval)
+            self._log_sync(*self.sync())
+            return last_sync
+        names = inotify.read(self.interval)
+        if names is None or time.monotonic() - last_sync >= self.resync:
+            self._log_sync(*self.sync())
+            return time.monotonic()
+        if not names:
+            return last_sync
+        # Файл часто пишут несколькими вызовами: ждём, пока события стихнут.
+        while True:
+            more = inotify.read(self.debounce)
+            if not more:
+                break
+            names |= more
+        if more is None:
+            self._log_sync(*self.sync())
+            return time.monotonic()
+        self._apply(names)
+        return last_sync
+
+    def compact(self):
+        """Сжимает сегменты каталога; хранилище догонит изменения при следующей сверке."""
+        merged, dropped = segments.compact(self.directory, self.index)
+        if merged:
+            data_version.bump(self.directory)
+            logger.info('Compacted %d files, dropped %d records', merged, dropped)
+        return merged, dropped
+
+    def _log_sync(self, updated, removed):
+        if updated or removed:
+            logger.info('Sync: %d files updated, %d removed', updated, removed)
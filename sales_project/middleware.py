@@ -0,0 +1,42 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+from sales_data.streaming import aiter_sync
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """
+    WhiteNoise, который умеет работать в асинхронной цепочке middleware.
+
+    Исходный middleware только синхронный: под ASGI Django из-за него
+    выполнял бы все запросы, включая асинхронные представления, в потоке.
+    Статика по-прежнему отдаётся синхронным кодом WhiteNoise, но в пуле потоков,
+    а тело файла читается блоками через aiter_sync — без этого Django под ASGI
+    прочитал бы файл в память целиком до отправки первого байта.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            response = await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+            if response.streaming and not response.is_async:
+                response.streaming_content = aiter_sync(response.streaming_content)
+            return response
+        return await self.get_response(request)
@@ -30,7 +30,10 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     # WhiteNoise should be placed directly after SecurityMiddleware to serve
     # static files efficiently in production (Render, PythonAnywhere, etc.).
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # Подкласс с поддержкой асинхронной цепочки для запуска под ASGI (uvicorn).
+    'sales_project.middleware.WhiteNoiseMiddleware',
+    # Метрики запросов к sales_data для /metrics и лог медленных запросов.
+    'sales_data.metrics.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -43,7 +46,8 @@ ROOT_URLCONF = 'sales_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с учётом времени рендеринга в метриках запроса.
+        'BACKEND': 'sales_data.metrics.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'sales_data' / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -89,6 +93,26 @@ else:
         }
     }
 
+# Кэш ответов index и search_sales (см. sales_data/response_cache.py). По умолчанию —
+# в памяти воркера с вытеснением давно не использованных; для общего кэша воркеров
+# можно указать, например, django.core.cache.backends.filebased.FileBasedCache
+# и каталог в SALES_RESPONSE_CACHE_LOCATION.
+SALES_RESPONSE_CACHE = 'sales_responses'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    SALES_RESPONSE_CACHE: {
+        'BACKEND': os.environ.get('SALES_RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('SALES_RESPONSE_CACHE_LOCATION', 'sales-responses'),
+        # Страховка от изменений мимо приложения без запущенного watch_uploads.
+        'TIMEOUT': int(os.environ.get('SALES_RESPONSE_CACHE_TIMEOUT', '300')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('SALES_RESPONSE_CACHE_MAX_ENTRIES', '500')),
+        },
+    },
+}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -130,5 +154,51 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/uploads/'
 MEDIA_ROOT = os.environ.get('MEDIA_ROOT', str(BASE_DIR / 'uploads'))
 
+# Кэш разобранных файлов из uploads/ (отдельный в каждом процессе-воркере).
+# Ограничивает память числом файлов и суммарным числом продаж; вытеснение LRU.
+SALES_FILE_CACHE_MAX_FILES = int(os.environ.get('SALES_FILE_CACHE_MAX_FILES', '10000'))
+SALES_FILE_CACHE_MAX_RECORDS = int(os.environ.get('SALES_FILE_CACHE_MAX_RECORDS', '200000'))
+
+# Число потоков, в которых асинхронные index и search_sales читают и разбирают файлы.
+SALES_FILE_PARSE_WORKERS = int(os.environ.get('SALES_FILE_PARSE_WORKERS', '4'))
+
+# Разбор uploads/ в нескольких процессах для поиска: число процессов (0 или 1 —
+# выключено) и минимальный суммарный размер изменившихся файлов, с которого он включается.
+SALES_PARSE_PROCESSES = int(os.environ.get('SALES_PARSE_PROCESSES', '0'))
+SALES_PARALLEL_PARSE_MIN_BYTES = int(os.environ.get('SALES_PARALLEL_PARSE_MIN_BYTES', str(32 * 1024 * 1024)))
+
+# Продажи, добавленные формой в файл, дописываются в NDJSON-сегменты; новый сегмент
+# начинается по достижении размера в байтах или возраста в секундах.
+SALES_SEGMENT_MAX_BYTES = int(os.environ.get('SALES_SEGMENT_MAX_BYTES', str(8 * 1024 * 1024)))
+SALES_SEGMENT_MAX_AGE = int(os.environ.get('SALES_SEGMENT_MAX_AGE', '3600'))
+
+# JSON-списки от этого размера (в байтах) правятся на месте по смещению записи, а не переписываются.
+SALES_INPLACE_MIN_BYTES = int(os.environ.get('SALES_INPLACE_MIN_BYTES', str(1024 * 1024)))
+
+# Число файлов в списке файлов на главной странице (дальше — по ссылке «Следующие файлы»).
+SALES_FILE_LIST_SIZE = int(os.environ.get('SALES_FILE_LIST_SIZE', '200'))
+
+# Размер страницы для index и search_sales (параметр limit ограничен сверху).
+SALES_PAGE_SIZE = int(os.environ.get('SALES_PAGE_SIZE', '50'))
+SALES_PAGE_SIZE_MAX = int(os.environ.get('SALES_PAGE_SIZE_MAX', '500'))
+
+# Размер пачки строк, которую серверный курсор БД отдаёт за раз при потоковой выдаче.
+SALES_STREAM_CHUNK_SIZE = int(os.environ.get('SALES_STREAM_CHUNK_SIZE', '2000'))
+
+# Ограничения на загружаемые файлы: размер в байтах и число продаж в файле.
+SALES_UPLOAD_MAX_BYTES = int(os.environ.get('SALES_UPLOAD_MAX_BYTES', str(500 * 1024 * 1024)))
+SALES_UPLOAD_MAX_RECORDS = int(os.environ.get('SALES_UPLOAD_MAX_RECORDS', '1000000'))
+
+# Сжатие новых загрузок в uploads/: '' — без сжатия, 'gzip' или 'zstd' (нужен пакет zstandard,
+# без него — gzip). Уже сохранённые файлы читаются при любом значении (см. sales_data/compressed.py).
+SALES_UPLOAD_COMPRESSION = os.environ.get('SALES_UPLOAD_COMPRESSION', '')
+
+# Запросы дольше этого порога (в секундах) пишутся в лог sales_data.metrics; 0 — отключить.
+SALES_SLOW_REQUEST_SECONDS = float(os.environ.get('SALES_SLOW_REQUEST_SECONDS', '1.0'))
+
+# Каталог общего для всех воркеров хранилища метрик (см. sales_data/metrics.py); пусто —
+# метрики свои у каждого процесса, что верно только для одного воркера.
+SALES_METRICS_DIR = os.environ.get('SALES_METRICS_DIR', '')
+
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
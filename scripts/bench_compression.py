@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Хранение файлов uploads/ без сжатия, в gzip и в zstd: объём и разбор.
+
+Создаёт во временном каталоге одни и те же синтетические файлы (JSON и
+XML по кругу) без сжатия и в каждом доступном сжатии (zstd — если
+установлен пакет zstandard) и для каждого варианта выводит объём на
+диске, число байт, прочитанных из файлов при разборе (rchar из
+/proc/self/io, только Linux), и лучшее время разбора всех файлов через
+parse_sale_file.
+
+Запуск:
+  python scripts/bench_compression.py [файлов] [записей_в_файле]
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sales_project.settings')
+
+import django
+
+django.setup()
+
+from sales_data import compressed, shards
+from sales_data.benchmark import _sale, _write_file
+from sales_data.file_cache import parse_sale_file
+from django.utils import timezone
+
+
+def generate(directory, files, records_per_file, encoding):
+    rng = random.Random(0)
+    moment = timezone.now()
+    n = 0
+    for i in range(files):
+        fmt = 'json' if i % 2 == 0 else 'xml'
+        sales = [_sale(rng, n + j, moment) for j in range(records_per_file)]
+        n += len(sales)
+        path = shards.path_for_write(directory, f'bench_{i:06d}.{fmt}')
+        _write_file(path, fmt, sales, single=False)
+        if encoding is not None:
+            with open(path, 'rb') as f:
+                data = compressed.compress(f.read(), encoding)
+            os.remove(path)
+            with open(path + compressed.SUFFIXES[encoding], 'wb') as f:
+                f.write(data)
+
+
+def read_chars():
+    """Байты, прочитанные процессом через read() (None, если /proc/self/io нет)."""
+    try:
+        with open('/proc/self/io', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def parse_all(entries):
+    return sum(len(parse_sale_file(entry.path, shards.file_format(entry.name))) for entry in entries)
+
+
+def timed(directory, repeat=3):
+    entries = list(shards.iter_entries(directory))
+    best = None
+    records = 0
+    read = None
+    for _ in range(repeat):
+        before = read_chars()
+        start = time.perf_counter()
+        records = parse_all(entries)
+        elapsed = time.perf_counter() - start
+        after = read_chars()
+        if before is not None and after is not None:
+            read = after - before
+        best = elapsed if best is None else min(best, elapsed)
+    return best, records, read
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    records_per_file = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    encodings = [None, compressed.GZIP]
+    if compressed.zstandard is not None:
+        encodings.append(compressed.ZSTD)
+    else:
+        print('zstandard is not installed, zstd skipped')
+
+    baseline = None
+    for encoding in encodings:
+        directory = tempfile.mkdtemp(prefix='bench_compression_')
+        try:
+            generate(directory, files, records_per_file, encoding)
+            size = sum(entry.stat().st_size for entry in shards.iter_entries(directory))
+            elapsed, records, read = timed(directory)
+            baseline = baseline or (size, elapsed)
+            read_text = f'{read / 2**20:.1f}MiB' if read is not None else 'n/a'
+            print(f'{encoding or "raw":>4}: disk={size / 2**20:.1f}MiB (x{baseline[0] / size:.1f} smaller) '
+                  f'read={read_text} parse={elapsed:.2f}s (x{elapsed / baseline[1]:.2f}) records={records}')
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
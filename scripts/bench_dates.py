@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк разбора дат: прежний parse_date против dates.DateParser.
+
+Для каждой формы даты разбирается столбец одинаковых по форме значений:
+прежней функцией, DateParser.parse по одному значению и parse_many.
+
+Запуск:
+  python scripts/bench_dates.py [значений]
+"""
+
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from sales_data.dates import DateParser
+
+
+def legacy_parse_date(value):
+    # Прежняя реализация из file_cache.py.
+    if not value:
+        return value
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except Exception:
+        pass
+    formats = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%d.%m.%Y %H:%M']
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt)
+        except Exception:
+            continue
+    return value
+
+
+SHAPES = {
+    'iso+tz': lambda d: d.isoformat() + '+00:00',
+    'iso': lambda d: d.strftime('%Y-%m-%dT%H:%M'),
+    'dotted': lambda d: d.strftime('%d.%m.%Y %H:%M'),
+    'invalid': lambda d: 'нет даты',
+}
+
+
+def timed(func, values, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(values)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    start = datetime(2025, 1, 1)
+    print(f'values={count}')
+    for name, shape in SHAPES.items():
+        values = [shape(start + timedelta(minutes=i)) for i in range(count)]
+        parser = DateParser()
+        assert parser.parse_many(values) == [legacy_parse_date(v) for v in values]
+
+        legacy = timed(lambda vs: [legacy_parse_date(v) for v in vs], values)
+        single = timed(lambda vs: [parser.parse(v) for v in vs], values)
+        batch = timed(lambda vs: DateParser().parse_many(vs), values)
+        print(f'{name:>8}: legacy={legacy / count * 1e6:.2f}us '
+              f'parse={single / count * 1e6:.2f}us parse_many={batch / count * 1e6:.2f}us '
+              f'speedup=x{legacy / batch:.1f}')
+
+
+if __name__ == '__main__':
+    main()
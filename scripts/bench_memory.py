@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Память на одну продажу: словари против SaleData (tracemalloc).
+
+Сравнивает прежнее представление записей — словарь на продажу из файла
+(с ключом 'source') и словарь из Sale.to_dict() для строки БД — с
+SaleData на __slots__. Данные синтетические, база не нужна.
+
+Запуск:
+  python scripts/bench_memory.py [строк]
+"""
+
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sales_project.settings')
+
+import django
+
+django.setup()
+
+from django.utils import timezone
+from sales_data.dates import parse_date
+from sales_data.file_cache import parse_sale_file
+from sales_data.models import Sale, SaleData
+
+
+def make_rows(rows):
+    now = timezone.now()
+    return [
+        {
+            'id': str(uuid.uuid4()),
+            'product_name': f'Продукт {i % 1000}',
+            'quantity': i % 20 + 1,
+            'price': (i % 10000) / 100 + 1,
+            'sale_date': (now - timedelta(minutes=i)).isoformat(),
+            'customer_name': f'Клиент {i}',
+            'customer_email': f'client{i}@example.com',
+        }
+        for i in range(rows)
+    ]
+
+
+def legacy_file_records(path):
+    # Прежний разбор: каждый элемент JSON остаётся словарём и получает 'source'.
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    for item in data:
+        item['sale_date'] = parse_date(item['sale_date'])
+        item['source'] = 'file'
+    return data
+
+
+def slotted_file_records(path):
+    return parse_sale_file(path, 'json')
+
+
+def db_instances(rows):
+    return [
+        Sale(
+            id=uuid.UUID(row['id']), product_name=row['product_name'], quantity=row['quantity'],
+            price=Decimal(str(row['price'])), sale_date=parse_date(row['sale_date']),
+            customer_name=row['customer_name'], customer_email=row['customer_email'],
+        )
+        for row in rows
+    ]
+
+
+def legacy_db_records(sales):
+    records = []
+    for sale in sales:
+        d = sale.to_dict()
+        d['source'] = 'database'
+        records.append(d)
+    return records
+
+
+def slotted_db_records(sales):
+    return [
+        SaleData.from_row((s.id, s.product_name, s.quantity, s.price, s.sale_date, s.customer_name, s.customer_email))
+        for s in sales
+    ]
+
+
+def measure(func, arg):
+    gc.collect()
+    tracemalloc.start()
+    result = func(arg)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def report(name, rows, legacy, slotted):
+    legacy_current, legacy_peak = legacy
+    slotted_current, slotted_peak = slotted
+    print(f'{name}: dict={legacy_current / rows:.0f} B/row (peak {legacy_peak / 2**20:.1f} MiB) '
+          f'SaleData={slotted_current / rows:.0f} B/row (peak {slotted_peak / 2**20:.1f} MiB) '
+          f'saved={(1 - slotted_current / legacy_current) * 100:.0f}%')
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    data = make_rows(rows)
+    print(f'rows={rows}')
+
+    with tempfile.NamedTemporaryFile('w', suffix='.json', encoding='utf-8', delete=False) as f:
+        json.dump(data, f, ensure_ascii=False)
+    try:
+        report('file', rows, measure(legacy_file_records, f.name), measure(slotted_file_records, f.name))
+    finally:
+        os.remove(f.name)
+
+    # Для БД учитываем только записи ответа: экземпляры модели уже в памяти.
+    sales = db_instances(data)
+    report('database', rows, measure(legacy_db_records, sales), measure(slotted_db_records, sales))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Холодный поиск по каталогу uploads/: один процесс против пула процессов.
+
+Создаёт во временном каталоге синтетические файлы (JSON и XML по кругу) и
+для каждого числа процессов ищет по ним с пустым кэшем: без запроса и с
+запросом, которому подходит малая часть записей. Выводит время и
+ускорение относительно разбора в одном процессе. Первый прогон каждого
+пула не учитывается (запуск процессов и django.setup() в них).
+
+Запуск:
+  python scripts/bench_parallel.py [файлов] [записей_в_файле] [процессы,через,запятую]
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sales_project.settings')
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from sales_data import parallel, shards
+from sales_data.benchmark import _sale, _write_file
+from sales_data.file_cache import FileRecordCache
+from django.utils import timezone
+
+
+QUERIES = {'all': '', 'selective': 'груша 7'}
+
+
+def generate(directory, files, records_per_file):
+    rng = random.Random(0)
+    moment = timezone.now()
+    n = 0
+    for i in range(files):
+        fmt = 'json' if i % 2 == 0 else 'xml'
+        sales = [_sale(rng, n + j, moment) for j in range(records_per_file)]
+        n += len(sales)
+        _write_file(shards.path_for_write(directory, f'bench_{i:06d}.{fmt}'), fmt, sales, single=False)
+
+
+def timed(directory, query_cf, repeat=3):
+    best = None
+    found = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        found = len(parallel.search_files(directory, query_cf, cache=FileRecordCache()))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, found
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    records_per_file = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    cpus = os.cpu_count() or 1
+    if len(sys.argv) > 3:
+        counts = [int(c) for c in sys.argv[3].split(',')]
+    else:
+        counts = sorted({1, 2, 4, cpus} - {0})
+
+    directory = tempfile.mkdtemp(prefix='bench_parallel_')
+    try:
+        generate(directory, files, records_per_file)
+        size = sum(entry.stat().st_size for entry in shards.iter_entries(directory))
+        print(f'files={files} records={files * records_per_file} size={size / 2**20:.1f}MiB cpus={cpus}')
+        settings.SALES_PARALLEL_PARSE_MIN_BYTES = 0
+
+        baseline = {}
+        for count in counts:
+            settings.SALES_PARSE_PROCESSES = count
+            if parallel.enabled():
+                parallel.search_files(directory, 'прогрев', cache=FileRecordCache())
+            for name, query_cf in QUERIES.items():
+                elapsed, found = timed(directory, query_cf)
+                baseline.setdefault(name, elapsed)
+                print(f'processes={count:>2} {name:>9}: {elapsed:.2f}s found={found} '
+                      f'speedup=x{baseline[name] / elapsed:.2f}')
+            parallel.shutdown()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Сравнение поиска по таблице продаж: старый фильтр в Python против SQL.
+
+Заполняет таблицу синтетическими продажами (по умолчанию 1 000 000 строк),
+замеряет оба варианта и удаляет созданные строки.
+
+Запуск:
+  python scripts/bench_search.py [строк] [запрос]
+
+Для PostgreSQL предварительно примените миграции (индексы pg_trgm).
+"""
+
+import os
+import sys
+import time
+import random
+from pathlib import Path
+from datetime import timedelta
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sales_project.settings')
+
+import django
+
+django.setup()
+
+from django.db import connection
+from django.utils import timezone
+from sales_data.models import Sale
+
+BENCH_PREFIX = 'bench-search'
+PRODUCTS = ['Яблоко', 'Банан', 'Груша', 'Apple', 'Orange', 'Laptop', 'Phone', 'Кофе', 'Чай', 'Сыр']
+
+
+def seed(rows, batch_size=10000):
+    now = timezone.now()
+    batch = []
+    for i in range(rows):
+        product = random.choice(PRODUCTS)
+        batch.append(Sale(
+            product_name=f'{BENCH_PREFIX} {product} {i}',
+            quantity=random.randint(1, 20),
+            price=random.randint(100, 100000) / 100,
+            sale_date=now - timedelta(minutes=i),
+            customer_name=f'Клиент {i % 5000}',
+            customer_email=f'client{i % 5000}@example.com',
+        ))
+        if len(batch) >= batch_size:
+            Sale.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Sale.objects.bulk_create(batch)
+
+
+def legacy_search(query):
+    query_cf = query.casefold()
+    return [s for s in Sale.objects.all() if (
+        query_cf in (s.product_name or '').casefold() or
+        query_cf in (s.customer_name or '').casefold() or
+        query_cf in (s.customer_email or '').casefold()
+    )]
+
+
+def sql_search(query):
+    return list(Sale.objects.search(query))
+
+
+def timed(func, query, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        found = len(func(query))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, found
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    queries = sys.argv[2:] or ['груша', 'laptop 4242', 'client42@']
+    print(f'vendor={connection.vendor} rows={rows}')
+    seed(rows)
+    try:
+        for query in queries:
+            legacy, legacy_found = timed(legacy_search, query, repeat=1)
+            sql, sql_found = timed(sql_search, query)
+            print(f'q={query!r}: python={legacy * 1000:.1f}ms ({legacy_found}) '
+                  f'sql={sql * 1000:.1f}ms ({sql_found}) speedup=x{legacy / sql:.1f}')
+    finally:
+        Sale.objects.filter(product_name__startswith=BENCH_PREFIX).delete()
+
+
+if __name__ == '__main__':
+    main()